@@ -11,47 +11,27 @@ from typing import (
     Callable,
     Optional,
     Iterable,
+    Iterator,
+    Tuple,
 )
 from . import subprocess_trace as subprocess
+import contextlib
 import os
-import multiprocessing
 import sys
 from .config_file import (
-    try_get_config,
-    get_config,
-    get_config_root,
+    ProjectContext,
     dump_config,
     get_path_info,
+    get_path_infos,
     resolve_test_target,
 )
-from .dtgen import run_dtgen
-from .format import run_formatter
-from .lint import run_linter
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from .verbosity import (
     add_verbosity_args,
     calculate_log_level,
 )
-from .gpu_handling import (
-    check_if_machine_supports_cuda,
-)
-from .coverage import (
-    postprocess_coverage_data,
-    view_coverage_data,
-)
-from .build import (
-    build_targets,
-)
 from .failure import fail_with_error
-from .benchmarks import (
-    call_benchmarks,
-    upload_to_bencher,
-    pretty_print_benchmark,
-)
-from .cmake import (
-    cmake_all,
-)
 import argparse
 from .targets import (
     GenericBinTarget,
@@ -70,30 +50,20 @@ from .targets import (
     parse_generic_run_target,
 )
 from .profile import (
-    profile_target,
     ProfilingTool,
-    visualize_profile,
-)
-from .testing import (
-    run_test_suites,
-    run_test_case,
-    resolve_test_case_target_using_build,
-    report_test_failure,
-    report_test_success,
 )
 from .checks import (
     Check,
-    run_check,
 )
 from .utils import (
     filtermap,
-    require_nonnull,
     get_only,
 )
 import json
-from .target_resolution import (
-    fully_resolve_run_target,
-)
+
+# editor integrations run commands like `proj root` and `proj query-path`
+# very frequently, so the subsystems each subcommand needs are imported
+# inside its main function rather than here
 
 _l = logging.getLogger(name="proj")
 
@@ -102,15 +72,21 @@ DIR = Path(__file__).resolve().parent
 STATUS_OK = 0
 STATUS_ERR = 1
 
+REGRESSION_ALPHA = 0.05
+
+# importing multiprocessing just for cpu_count() noticeably slows down startup
+DEFAULT_JOBS = os.cpu_count() or 1
+
 
 @dataclass(frozen=True)
 class MainRootArgs:
     path: Path
     verbosity: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_root(args: MainRootArgs) -> int:
-    config_root = get_config_root(args.path)
+    config_root = args.ctx.get_config_root(args.path)
     print(config_root)
     return STATUS_OK
 
@@ -119,10 +95,11 @@ def main_root(args: MainRootArgs) -> int:
 class MainConfigArgs:
     path: Path
     verbosity: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_config(args: MainConfigArgs) -> int:
-    config = get_config(args.path)
+    config = args.ctx.get_config(args.path)
     json.dump(dump_config(config), sort_keys=True, indent=2, fp=sys.stdout)
     return STATUS_OK
 
@@ -131,13 +108,46 @@ def main_config(args: MainConfigArgs) -> int:
 class MainQueryPathArgs:
     path: Path
     verbosity: int
-    file: Path
+    file: Optional[Path]
+    batch: Optional[str]
+    ctx: ProjectContext = field(default_factory=ProjectContext)
+
+
+def read_batch_paths(f: TextIO) -> Iterator[Path]:
+    for line in f:
+        line = line.rstrip("\n")
+        if line != "":
+            yield Path(line)
 
 
 def main_query_path(args: MainQueryPathArgs) -> int:
-    path_info = get_path_info(args.file)
-    json.dump(path_info.json(), sort_keys=True, indent=2, fp=sys.stdout)
-    return STATUS_OK
+    if args.batch is None:
+        if args.file is None:
+            fail_with_error("query-path requires a file or --batch")
+        assert args.file is not None
+        path_info = get_path_info(args.file, args.ctx)
+        json.dump(path_info.json(), sort_keys=True, indent=2, fp=sys.stdout)
+        return STATUS_OK
+
+    if args.file is not None:
+        fail_with_error("--batch cannot be combined with a file")
+
+    with contextlib.ExitStack() as stack:
+        if args.batch == "-":
+            f = sys.stdin
+        else:
+            f = stack.enter_context(open(args.batch))
+
+        # one record per input path, in order, so that callers can match them
+        # up without the records repeating the paths
+        result = STATUS_OK
+        for info in get_path_infos(read_batch_paths(f), args.ctx):
+            if info is None:
+                print("null", flush=True)
+                result = STATUS_ERR
+            else:
+                print(json.dumps(info.json(), sort_keys=True), flush=True)
+    return result
 
 
 def xdg_open(path: Path) -> None:
@@ -148,6 +158,21 @@ def xdg_open(path: Path) -> None:
     )
 
 
+@dataclass(frozen=True)
+class MainServeArgs:
+    path: Path
+    verbosity: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
+
+
+def main_serve(args: MainServeArgs) -> int:
+    from .server import run_server
+
+    config = args.ctx.get_config(args.path)
+    run_server(config)
+    return STATUS_OK
+
+
 @dataclass(frozen=True)
 class MainCmakeArgs:
     path: Path
@@ -155,12 +180,18 @@ class MainCmakeArgs:
     trace: bool
     dtgen_skip: bool
     verbosity: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_cmake(args: MainCmakeArgs) -> int:
-    config = get_config(args.path)
+    from .cmake import cmake_all
+    from .dtgen import is_dtgen_watch_running, run_dtgen
+
+    config = args.ctx.get_config(args.path)
 
-    if not args.dtgen_skip:
+    if not args.dtgen_skip and is_dtgen_watch_running(config.base):
+        _l.info("Skipping dtgen as `proj dtgen --watch` is running")
+    elif not args.dtgen_skip:
         run_dtgen(
             root=config.base,
             config=config,
@@ -179,10 +210,14 @@ class MainBuildArgs:
     dtgen_skip: bool
     targets: Collection[BuildTarget]
     release: bool
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_build(args: MainBuildArgs) -> int:
-    config = get_config(args.path)
+    from .build import build_targets
+    from .cmake import cmake_all
+
+    config = args.ctx.get_config(args.path)
 
     if args.release:
         build_dir = config.release_build_dir
@@ -219,11 +254,37 @@ class MainBenchmarkArgs:
     targets: Collection[Union[BenchmarkSuiteTarget, BenchmarkCaseTarget]]
     upload: bool
     browser: bool
+    pin_cores: bool
+    cores_per_suite: int
+    compare: Optional[str]
+    regression_threshold: float
+    repetitions: int
+    target_ci: Optional[float]
+    max_repetitions: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_benchmark(args: MainBenchmarkArgs) -> int:
+    from .benchmark_history import (
+        compare_benchmarks,
+        get_git_commit,
+        get_machine_key,
+        is_git_worktree_dirty,
+        load_benchmarks_for_commit,
+        open_benchmark_history,
+        pretty_print_comparisons,
+        record_benchmark_result,
+    )
+    from .benchmarks import (
+        call_benchmarks,
+        call_benchmarks_adaptive,
+        pretty_print_benchmark,
+        upload_to_bencher,
+    )
+    from .build import build_targets
+
     _l.debug("Running main_benchmark for args: %s", args)
-    config = get_config(args.path)
+    config = args.ctx.get_config(args.path)
 
     requested_benchmark_targets: List[Union[BenchmarkSuiteTarget, BenchmarkCaseTarget]]
     if len(args.targets) == 0:
@@ -253,6 +314,14 @@ def main_benchmark(args: MainBenchmarkArgs) -> int:
     if len(requested_benchmark_targets) == 0:
         fail_with_error("No benchmark targets available to run")
 
+    # resolved before doing any work, as a comparison is impossible without it
+    baseline_commit: Optional[str] = None
+    if args.compare is not None:
+        try:
+            baseline_commit = get_git_commit(config.base, args.compare)
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            fail_with_error(f"Could not resolve {args.compare} to a git commit")
+
     build_targets(
         config=config,
         targets=[t.build_target for t in requested_benchmark_targets],
@@ -262,14 +331,84 @@ def main_benchmark(args: MainBenchmarkArgs) -> int:
         build_dir=config.release_build_dir,
     )
 
-    benchmark_result = call_benchmarks(
-        requested_benchmark_targets, config.release_build_dir
-    )
+    if args.target_ci is not None:
+        benchmark_result = call_benchmarks_adaptive(
+            requested_benchmark_targets,
+            config.release_build_dir,
+            target_relative_ci=args.target_ci,
+            min_repetitions=args.repetitions,
+            max_repetitions=args.max_repetitions,
+            parallel=args.pin_cores,
+            cores_per_suite=args.cores_per_suite,
+        )
+    else:
+        benchmark_result = call_benchmarks(
+            requested_benchmark_targets,
+            config.release_build_dir,
+            parallel=args.pin_cores,
+            cores_per_suite=args.cores_per_suite,
+            repetitions=args.repetitions,
+        )
     pretty_print_benchmark(benchmark_result, f=sys.stdout)
     if args.upload:
         upload_to_bencher(config, benchmark_result, browser=args.browser)
 
-    return 0
+    # recording is best-effort so that projects outside of git (or without any
+    # commits yet) can still run benchmarks. FileNotFoundError means git itself
+    # is missing
+    git_commit: Optional[str]
+    try:
+        git_commit = get_git_commit(config.base)
+        dirty = is_git_worktree_dirty(config.base)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        _l.warning("Not recording benchmark results as HEAD is not a git commit")
+        git_commit = None
+
+    with open_benchmark_history(config.benchmark_history_path) as conn:
+        if git_commit is not None:
+            record_benchmark_result(
+                conn,
+                benchmark_result,
+                git_commit=git_commit,
+                dirty=dirty,
+            )
+
+        if baseline_commit is not None:
+            baseline = load_benchmarks_for_commit(
+                conn,
+                git_commit=baseline_commit,
+                machine=get_machine_key(benchmark_result.context),
+            )
+
+    if baseline_commit is not None:
+        if len(baseline) == 0:
+            fail_with_error(
+                f"No benchmark results recorded for {args.compare} ({baseline_commit}) on this machine. "
+                f"Run proj benchmark on a clean checkout of {args.compare} first."
+            )
+
+        comparisons = compare_benchmarks(
+            baseline, benchmark_result.benchmarks, alpha=REGRESSION_ALPHA
+        )
+        pretty_print_comparisons(
+            comparisons,
+            threshold=args.regression_threshold,
+            alpha=REGRESSION_ALPHA,
+            f=sys.stdout,
+        )
+        if any(c.is_inconclusive(args.regression_threshold) for c in comparisons):
+            _l.warning(
+                "Some benchmarks are slower than the baseline but have too few samples "
+                "to tell whether the slowdown is significant. Rerun both with more "
+                "--repetitions to check them."
+            )
+        if any(
+            c.is_regression(args.regression_threshold, REGRESSION_ALPHA)
+            for c in comparisons
+        ):
+            return STATUS_ERR
+
+    return STATUS_OK
 
 
 @dataclass(frozen=True)
@@ -287,10 +426,13 @@ class MainRunArgs:
     debug_build: bool
     skip_gpu: bool
     target_run_args: Sequence[str]
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_run(args: MainRunArgs) -> int:
-    config = get_config(args.path)
+    from .target_resolution import fully_resolve_run_target
+
+    config = args.ctx.get_config(args.path)
 
     if args.debug_build:
         build_dir = config.debug_build_dir
@@ -332,10 +474,14 @@ class MainProfileArgs:
         GenericTestCaseTarget,
     ]
     target_run_args: Sequence[str]
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_profile(args: MainProfileArgs) -> int:
-    config = get_config(args.path)
+    from .profile import profile_target, visualize_profile
+    from .target_resolution import fully_resolve_run_target
+
+    config = args.ctx.get_config(args.path)
 
     build_dir = config.release_build_dir
 
@@ -365,18 +511,38 @@ class MainTestArgs:
     coverage: bool
     verbosity: int
     jobs: int
+    cuda_jobs: int
+    shard: Optional[Tuple[int, int]]
+    batch_size: int
+    changed_since: Optional[str]
+    affected: bool
+    cache_results: bool
     dtgen_force: bool
     dtgen_skip: bool
     browser: bool
     debug: bool
     skip_gpu_tests: bool
     targets: Collection[Union[GenericTestSuiteTarget, GenericTestCaseTarget]]
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_test(args: MainTestArgs) -> int:
     assert isinstance(args, MainTestArgs)
 
-    config = get_config(args.path)
+    from .affected import get_affected_targets
+    from .build import build_targets
+    from .cmake import cmake_all
+    from .coverage import postprocess_coverage_data, view_coverage_data
+    from .gpu_handling import check_if_machine_supports_cuda
+    from .testing import (
+        report_test_failure,
+        report_test_success,
+        resolve_test_case_target_using_build,
+        run_test_case,
+        run_test_suites,
+    )
+
+    config = args.ctx.get_config(args.path)
 
     if args.coverage:
         build_dir = config.coverage_build_dir
@@ -401,6 +567,29 @@ def main_test(args: MainTestArgs) -> int:
     else:
         requested_test_targets = [resolve_test_target(config, t) for t in args.targets]
 
+    if args.affected or args.changed_since is not None:
+        if args.changed_since is not None:
+            since = args.changed_since
+        else:
+            since = "HEAD"
+        affected_targets = get_affected_targets(config, build_dir, since)
+        if affected_targets is None:
+            _l.info("All test targets are affected by changes since %s", since)
+        else:
+            requested_test_targets = [
+                t
+                for t in requested_test_targets
+                if t.build_target.name in affected_targets
+            ]
+            _l.info(
+                "Test targets affected by changes since %s: %s",
+                since,
+                requested_test_targets,
+            )
+            if len(requested_test_targets) == 0:
+                print(f"No test targets affected by changes since {since}")
+                return STATUS_OK
+
     def get_test_cases(
         x: Iterable[Any],
     ) -> List[Union[CpuTestCaseTarget, CudaTestCaseTarget, GenericTestCaseTarget]]:
@@ -521,6 +710,11 @@ def main_test(args: MainTestArgs) -> int:
             test_suites=test_suites,
             build_dir=build_dir,
             debug=args.debug,
+            jobs=args.jobs,
+            cuda_jobs=args.cuda_jobs,
+            shard=args.shard,
+            batch_size=args.batch_size,
+            use_result_cache=args.cache_results,
         )
         num_passed = len(test_statistics.passed)
         num_failed = len(test_statistics.failed)
@@ -591,10 +785,13 @@ class MainCheckArgs:
     path: Path
     check: Check
     verbosity: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_check(args: MainCheckArgs) -> int:
-    config = get_config(args.path)
+    from .checks import run_check
+
+    config = args.ctx.get_config(args.path)
 
     run_check(config, args.check, verbosity=args.verbosity)
 
@@ -607,11 +804,14 @@ class MainLintArgs:
     files: Sequence[Path]
     profile_checks: bool
     verbosity: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_lint(args: MainLintArgs) -> int:
-    root = get_config_root(args.path)
-    config = get_config(args.path)
+    from .lint import run_linter
+
+    root = args.ctx.get_config_root(args.path)
+    config = args.ctx.get_config(args.path)
     if len(args.files) == 0:
         files = None
     else:
@@ -627,10 +827,13 @@ class MainFormatArgs:
     path: Path
     files: Sequence[Path]
     verbosity: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_format(args: Any) -> int:
-    config = get_config(args.path)
+    from .format import run_formatter
+
+    config = args.ctx.get_config(args.path)
     if len(args.files) == 0:
         files = None
     else:
@@ -646,12 +849,30 @@ class MainDtgenArgs:
     path: Path
     files: Sequence[Path]
     force: bool
+    jobs: int
+    watch: bool
+    poll: bool
+    poll_interval: float
     verbosity: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_dtgen(args: MainDtgenArgs) -> int:
-    root = get_config_root(args.path)
-    config = get_config(args.path)
+    from .dtgen import run_dtgen, watch_dtgen
+
+    root = args.ctx.get_config_root(args.path)
+    config = args.ctx.get_config(args.path)
+    if args.watch:
+        if len(args.files) != 0 or args.force:
+            fail_with_error("--watch cannot be combined with --force or files")
+        watch_dtgen(
+            root=root,
+            config=config,
+            jobs=args.jobs,
+            poll=args.poll,
+            poll_interval=args.poll_interval,
+        )
+        return STATUS_OK
     if len(args.files) == 0:
         files = None
     else:
@@ -664,6 +885,7 @@ def main_dtgen(args: MainDtgenArgs) -> int:
         files=files,
         force=args.force,
         delete_outdated=True,
+        jobs=args.jobs,
     )
     return STATUS_OK
 
@@ -673,11 +895,12 @@ class MainDoxygenArgs:
     path: Path
     browser: bool
     verbosity: int
+    ctx: ProjectContext = field(default_factory=ProjectContext)
 
 
 def main_doxygen(args: MainDoxygenArgs) -> int:
-    root = get_config_root(args.path)
-    config = get_config(args.path)
+    root = args.ctx.get_config_root(args.path)
+    config = args.ctx.get_config(args.path)
 
     env = {
         **os.environ,
@@ -712,11 +935,25 @@ def main_doxygen(args: MainDoxygenArgs) -> int:
 T = TypeVar("T")
 
 
+def parse_shard(s: str) -> Tuple[int, int]:
+    pieces = s.split("/")
+    if len(pieces) != 2:
+        raise ValueError(f"Failed to parse {s=}")
+    shard_num = int(pieces[0])
+    num_shards = int(pieces[1])
+    if not (1 <= shard_num <= num_shards):
+        raise ValueError(f"Failed to parse {s=}")
+    return (shard_num - 1, num_shards)
+
+
 def make_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser()
+    p.add_argument("--trace-out", type=Path)
     subparsers = p.add_subparsers()
 
-    config = try_get_config(Path.cwd())
+    # parsing build targets needs the config, so it is loaded on demand and
+    # shared with the main function
+    ctx = ProjectContext()
 
     def set_main_signature(
         parser: argparse.ArgumentParser, func: Callable[[T], int], args_type: Type[T]
@@ -727,6 +964,7 @@ def make_parser() -> argparse.ArgumentParser:
             args_type: Type[T] = args_type,
         ) -> int:
             setattr(args, "path", Path.cwd())
+            setattr(args, "ctx", ctx)
             return func(
                 args_type(
                     **{
@@ -749,12 +987,57 @@ def make_parser() -> argparse.ArgumentParser:
 
     query_path_p = subparsers.add_parser("query-path")
     set_main_signature(query_path_p, main_query_path, MainQueryPathArgs)
-    query_path_p.add_argument("file", type=Path)
+    query_path_p.add_argument("file", type=Path, nargs="?")
+    query_path_p.add_argument(
+        "--batch",
+        metavar="LIST",
+        nargs="?",
+        const="-",
+        help="print a line of json for each path in LIST (or stdin), one path per line",
+    )
     add_verbosity_args(query_path_p)
 
+    serve_p = subparsers.add_parser("serve")
+    set_main_signature(serve_p, main_serve, MainServeArgs)
+    add_verbosity_args(serve_p)
+
     test_p = subparsers.add_parser("test")
     set_main_signature(test_p, main_test, MainTestArgs)
-    test_p.add_argument("--jobs", "-j", type=int, default=multiprocessing.cpu_count())
+    test_p.add_argument("--jobs", "-j", type=int, default=DEFAULT_JOBS)
+    test_p.add_argument(
+        "--cuda-jobs",
+        type=int,
+        default=1,
+        help="maximum number of cuda test cases to run concurrently",
+    )
+    test_p.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="only run the given shard (e.g., 2/4) of the test cases, balanced using previously recorded test durations",
+    )
+    test_p.add_argument(
+        "--changed-since",
+        metavar="REV",
+        default=None,
+        help="only run test suites affected by changes since the given git revision",
+    )
+    test_p.add_argument(
+        "--affected",
+        action="store_true",
+        help="only run test suites affected by uncommitted changes (same as --changed-since HEAD)",
+    )
+    test_p.add_argument(
+        "--cache-results",
+        action="store_true",
+        help="skip test cases that previously passed if neither the test binary nor the project libraries it links against have changed",
+    )
+    test_p.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="maximum number of test cases to run in a single test binary invocation (failures are rerun individually)",
+    )
     test_p.add_argument("--coverage", "-c", action="store_true")
     test_p.add_argument("--dtgen-force", action="store_true")
     test_p.add_argument("--dtgen-skip", action="store_true")
@@ -768,14 +1051,14 @@ def make_parser() -> argparse.ArgumentParser:
 
     build_p = subparsers.add_parser("build")
     set_main_signature(build_p, main_build, MainBuildArgs)
-    build_p.add_argument("--jobs", "-j", type=int, default=multiprocessing.cpu_count())
+    build_p.add_argument("--jobs", "-j", type=int, default=DEFAULT_JOBS)
     build_p.add_argument("--dtgen-skip", action="store_true")
     build_p.add_argument("--release", action="store_true")
     build_p.add_argument(
         "targets",
         nargs="*",
         type=lambda p: BuildTarget.from_str(
-            require_nonnull(config).configured_names, p
+            ctx.get_config(Path.cwd()).configured_names, p
         ),
     )
     add_verbosity_args(build_p)
@@ -783,18 +1066,25 @@ def make_parser() -> argparse.ArgumentParser:
     benchmark_p = subparsers.add_parser("benchmark")
     set_main_signature(benchmark_p, main_benchmark, MainBenchmarkArgs)
     benchmark_p.add_argument(
-        "--jobs", "-j", type=int, default=multiprocessing.cpu_count()
+        "--jobs", "-j", type=int, default=DEFAULT_JOBS
     )
     benchmark_p.add_argument("--dtgen-skip", action="store_true")
     benchmark_p.add_argument("--skip-gpu-benchmarks", action="store_true")
     benchmark_p.add_argument("--upload", action="store_true")
     benchmark_p.add_argument("--browser", action="store_true")
+    benchmark_p.add_argument("--pin-cores", action="store_true")
+    benchmark_p.add_argument("--cores-per-suite", type=int, default=1)
+    benchmark_p.add_argument("--compare", metavar="REV")
+    benchmark_p.add_argument("--regression-threshold", type=float, default=0.05)
+    benchmark_p.add_argument("--repetitions", type=int, default=1)
+    benchmark_p.add_argument("--target-ci", type=float)
+    benchmark_p.add_argument("--max-repetitions", type=int, default=32)
     benchmark_p.add_argument("targets", nargs="*", type=parse_generic_benchmark_target)
     add_verbosity_args(benchmark_p)
 
     run_p = subparsers.add_parser("run")
     set_main_signature(run_p, main_run, MainRunArgs)
-    run_p.add_argument("--jobs", "-j", type=int, default=multiprocessing.cpu_count())
+    run_p.add_argument("--jobs", "-j", type=int, default=DEFAULT_JOBS)
     run_p.add_argument("target", type=parse_generic_run_target)
     run_p.add_argument("--skip-gpu", action="store_true")
     run_p.add_argument("--debug-build", action="store_true")
@@ -804,7 +1094,7 @@ def make_parser() -> argparse.ArgumentParser:
     profile_p = subparsers.add_parser("profile")
     set_main_signature(profile_p, main_profile, MainProfileArgs)
     profile_p.add_argument(
-        "--jobs", "-j", type=int, default=multiprocessing.cpu_count()
+        "--jobs", "-j", type=int, default=DEFAULT_JOBS
     )
     profile_p.add_argument("--dry-run", action="store_true")
     profile_p.add_argument(
@@ -828,6 +1118,23 @@ def make_parser() -> argparse.ArgumentParser:
     dtgen_p.add_argument(
         "--force", action="store_true", help="Disable incremental toml->c++ generation"
     )
+    dtgen_p.add_argument("--jobs", "-j", type=int, default=DEFAULT_JOBS)
+    dtgen_p.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and regenerate specs as they change (builds skip dtgen while this is running)",
+    )
+    dtgen_p.add_argument(
+        "--poll",
+        action="store_true",
+        help="with --watch, poll for changes instead of using inotify",
+    )
+    dtgen_p.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="with --watch, seconds between checks for changes when polling",
+    )
     dtgen_p.add_argument("files", nargs="*", type=Path)
     add_verbosity_args(dtgen_p)
 
@@ -868,8 +1175,17 @@ def main(argv: Sequence[str]) -> int:
         level=calculate_log_level(args),
     )
 
+    trace_out: Optional[Path] = args.trace_out
+    delattr(args, "trace_out")
+
     if hasattr(args, "func") and args.func is not None:
-        result = args.func(args)
+        if trace_out is not None:
+            subprocess.start_tracing()
+        try:
+            result = args.func(args)
+        finally:
+            if trace_out is not None:
+                subprocess.write_chrome_trace(subprocess.stop_tracing(), trace_out)
         assert isinstance(result, int), result
         return result
     else:
@@ -0,0 +1,196 @@
+from pathlib import Path
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Set,
+)
+from . import subprocess_trace as subprocess
+from .config_file import (
+    ProjectConfig,
+)
+from .cmake import (
+    get_target_dependency_graph,
+)
+from .targets import (
+    LibTarget,
+)
+import json
+import logging
+import os
+import re
+import shlex
+
+_l = logging.getLogger(__name__)
+
+OBJECT_FILE_TARGET_RE = re.compile(r"CMakeFiles/(?P<target>[^/]+)\.dir/")
+
+BUILD_CONFIGURATION_FILENAMES = (
+    "CMakeLists.txt",
+    ".proj.toml",
+)
+
+
+def get_changed_files(root: Path, since: str) -> FrozenSet[Path]:
+    diffed = subprocess.check_output(
+        ["git", "diff", "--name-only", "--relative", "-z", since, "--"],
+        cwd=root,
+        env=os.environ,
+        text=True,
+    )
+    untracked = subprocess.check_output(
+        ["git", "ls-files", "--others", "--exclude-standard", "-z"],
+        cwd=root,
+        env=os.environ,
+        text=True,
+    )
+    return frozenset(
+        root / p for p in [*diffed.split("\0"), *untracked.split("\0")] if p != ""
+    )
+
+
+def _get_object_file(entry: Mapping[str, object]) -> Optional[str]:
+    output = entry.get("output")
+    if isinstance(output, str):
+        return output
+
+    command = entry.get("command")
+    if isinstance(command, str):
+        args = shlex.split(command)
+    else:
+        arguments = entry.get("arguments")
+        if not isinstance(arguments, list):
+            return None
+        args = [str(a) for a in arguments]
+
+    for flag, value in zip(args, args[1:]):
+        if flag == "-o":
+            return value
+    return None
+
+
+def load_compile_commands_targets(
+    compile_commands: Path,
+) -> Dict[Path, FrozenSet[str]]:
+    with compile_commands.open("r") as f:
+        entries = json.load(f)
+    assert isinstance(entries, list)
+
+    result: Dict[Path, Set[str]] = {}
+    for entry in entries:
+        assert isinstance(entry, dict)
+        object_file = _get_object_file(entry)
+        if object_file is None:
+            continue
+        match = OBJECT_FILE_TARGET_RE.search(object_file)
+        if match is None:
+            continue
+        file = Path(entry["directory"]) / entry["file"]
+        result.setdefault(file.resolve(), set()).add(match.group("target"))
+
+    return {k: frozenset(v) for k, v in result.items()}
+
+
+def get_target_for_path_by_layout(config: ProjectConfig, p: Path) -> Optional[str]:
+    try:
+        relpath = p.relative_to(config.base)
+    except ValueError:
+        return None
+
+    parts = relpath.parts
+    if len(parts) < 3 or parts[0] != "lib" or parts[1] not in config.lib_names:
+        return None
+
+    lib = LibTarget(parts[1])
+    if parts[2] == "test":
+        return lib.generic_test_target.build_target.name
+    elif parts[2] == "benchmark":
+        return lib.benchmark_target.build_target.name
+    else:
+        return lib.build_target.name
+
+
+def is_build_configuration_file(p: Path) -> bool:
+    return p.name in BUILD_CONFIGURATION_FILENAMES or p.suffix == ".cmake"
+
+
+def get_dependent_targets(
+    dependency_graph: Mapping[str, FrozenSet[str]],
+    targets: Iterable[str],
+) -> FrozenSet[str]:
+    dependents: Dict[str, Set[str]] = {}
+    for target, deps in dependency_graph.items():
+        for dep in deps:
+            dependents.setdefault(dep, set()).add(target)
+
+    result: Set[str] = set()
+    to_visit = list(targets)
+    while len(to_visit) > 0:
+        target = to_visit.pop()
+        if target in result:
+            continue
+        result.add(target)
+        to_visit.extend(dependents.get(target, set()))
+    return frozenset(result)
+
+
+def _get_changed_targets(
+    config: ProjectConfig,
+    changed_files: Iterable[Path],
+    file_targets: Mapping[Path, FrozenSet[str]],
+) -> Iterator[Optional[str]]:
+    for changed_file in changed_files:
+        from_compile_commands = file_targets.get(changed_file.resolve())
+        if from_compile_commands is not None:
+            yield from from_compile_commands
+            continue
+
+        from_layout = get_target_for_path_by_layout(config, changed_file)
+        if from_layout is not None:
+            yield from_layout
+        elif is_build_configuration_file(changed_file):
+            _l.info(
+                "Build configuration file %s changed, considering all targets affected",
+                changed_file,
+            )
+            yield None
+        else:
+            _l.debug("Changed file %s does not belong to any target", changed_file)
+
+
+# returns the names of the cmake targets affected by changes since the git
+# revision `since`, or None if every target should be considered affected
+def get_affected_targets(
+    config: ProjectConfig,
+    build_dir: Path,
+    since: str,
+) -> Optional[FrozenSet[str]]:
+    changed_files = get_changed_files(config.base, since)
+    _l.debug("Files changed since %s: %s", since, sorted(changed_files))
+
+    # the build being tested may be configured with different sources or
+    # targets than the debug build
+    compile_commands = build_dir / "compile_commands.json"
+    if compile_commands.is_file():
+        file_targets = load_compile_commands_targets(compile_commands)
+    else:
+        _l.info(
+            "Could not find %s, falling back to directory layout to find changed targets",
+            compile_commands,
+        )
+        file_targets = {}
+
+    changed_targets: Set[str] = set()
+    for changed_target in _get_changed_targets(config, changed_files, file_targets):
+        if changed_target is None:
+            return None
+        changed_targets.add(changed_target)
+    _l.info("Targets changed since %s: %s", since, sorted(changed_targets))
+
+    return get_dependent_targets(
+        get_target_dependency_graph(build_dir),
+        changed_targets,
+    )
@@ -0,0 +1,321 @@
+from pathlib import Path
+from typing import (
+    Dict,
+    IO,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from dataclasses import dataclass
+from . import subprocess_trace as subprocess
+from . import json
+from .benchmarks import (
+    BenchmarkContext,
+    BenchmarkResult,
+    IndividualBenchmark,
+    render_table,
+)
+import contextlib
+import hashlib
+import itertools
+import logging
+import math
+import os
+import random
+import sqlite3
+import statistics
+
+_l = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    git_commit TEXT NOT NULL,
+    dirty INTEGER NOT NULL,
+    machine TEXT NOT NULL,
+    date TEXT NOT NULL,
+    context TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_commit_and_machine ON runs (git_commit, machine);
+CREATE TABLE IF NOT EXISTS benchmarks (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    real_time REAL NOT NULL,
+    cpu_time REAL NOT NULL,
+    iterations INTEGER NOT NULL,
+    time_unit TEXT NOT NULL,
+    rest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS benchmarks_by_run ON benchmarks (run_id);
+"""
+
+TIME_UNIT_NS = {
+    "ns": 1.0,
+    "us": 1e3,
+    "ms": 1e6,
+    "s": 1e9,
+}
+
+MAX_EXACT_PERMUTATIONS = 20000
+NUM_SAMPLED_PERMUTATIONS = 10000
+
+
+def get_machine_key(context: BenchmarkContext) -> str:
+    h = hashlib.md5()
+    h.update(
+        json.dumps(
+            {
+                "host_name": context.rest.get("host_name"),
+                "num_cpus": context.num_cpus,
+                "caches": [c.to_json() for c in context.caches],
+            },
+            sort_keys=True,
+        ).encode("utf-8")
+    )
+    return h.hexdigest()
+
+
+def get_git_commit(root: Path, rev: str = "HEAD") -> str:
+    output = subprocess.check_output(
+        ["git", "rev-parse", "--verify", f"{rev}^{{commit}}"],
+        cwd=root,
+        env=os.environ,
+        text=True,
+    )
+    assert isinstance(output, str)
+    return output.strip()
+
+
+def is_git_worktree_dirty(root: Path) -> bool:
+    status = subprocess.check_output(
+        ["git", "status", "--porcelain", "--untracked-files=no"],
+        cwd=root,
+        env=os.environ,
+        text=True,
+    )
+    assert isinstance(status, str)
+    return status.strip() != ""
+
+
+@contextlib.contextmanager
+def open_benchmark_history(path: Path) -> Iterator[sqlite3.Connection]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def record_benchmark_result(
+    conn: sqlite3.Connection,
+    result: BenchmarkResult,
+    git_commit: str,
+    dirty: bool,
+) -> int:
+    cursor = conn.execute(
+        "INSERT INTO runs (git_commit, dirty, machine, date, context) VALUES (?, ?, ?, ?, ?)",
+        (
+            git_commit,
+            int(dirty),
+            get_machine_key(result.context),
+            result.context.date.isoformat(),
+            json.dumps(result.context.to_json()),
+        ),
+    )
+    run_id = cursor.lastrowid
+    assert run_id is not None
+    conn.executemany(
+        "INSERT INTO benchmarks (run_id, name, real_time, cpu_time, iterations, time_unit, rest) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                run_id,
+                b.name,
+                b.real_time,
+                b.cpu_time,
+                b.iterations,
+                b.time_unit,
+                json.dumps(b.rest),
+            )
+            for b in result.benchmarks
+        ],
+    )
+    return run_id
+
+
+def load_benchmarks_for_commit(
+    conn: sqlite3.Connection,
+    git_commit: str,
+    machine: str,
+) -> List[IndividualBenchmark]:
+    rows = conn.execute(
+        "SELECT b.name, b.real_time, b.cpu_time, b.iterations, b.time_unit, b.rest "
+        "FROM benchmarks b JOIN runs r ON b.run_id = r.id "
+        "WHERE r.git_commit = ? AND r.machine = ? AND r.dirty = 0 "
+        "ORDER BY r.id",
+        (git_commit, machine),
+    ).fetchall()
+
+    result = []
+    for name, real_time, cpu_time, iterations, time_unit, rest in rows:
+        loaded_rest = json.loads(rest)
+        assert isinstance(loaded_rest, dict)
+        result.append(
+            IndividualBenchmark(
+                name=name,
+                real_time=real_time,
+                cpu_time=cpu_time,
+                iterations=iterations,
+                time_unit=time_unit,
+                rest=loaded_rest,
+            )
+        )
+    return result
+
+
+@dataclass(frozen=True)
+class BenchmarkComparison:
+    name: str
+    baseline_ns: float
+    current_ns: float
+    num_baseline_samples: int
+    num_current_samples: int
+    p_value: Optional[float]
+
+    @property
+    def change(self) -> float:
+        return self.current_ns / self.baseline_ns - 1.0
+
+    def is_regression(self, threshold: float, alpha: float) -> bool:
+        if self.change <= threshold:
+            return False
+        return self.p_value is not None and self.p_value < alpha
+
+    # slower by more than the threshold, but with too few samples to tell
+    # whether that is more than noise
+    def is_inconclusive(self, threshold: float) -> bool:
+        return self.change > threshold and self.p_value is None
+
+
+def get_sample_ns(b: IndividualBenchmark) -> float:
+    return b.real_time * TIME_UNIT_NS[b.time_unit]
+
+
+def is_iteration_sample(b: IndividualBenchmark) -> bool:
+    return b.run_type == "iteration"
+
+
+def _group_samples(
+    benchmarks: Sequence[IndividualBenchmark],
+) -> Dict[str, List[float]]:
+    result: Dict[str, List[float]] = {}
+    for b in benchmarks:
+        if is_iteration_sample(b):
+            result.setdefault(b.name, []).append(get_sample_ns(b))
+    return result
+
+
+# one-sided permutation test of the hypothesis that `current` is slower than
+# `baseline`. returns None if there are too few samples for the test to ever
+# be significant at `alpha`
+def permutation_test_p_value(
+    baseline: Sequence[float],
+    current: Sequence[float],
+    alpha: float,
+) -> Optional[float]:
+    n = len(baseline) + len(current)
+    num_arrangements = math.comb(n, len(current))
+    if 1 / num_arrangements >= alpha:
+        return None
+
+    pooled = [*baseline, *current]
+    observed = statistics.mean(current) - statistics.mean(baseline)
+
+    def diff_for(current_indices: Sequence[int]) -> float:
+        chosen = set(current_indices)
+        c = [pooled[i] for i in chosen]
+        b = [pooled[i] for i in range(n) if i not in chosen]
+        return statistics.mean(c) - statistics.mean(b)
+
+    if num_arrangements <= MAX_EXACT_PERMUTATIONS:
+        arrangements: List[Sequence[int]] = list(
+            itertools.combinations(range(n), len(current))
+        )
+    else:
+        rng = random.Random(0)
+        arrangements = [
+            rng.sample(range(n), len(current)) for _ in range(NUM_SAMPLED_PERMUTATIONS)
+        ]
+
+    # the observed arrangement must count as at least as extreme as itself,
+    # despite the rounding error from summing in a different order
+    cutoff = observed - 1e-9 * abs(observed)
+    at_least_as_extreme = sum(1 for a in arrangements if diff_for(a) >= cutoff)
+    return at_least_as_extreme / len(arrangements)
+
+
+def compare_benchmarks(
+    baseline: Sequence[IndividualBenchmark],
+    current: Sequence[IndividualBenchmark],
+    alpha: float,
+) -> List[BenchmarkComparison]:
+    baseline_samples = _group_samples(baseline)
+    current_samples = _group_samples(current)
+
+    result = []
+    for name, current_for_name in current_samples.items():
+        baseline_for_name = baseline_samples.get(name)
+        if baseline_for_name is None:
+            _l.info("No baseline found for benchmark %s, skipping comparison", name)
+            continue
+        result.append(
+            BenchmarkComparison(
+                name=name,
+                baseline_ns=statistics.median(baseline_for_name),
+                current_ns=statistics.median(current_for_name),
+                num_baseline_samples=len(baseline_for_name),
+                num_current_samples=len(current_for_name),
+                p_value=permutation_test_p_value(
+                    baseline_for_name, current_for_name, alpha
+                ),
+            )
+        )
+    return result
+
+
+def pretty_print_comparisons(
+    comparisons: Sequence[BenchmarkComparison],
+    threshold: float,
+    alpha: float,
+    f: IO[str],
+) -> None:
+    def render_row(c: BenchmarkComparison) -> Tuple[str, str, str, str, str, str]:
+        return (
+            c.name,
+            f"{round(c.baseline_ns)} ns",
+            f"{round(c.current_ns)} ns",
+            f"{c.change:+.1%}",
+            "n/a" if c.p_value is None else f"{c.p_value:.3f}",
+            render_verdict(c),
+        )
+
+    def render_verdict(c: BenchmarkComparison) -> str:
+        if c.is_regression(threshold, alpha):
+            return "REGRESSION"
+        elif c.is_inconclusive(threshold):
+            return "INCONCLUSIVE"
+        else:
+            return ""
+
+    print(
+        render_table(
+            columns=["Benchmark", "Baseline", "Current", "Change", "p", ""],
+            data=[render_row(c) for c in comparisons],
+            sep=[1, 3, 3, 3, 3, 3],
+        ),
+        file=f,
+    )
@@ -11,13 +11,20 @@ from typing import (
     List,
     Union,
     TypeVar,
+    FrozenSet,
+    Set,
+    Callable,
 )
 from dataclasses import dataclass
+import dataclasses
 from datetime import datetime
 import statistics
+import math
 from tempfile import NamedTemporaryFile
 import logging
-import re
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from .browser import open_in_browser
 from .config_file import ProjectConfig
 from .targets import (
@@ -28,6 +35,7 @@ from pathlib import Path
 from .progressbar import (
     get_progress_manager,
     ProgressBar,
+    SynchronizedProgressBar,
 )
 
 _l = logging.getLogger(__name__)
@@ -154,6 +162,24 @@ class IndividualBenchmark:
             rest=rest,
         )
 
+    @property
+    def run_name(self) -> str:
+        run_name = self.rest.get("run_name", self.name)
+        assert isinstance(run_name, str)
+        return run_name
+
+    @property
+    def run_type(self) -> str:
+        run_type = self.rest.get("run_type", "iteration")
+        assert isinstance(run_type, str)
+        return run_type
+
+    @property
+    def aggregate_name(self) -> Optional[str]:
+        aggregate_name = self.rest.get("aggregate_name")
+        assert aggregate_name is None or isinstance(aggregate_name, str)
+        return aggregate_name
+
     def to_json(self) -> Json:
         return {
             "name": self.name,
@@ -187,6 +213,118 @@ class BenchmarkResult:
         }
 
 
+# two-sided 95% critical values of Student's t distribution, indexed by degrees
+# of freedom
+T_CRITICAL_95 = (
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+)  # fmt: skip
+
+
+def t_critical_95(degrees_of_freedom: int) -> float:
+    assert degrees_of_freedom >= 1
+    if degrees_of_freedom <= len(T_CRITICAL_95):
+        return T_CRITICAL_95[degrees_of_freedom - 1]
+    else:
+        return 1.96
+
+
+@dataclass(frozen=True)
+class BenchmarkStatistics:
+    name: str
+    time_unit: str
+    repetitions: int
+    mean: float
+    median: float
+    stddev: float
+
+    @property
+    def confidence_interval(self) -> Optional[Tuple[float, float]]:
+        if self.repetitions < 2:
+            return None
+        half_width = (
+            t_critical_95(self.repetitions - 1)
+            * self.stddev
+            / math.sqrt(self.repetitions)
+        )
+        return (self.mean - half_width, self.mean + half_width)
+
+    @property
+    def relative_ci_half_width(self) -> Optional[float]:
+        ci = self.confidence_interval
+        if ci is None or self.mean == 0:
+            return None
+        return (ci[1] - ci[0]) / 2 / self.mean
+
+    def is_precise(self, target_relative_ci: float) -> bool:
+        width = self.relative_ci_half_width
+        return width is not None and width <= target_relative_ci
+
+
+def _statistics_from_samples(
+    name: str, samples: Sequence[IndividualBenchmark]
+) -> BenchmarkStatistics:
+    times = [s.real_time for s in samples]
+    return BenchmarkStatistics(
+        name=name,
+        time_unit=samples[0].time_unit,
+        repetitions=len(times),
+        mean=statistics.mean(times),
+        median=statistics.median(times),
+        stddev=statistics.stdev(times) if len(times) >= 2 else 0.0,
+    )
+
+
+# used when only the aggregates were reported, e.g. with
+# --benchmark_report_aggregates_only
+def _statistics_from_aggregates(
+    name: str, aggregates: Sequence[IndividualBenchmark]
+) -> Optional[BenchmarkStatistics]:
+    by_aggregate_name = {a.aggregate_name: a for a in aggregates}
+    mean = by_aggregate_name.get("mean")
+    if mean is None:
+        return None
+    median = by_aggregate_name.get("median", mean)
+    stddev = by_aggregate_name.get("stddev")
+    repetitions = mean.rest.get("repetitions", 1)
+    assert isinstance(repetitions, int)
+    return BenchmarkStatistics(
+        name=name,
+        time_unit=mean.time_unit,
+        repetitions=repetitions,
+        mean=mean.real_time,
+        median=median.real_time,
+        stddev=0.0 if stddev is None else stddev.real_time,
+    )
+
+
+def summarize_benchmarks(
+    benchmarks: Sequence[IndividualBenchmark],
+) -> List[BenchmarkStatistics]:
+    samples: Dict[str, List[IndividualBenchmark]] = {}
+    aggregates: Dict[str, List[IndividualBenchmark]] = {}
+    for b in benchmarks:
+        samples.setdefault(b.run_name, [])
+        aggregates.setdefault(b.run_name, [])
+        if b.run_type == "aggregate":
+            aggregates[b.run_name].append(b)
+        else:
+            samples[b.run_name].append(b)
+
+    result = []
+    for run_name in samples.keys():
+        if len(samples[run_name]) > 0:
+            result.append(_statistics_from_samples(run_name, samples[run_name]))
+        else:
+            from_aggregates = _statistics_from_aggregates(
+                run_name, aggregates[run_name]
+            )
+            if from_aggregates is not None:
+                result.append(from_aggregates)
+    return result
+
+
 def render_table(
     columns: Sequence[str],
     data: Sequence[Sequence[str]],
@@ -257,6 +395,11 @@ def pretty_print_benchmark(benchmark: BenchmarkResult, f: IO[str]) -> None:
     (load0, load1, load2) = benchmark.context.load_avg
     line(f"Load Average: {load0:.2f}, {load1:.2f}, {load2:.2f}")
 
+    summary = summarize_benchmarks(benchmark.benchmarks)
+    if any(s.repetitions > 1 for s in summary):
+        line(render_statistics_table(summary))
+        return
+
     columns = ["Benchmark", "Time", "CPU", "Iterations"]
     sep = [1, 3, 3]
     table_data = [
@@ -272,6 +415,31 @@ def pretty_print_benchmark(benchmark: BenchmarkResult, f: IO[str]) -> None:
     line(render_table(columns=columns, data=table_data, sep=sep))
 
 
+def render_statistics_table(summary: Sequence[BenchmarkStatistics]) -> str:
+    def render_ci(s: BenchmarkStatistics) -> str:
+        width = s.relative_ci_half_width
+        if width is None:
+            return "n/a"
+        else:
+            return f"\u00b1{width:.1%}"
+
+    return render_table(
+        columns=["Benchmark", "Mean", "Median", "Stddev", "95% CI", "Reps"],
+        data=[
+            (
+                s.name,
+                f"{round(s.mean)} {s.time_unit}",
+                f"{round(s.median)} {s.time_unit}",
+                f"{round(s.stddev)} {s.time_unit}",
+                render_ci(s),
+                str(s.repetitions),
+            )
+            for s in summary
+        ],
+        sep=[1, 3, 3, 3, 3, 3],
+    )
+
+
 def list_benchmarks(
     benchmark_binaries: Sequence[Union[BenchmarkSuiteTarget, BenchmarkCaseTarget]],
     build_dir: Path,
@@ -297,9 +465,98 @@ def get_benchmark_list_for_binary(
     return [bin.get_benchmark_case(line) for line in stdout.splitlines()]
 
 
+ISOLATED_CPUS_PATH = Path("/sys/devices/system/cpu/isolated")
+
+CPU_AFFINITY_KEY = "proj_cpu_affinity"
+
+
+def parse_cpu_list(s: str) -> FrozenSet[int]:
+    result: Set[int] = set()
+    for piece in s.strip().split(","):
+        if piece == "":
+            continue
+        if "-" in piece:
+            (lo, hi) = piece.split("-")
+            result.update(range(int(lo), int(hi) + 1))
+        else:
+            result.add(int(piece))
+    return frozenset(result)
+
+
+def get_benchmark_cores() -> Tuple[int, ...]:
+    # prefer cores isolated from the scheduler (isolcpus), as nothing else will
+    # be scheduled on them to disturb the measurements
+    try:
+        isolated = parse_cpu_list(ISOLATED_CPUS_PATH.read_text())
+    except FileNotFoundError:
+        isolated = frozenset()
+
+    if len(isolated) > 0:
+        _l.debug("Using isolated cores %s for benchmarks", sorted(isolated))
+        return tuple(sorted(isolated))
+    else:
+        available = os.sched_getaffinity(0)
+        _l.debug(
+            "No isolated cores found, using available cores %s for benchmarks",
+            sorted(available),
+        )
+        return tuple(sorted(available))
+
+
+def split_cores(
+    cores: Sequence[int], cores_per_suite: int
+) -> Tuple[Tuple[int, ...], ...]:
+    assert cores_per_suite >= 1
+    return tuple(
+        tuple(cores[i : i + cores_per_suite])
+        for i in range(0, len(cores) - cores_per_suite + 1, cores_per_suite)
+    )
+
+
+def pin_command(command: Sequence[str], cores: Optional[Sequence[int]]) -> List[str]:
+    if cores is None:
+        return list(command)
+    else:
+        return [
+            "taskset",
+            "--cpu-list",
+            ",".join(str(c) for c in cores),
+            *command,
+        ]
+
+
+# keyed by benchmark rather than by executable, as the cases of a single
+# binary can be run separately on different cores
+def record_cpu_affinity(
+    result: BenchmarkResult, cores: Sequence[int]
+) -> BenchmarkResult:
+    affinity: Dict[str, Json] = {b.run_name: list(cores) for b in result.benchmarks}
+    return dataclasses.replace(
+        result,
+        context=dataclasses.replace(
+            result.context,
+            rest={
+                **result.context.rest,
+                CPU_AFFINITY_KEY: affinity,
+            },
+        ),
+    )
+
+
+def get_repetition_args(repetitions: int) -> List[str]:
+    assert repetitions >= 1
+    if repetitions == 1:
+        return []
+    else:
+        return [f"--benchmark_repetitions={repetitions}"]
+
+
 def call_benchmarks(
     benchmark_binaries: Sequence[Union[BenchmarkSuiteTarget, BenchmarkCaseTarget]],
     build_dir: Path,
+    parallel: bool = False,
+    cores_per_suite: int = 1,
+    repetitions: int = 1,
 ) -> BenchmarkResult:
     _l.debug("Calling benchmark suites %s", benchmark_binaries)
     benchmark_binaries = list(sorted(benchmark_binaries))
@@ -307,82 +564,335 @@ def call_benchmarks(
 
     manager = get_progress_manager()
     with manager.counter(total=len(all_benchmarks), desc="Benchmarks") as pbar:
-        results = [call_benchmark(bin, pbar, build_dir) for bin in benchmark_binaries]
+        if parallel:
+            results = call_benchmarks_pinned(
+                benchmark_binaries,
+                SynchronizedProgressBar(pbar),
+                build_dir,
+                cores_per_suite=cores_per_suite,
+                repetitions=repetitions,
+            )
+        else:
+            results = [
+                call_benchmark(bin, pbar, build_dir, repetitions=repetitions)
+                for bin in benchmark_binaries
+            ]
     return merge_benchmark_results(results)
 
 
+def call_benchmarks_adaptive(
+    benchmark_binaries: Sequence[Union[BenchmarkSuiteTarget, BenchmarkCaseTarget]],
+    build_dir: Path,
+    target_relative_ci: float,
+    min_repetitions: int,
+    max_repetitions: int,
+    parallel: bool = False,
+    cores_per_suite: int = 1,
+) -> BenchmarkResult:
+    repetitions = max(min_repetitions, 2)
+    result = call_benchmarks(
+        benchmark_binaries,
+        build_dir,
+        parallel=parallel,
+        cores_per_suite=cores_per_suite,
+        repetitions=repetitions,
+    )
+    all_cases = list_benchmarks(benchmark_binaries, build_dir)
+
+    while True:
+        imprecise = {
+            s.name
+            for s in summarize_benchmarks(result.benchmarks)
+            if not s.is_precise(target_relative_ci)
+        }
+        if len(imprecise) == 0:
+            break
+        extra_repetitions = min(repetitions, max_repetitions - repetitions)
+        if extra_repetitions <= 0:
+            _l.warning(
+                "Reached %d repetitions without a 95%% confidence interval within \u00b1%.1f%% for %s",
+                repetitions,
+                target_relative_ci * 100,
+                sorted(imprecise),
+            )
+            break
+
+        _l.info(
+            "Running %d more repetitions of %s", extra_repetitions, sorted(imprecise)
+        )
+        rerun = call_benchmarks(
+            [c for c in all_cases if c.case_name in imprecise],
+            build_dir,
+            parallel=parallel,
+            cores_per_suite=cores_per_suite,
+            repetitions=extra_repetitions,
+        )
+        repetitions += extra_repetitions
+
+        # the aggregates reported by the benchmark binary no longer cover all
+        # of the samples, so summarize_benchmarks recomputes them instead
+        result = dataclasses.replace(
+            result,
+            benchmarks=tuple(
+                [
+                    *[
+                        b
+                        for b in result.benchmarks
+                        if not (b.run_name in imprecise and b.run_type == "aggregate")
+                    ],
+                    *[b for b in rerun.benchmarks if b.run_type != "aggregate"],
+                ]
+            ),
+        )
+
+    return result
+
+
+def call_benchmarks_pinned(
+    benchmark_binaries: Sequence[Union[BenchmarkSuiteTarget, BenchmarkCaseTarget]],
+    pbar: ProgressBar,
+    build_dir: Path,
+    cores_per_suite: int,
+    repetitions: int = 1,
+) -> List[BenchmarkResult]:
+    core_sets = split_cores(get_benchmark_cores(), cores_per_suite)
+    if len(core_sets) == 0:
+        raise ValueError(
+            f"Not enough cores available to run benchmarks with {cores_per_suite} cores per suite"
+        )
+    _l.info(
+        "Running up to %d benchmark suites concurrently on core sets %s",
+        len(core_sets),
+        core_sets,
+    )
+
+    free_core_sets: "queue.Queue[Tuple[int, ...]]" = queue.Queue()
+    for core_set in core_sets:
+        free_core_sets.put(core_set)
+
+    def run_pinned(
+        benchmark: Union[BenchmarkSuiteTarget, BenchmarkCaseTarget],
+    ) -> BenchmarkResult:
+        cores = free_core_sets.get()
+        try:
+            return record_cpu_affinity(
+                call_benchmark(
+                    benchmark, pbar, build_dir, cores=cores, repetitions=repetitions
+                ),
+                cores,
+            )
+        finally:
+            free_core_sets.put(cores)
+
+    with ThreadPoolExecutor(max_workers=len(core_sets)) as pool:
+        return list(pool.map(run_pinned, benchmark_binaries))
+
+
 def call_benchmark(
     benchmark: Union[BenchmarkCaseTarget, BenchmarkSuiteTarget],
     pbar: ProgressBar,
     build_dir: Path,
+    cores: Optional[Sequence[int]] = None,
+    repetitions: int = 1,
 ) -> BenchmarkResult:
     if isinstance(benchmark, BenchmarkCaseTarget):
-        return call_benchmark_case(benchmark, pbar, build_dir)
+        return call_benchmark_case(
+            benchmark, pbar, build_dir, cores=cores, repetitions=repetitions
+        )
     else:
         assert isinstance(benchmark, BenchmarkSuiteTarget)
-        return call_benchmark_suite(benchmark, pbar, build_dir)
+        return call_benchmark_suite(
+            benchmark, pbar, build_dir, cores=cores, repetitions=repetitions
+        )
+
+
+# incrementally parses the json written by --benchmark_format=json, so that
+# each benchmark is reported as soon as its entry has been printed. only the
+# json structure (a top-level object whose "benchmarks" key holds an array of
+# entries) is relied on, not how the printer lays it out over lines
+class BenchmarkOutputParser:
+    def __init__(self, on_benchmark: Callable[[IndividualBenchmark], None]) -> None:
+        self._on_benchmark = on_benchmark
+        self._buffer = ""
+        self._pos = 0
+        # one of "start", "object", "array" or "done"
+        self._state = "start"
+        self._context: Optional[BenchmarkContext] = None
+        self._benchmarks: List[IndividualBenchmark] = []
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk: str) -> None:
+        self._buffer += chunk
+        while self._step():
+            pass
+        # drop what has been consumed so the buffer only holds the entry
+        # currently being printed
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+
+    def _skip(self, chars: str) -> Optional[str]:
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in chars:
+            self._pos += 1
+        if self._pos == len(self._buffer):
+            return None
+        return self._buffer[self._pos]
+
+    # decodes the json value at the current position, or returns None if it
+    # has not been fully printed yet. a value is only accepted once something
+    # follows it, as a prefix of a number is itself a valid number
+    def _decode(self) -> Optional[Tuple[Json]]:
+        try:
+            (value, end) = self._decoder.raw_decode(self._buffer, self._pos)
+        except ValueError:
+            return None
+        if end == len(self._buffer):
+            return None
+        self._pos = end
+        return (value,)
+
+    # consumes one token or value, returning whether any progress was made
+    def _step(self) -> bool:
+        if self._state == "start":
+            start = self._buffer.find("{", self._pos)
+            if start == -1:
+                self._pos = len(self._buffer)
+                return False
+            self._pos = start + 1
+            self._state = "object"
+            return True
+        elif self._state == "object":
+            c = self._skip(" \t\r\n,")
+            if c is None:
+                return False
+            if c == "}":
+                self._pos += 1
+                self._state = "done"
+                return True
+            start = self._pos
+            key = self._decode()
+            if key is None or self._skip(" \t\r\n:") is None:
+                self._pos = start
+                return False
+            if key[0] == "benchmarks":
+                if self._buffer[self._pos] != "[":
+                    raise ValueError("Expected the benchmarks to be a json array")
+                self._pos += 1
+                self._state = "array"
+                return True
+            value = self._decode()
+            if value is None:
+                self._pos = start
+                return False
+            if key[0] == "context":
+                self._context = BenchmarkContext.from_json(value[0])
+            return True
+        elif self._state == "array":
+            c = self._skip(" \t\r\n,")
+            if c is None:
+                return False
+            if c == "]":
+                self._pos += 1
+                self._state = "object"
+                return True
+            entry = self._decode()
+            if entry is None:
+                return False
+            benchmark = IndividualBenchmark.from_json(entry[0])
+            self._benchmarks.append(benchmark)
+            self._on_benchmark(benchmark)
+            return True
+        else:
+            assert self._state == "done"
+            self._pos = len(self._buffer)
+            return False
+
+    def finish(self) -> BenchmarkResult:
+        self.feed("\n")
+        if self._context is None:
+            raise ValueError("Benchmark output did not contain a context")
+        return BenchmarkResult(
+            context=self._context,
+            benchmarks=tuple(self._benchmarks),
+        )
 
 
 def call_benchmark_case(
-    benchmark: BenchmarkCaseTarget, pbar: ProgressBar, build_dir: Path
+    benchmark: BenchmarkCaseTarget,
+    pbar: ProgressBar,
+    build_dir: Path,
+    cores: Optional[Sequence[int]] = None,
+    repetitions: int = 1,
 ) -> BenchmarkResult:
     pbar.update(incr=0, force=True)
     functions = [benchmark]
 
-    def hook(line: str) -> None:
-        match = NAME_RE.search(line)
-        if match is None:
+    def on_benchmark(b: IndividualBenchmark) -> None:
+        assert b.run_name == benchmark.case_name, (b.run_name, benchmark.case_name)
+        if len(functions) == 0:
+            # further repetitions or aggregates of the same benchmark
             return
-        testname = match.group("testname")
-        assert testname == benchmark.case_name, (testname, benchmark.case_name)
         functions.pop(0)
         if len(functions) > 0:
-            print(f"Running {functions[0]}")
+            pbar.write(f"Running {functions[0]}")
         pbar.update()
 
-    stdout = subprocess.hook_stdout(
-        [
-            str(build_dir / benchmark.run_target.executable_path),
-            "--benchmark_format=json",
-            *benchmark.run_target.args,
-        ],
-        stdout_hook=hook,
+    parser = BenchmarkOutputParser(on_benchmark)
+    subprocess.hook_stdout(
+        pin_command(
+            [
+                str(build_dir / benchmark.run_target.executable_path),
+                "--benchmark_format=json",
+                *benchmark.run_target.args,
+                *get_repetition_args(repetitions),
+            ],
+            cores,
+        ),
+        stdout_hook=parser.feed,
+        capture_output=False,
     )
-    return BenchmarkResult.from_json(json.loads(stdout))
-
-
-NAME_RE = re.compile(r'"name": "(?P<testname>[^"]+)"')
+    return parser.finish()
 
 
 def call_benchmark_suite(
-    benchmark: BenchmarkSuiteTarget, pbar: ProgressBar, build_dir: Path
+    benchmark: BenchmarkSuiteTarget,
+    pbar: ProgressBar,
+    build_dir: Path,
+    cores: Optional[Sequence[int]] = None,
+    repetitions: int = 1,
 ) -> BenchmarkResult:
     functions = get_benchmark_list_for_binary(benchmark, build_dir)
     pbar.update(incr=0, force=True)
+    last_run_name: List[Optional[str]] = [None]
 
-    def hook(line: str) -> None:
-        match = NAME_RE.search(line)
-        if match is None:
+    def on_benchmark(b: IndividualBenchmark) -> None:
+        if b.run_name == last_run_name[0]:
+            # further repetitions or aggregates of the same benchmark
             return
-        testname = match.group("testname")
-        assert benchmark.get_benchmark_case(testname) == functions[0], (
-            testname,
+        last_run_name[0] = b.run_name
+        assert benchmark.get_benchmark_case(b.run_name) == functions[0], (
+            b.run_name,
             functions[0],
         )
         functions.pop(0)
         if len(functions) > 0:
-            print(f"Running {functions[0]}")
+            pbar.write(f"Running {functions[0]}")
         pbar.update()
 
-    print(f"Running {functions[0]}")
-    stdout = subprocess.hook_stdout(
-        [
-            str(build_dir / benchmark.run_target.executable_path),
-            "--benchmark_format=json",
-        ],
-        stdout_hook=hook,
+    pbar.write(f"Running {functions[0]}")
+    parser = BenchmarkOutputParser(on_benchmark)
+    subprocess.hook_stdout(
+        pin_command(
+            [
+                str(build_dir / benchmark.run_target.executable_path),
+                "--benchmark_format=json",
+                *get_repetition_args(repetitions),
+            ],
+            cores,
+        ),
+        stdout_hook=parser.feed,
+        capture_output=False,
     )
-    return BenchmarkResult.from_json(json.loads(stdout))
+    return parser.finish()
 
 
 def upload_to_bencher(
@@ -447,6 +957,14 @@ def all_same(x: Sequence[T]) -> bool:
 def merge_benchmark_contexts(contexts: Sequence[BenchmarkContext]) -> BenchmarkContext:
     assert len(contexts) >= 1
     rest = dict(contexts[0].rest)
+    cpu_affinities: Dict[str, Json] = {}
+    for c in contexts:
+        affinity = c.rest.get(CPU_AFFINITY_KEY)
+        if affinity is not None:
+            assert isinstance(affinity, dict)
+            cpu_affinities.update(affinity)
+    if len(cpu_affinities) > 0:
+        rest[CPU_AFFINITY_KEY] = cpu_affinities
     num_cpus = require_all_same([c.num_cpus for c in contexts])
     caches = require_all_same([c.caches for c in contexts])
     if all_same([c.executable for c in contexts]):
@@ -8,7 +8,10 @@ import sys
 import os
 from pathlib import Path
 from .failure import fail_with_error
-from .dtgen import run_dtgen
+from .dtgen import (
+    is_dtgen_watch_running,
+    run_dtgen,
+)
 from .targets import (
     BuildTarget,
 )
@@ -29,11 +32,14 @@ def build_targets(
     if len(_targets) == 0:
         fail_with_error("No build targets selected")
 
-    if not dtgen_skip:
+    if not dtgen_skip and is_dtgen_watch_running(config.base):
+        _l.info("Skipping dtgen as `proj dtgen --watch` is running")
+    elif not dtgen_skip:
         run_dtgen(
             root=config.base,
             config=config,
             force=False,
+            jobs=jobs,
         )
 
     subprocess.check_call(
@@ -11,22 +11,6 @@ from enum import (
 from .config_file import (
     ProjectConfig,
 )
-from .format import (
-    run_formatter_check as _run_formatter_check,
-)
-from .dtgen import (
-    run_dtgen,
-)
-from .cmake import (
-    cmake_all,
-)
-import multiprocessing
-from .build import (
-    build_targets,
-)
-from .testing import (
-    run_test_suites,
-)
 import logging
 from .failure import (
     fail_without_error,
@@ -37,6 +21,8 @@ from . import subprocess_trace as subprocess
 _l = logging.getLogger(__name__)
 
 
+# the cli needs Check to parse its arguments, so the subsystems the checks
+# run are only imported once a check actually runs
 class Check(StrEnum):
     FORMAT = "format"
     CPU_CI = "cpu-ci"
@@ -46,6 +32,8 @@ class Check(StrEnum):
 def run_formatter_check(
     config: ProjectConfig, files: Optional[Sequence[PathLike[str]]] = None
 ) -> None:
+    from .format import run_formatter_check as _run_formatter_check
+
     try:
         _run_formatter_check(config=config, files=files)
     except subprocess.CalledProcessError:
@@ -63,6 +51,11 @@ def run_check(config: ProjectConfig, check: Check, verbosity: int) -> None:
 
 
 def run_build_check(config: ProjectConfig, verbosity: int) -> None:
+    from .build import build_targets
+    from .cmake import cmake_all
+    from .dtgen import run_dtgen
+    import multiprocessing
+
     run_dtgen(
         root=config.base,
         config=config,
@@ -81,6 +74,12 @@ def run_build_check(config: ProjectConfig, verbosity: int) -> None:
 
 
 def run_cpu_ci(config: ProjectConfig, verbosity: int) -> None:
+    from .build import build_targets
+    from .cmake import cmake_all
+    from .dtgen import run_dtgen
+    import multiprocessing
+    from .testing import run_test_suites
+
     _l.info("Running formatter check...")
     run_formatter_check(config)
 
@@ -110,6 +109,7 @@ def run_cpu_ci(config: ProjectConfig, verbosity: int) -> None:
         test_suites=list(sorted(config.all_cpu_test_targets)),
         build_dir=config.coverage_build_dir,
         debug=False,
+        jobs=multiprocessing.cpu_count(),
     )
 
     if len(test_results.failed) > 0:
@@ -117,6 +117,12 @@ def run_cpu_ci(config: ProjectConfig, verbosity: int) -> None:
 
 
 def run_gpu_ci(config: ProjectConfig, verbosity: int) -> None:
+    from .build import build_targets
+    from .cmake import cmake_all
+    from .dtgen import run_dtgen
+    import multiprocessing
+    from .testing import run_test_suites
+
     _l.info("Running dtgen")
     run_dtgen(
         root=config.base,
@@ -144,6 +150,7 @@ def run_gpu_ci(config: ProjectConfig, verbosity: int) -> None:
         test_suites=test_suites,
         build_dir=config.debug_build_dir,
         debug=False,
+        jobs=multiprocessing.cpu_count(),
     )
 
     if len(test_results.failed) > 0:
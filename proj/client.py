@@ -0,0 +1,117 @@
+from typing import (
+    Any,
+    Optional,
+    Sequence,
+)
+import json
+import os
+import socket
+import sys
+
+# this module runs before anything else on every invocation of proj, so it
+# must only import a few small standard library modules
+
+SERVER_SOCKET_FILENAME = ".proj-server.sock"
+
+SERVER_TIMEOUT_SECONDS = 1.0
+
+
+def find_project_root(path: str) -> Optional[str]:
+    d = os.path.realpath(path)
+    while True:
+        if os.path.isfile(os.path.join(d, ".proj.toml")):
+            return d
+        parent = os.path.dirname(d)
+        if parent == d:
+            return None
+        d = parent
+
+
+def get_server_socket_path(root: str) -> str:
+    return os.path.join(root, "build", SERVER_SOCKET_FILENAME)
+
+
+def _recv_line(s: socket.socket) -> bytes:
+    chunks = []
+    while True:
+        chunk = s.recv(64 * 1024)
+        if len(chunk) == 0:
+            raise ConnectionError("proj server closed the connection")
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            return b"".join(chunks)
+
+
+# asks the `proj serve` instance for the project containing path, if there is
+# one. returns None if no server is running or it could not answer, in which
+# case the caller should compute the answer itself
+def query_server(command: str, path: str) -> Optional[Any]:
+    # the server has a different working directory
+    path = os.path.join(os.getcwd(), path)
+    root = find_project_root(path)
+    if root is None:
+        return None
+    socket_path = get_server_socket_path(root)
+    if not os.path.exists(socket_path):
+        return None
+
+    request = json.dumps({"command": command, "path": path}) + "\n"
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(SERVER_TIMEOUT_SECONDS)
+            s.connect(socket_path)
+            s.sendall(request.encode())
+            response = json.loads(_recv_line(s))
+    except (OSError, ValueError):
+        return None
+
+    if "error" in response:
+        return None
+    return response["result"]
+
+
+def is_server_running(root: str) -> bool:
+    socket_path = get_server_socket_path(root)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(SERVER_TIMEOUT_SECONDS)
+            s.connect(socket_path)
+    except OSError:
+        return False
+    return True
+
+
+# answers the commands that editors run most often using the server, printing
+# exactly what the corresponding main function would
+def try_main_using_server(argv: Sequence[str]) -> bool:
+    if list(argv) == ["root"]:
+        root = query_server("root", os.getcwd())
+        if root is None:
+            return False
+        print(root)
+    elif list(argv) == ["config"]:
+        config = query_server("config", os.getcwd())
+        if config is None:
+            return False
+        json.dump(config, sort_keys=True, indent=2, fp=sys.stdout)
+    elif len(argv) == 2 and argv[0] == "query-path" and not argv[1].startswith("-"):
+        path_info = query_server("query-path", argv[1])
+        if path_info is None:
+            return False
+        json.dump(path_info, sort_keys=True, indent=2, fp=sys.stdout)
+    else:
+        return False
+    return True
+
+
+def entrypoint() -> None:
+    if try_main_using_server(sys.argv[1:]):
+        sys.exit(0)
+
+    from .__main__ import entrypoint as main_entrypoint
+
+    main_entrypoint()
+
+
+if __name__ == "__main__":
+    entrypoint()
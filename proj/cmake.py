@@ -3,7 +3,14 @@ from typing import (
     List,
     Iterable,
     Iterator,
+    Dict,
+    Set,
+    FrozenSet,
+    Optional,
+    Tuple,
 )
+import asyncio
+import json
 import os
 import shlex
 from . import subprocess_trace as subprocess
@@ -11,8 +18,10 @@ from pathlib import Path
 from enum import StrEnum
 import sys
 import shutil
+import tempfile
 from .config_file import ProjectConfig
 from . import fix_compile_commands
+from .utils import write_file_if_changed
 import re
 from proj.targets import (
     BuildTarget,
@@ -24,9 +33,15 @@ _l = logging.getLogger(__name__)
 
 
 def run_cmake(cmake_args: Iterable[str], require_shell: bool, cwd: Path) -> None:
+    asyncio.run(run_cmake_async(cmake_args, require_shell=require_shell, cwd=cwd))
+
+
+async def run_cmake_async(
+    cmake_args: Iterable[str], require_shell: bool, cwd: Path
+) -> None:
     cmake_args = list(cmake_args)
     _l.debug("Running cmake command: %s", cmake_args)
-    subprocess.check_call(
+    await subprocess.check_call_async(
         [
             "cmake",
             *cmake_args,
@@ -64,6 +79,92 @@ def get_targets_list(names: ConfiguredNames, build_dir: Path) -> Iterator[BuildT
             yield parsed
 
 
+GRAPHVIZ_NODE = re.compile(r'^\s*"(?P<node>[^"]+)"\s*\[\s*label\s*=\s*"(?P<label>[^"]*)"')
+GRAPHVIZ_EDGE = re.compile(r'^\s*"(?P<src>[^"]+)"\s*->\s*"(?P<dst>[^"]+)"')
+
+
+def parse_graphviz_dependencies(dot: str) -> Dict[str, FrozenSet[str]]:
+    labels: Dict[str, str] = {}
+    edges: List[Tuple[str, str]] = []
+    for line in dot.splitlines():
+        node_match = GRAPHVIZ_NODE.match(line)
+        if node_match is not None:
+            labels[node_match.group("node")] = node_match.group("label")
+            continue
+        edge_match = GRAPHVIZ_EDGE.match(line)
+        if edge_match is not None:
+            edges.append((edge_match.group("src"), edge_match.group("dst")))
+
+    deps: Dict[str, Set[str]] = {label: set() for label in labels.values()}
+    for src, dst in edges:
+        deps[labels[src]].add(labels[dst])
+    return {k: frozenset(v) for k, v in deps.items()}
+
+
+TARGET_GRAPH_CACHE_FILENAME = ".proj-target-graph-cache.json"
+
+
+def _run_cmake_graphviz(build_dir: Path) -> str:
+    with tempfile.TemporaryDirectory() as d:
+        dot_path = Path(d) / "targets.dot"
+        subprocess.check_call(
+            ["cmake", f"--graphviz={dot_path}", "."],
+            stdout=subprocess.DEVNULL,
+            stderr=sys.stderr,
+            cwd=build_dir,
+            env=os.environ,
+        )
+        return dot_path.read_text()
+
+
+# cmake rewrites its cache every time the build dir is configured, including
+# when a build reconfigures it after a CMakeLists.txt changed
+def _get_cmake_cache_stamp(build_dir: Path) -> Optional[List[int]]:
+    try:
+        st = (build_dir / "CMakeCache.txt").stat()
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _load_cached_target_dependency_graph(
+    build_dir: Path,
+) -> Optional[Dict[str, FrozenSet[str]]]:
+    stamp = _get_cmake_cache_stamp(build_dir)
+    if stamp is None:
+        return None
+    try:
+        raw = json.loads((build_dir / TARGET_GRAPH_CACHE_FILENAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    if not isinstance(raw, dict) or raw.get("cmake_cache") != stamp:
+        return None
+    graph = raw.get("graph")
+    if not isinstance(graph, dict):
+        return None
+    return {k: frozenset(v) for k, v in graph.items()}
+
+
+# getting the graph from cmake reconfigures the build dir, so it is cached
+# until the build dir is next configured
+def get_target_dependency_graph(build_dir: Path) -> Dict[str, FrozenSet[str]]:
+    cached = _load_cached_target_dependency_graph(build_dir)
+    if cached is not None:
+        _l.debug("Using cached target dependency graph for %s", build_dir)
+        return cached
+
+    graph = parse_graphviz_dependencies(_run_cmake_graphviz(build_dir))
+    raw = {
+        "cmake_cache": _get_cmake_cache_stamp(build_dir),
+        "graph": {k: sorted(v) for k, v in graph.items()},
+    }
+    write_file_if_changed(
+        build_dir / TARGET_GRAPH_CACHE_FILENAME,
+        json.dumps(raw, sort_keys=True, indent=2).encode("utf-8"),
+    )
+    return graph
+
+
 def render_args(arg_map: Mapping[str, str], trace: bool) -> List[str]:
     cmake_args = [f"-D{k}={v}" for k, v in arg_map.items()]
     cmake_args += shlex.split(os.environ.get("CMAKE_FLAGS", ""))
@@ -99,6 +200,12 @@ def get_build_dir(config: ProjectConfig, mode: BuildMode) -> Path:
 
 
 def cmake(config: ProjectConfig, mode: BuildMode, fast: bool, trace: bool) -> None:
+    asyncio.run(cmake_async(config=config, mode=mode, fast=fast, trace=trace))
+
+
+async def cmake_async(
+    config: ProjectConfig, mode: BuildMode, fast: bool, trace: bool
+) -> None:
     arg_map = get_arg_map(config, mode)
     build_dir = get_build_dir(config, mode)
 
@@ -108,7 +215,9 @@ def cmake(config: ProjectConfig, mode: BuildMode, fast: bool, trace: bool) -> No
 
     rendered_args = render_args(arg_map, trace=trace)
 
-    run_cmake(rendered_args, require_shell=config.cmake_require_shell, cwd=build_dir)
+    await run_cmake_async(
+        rendered_args, require_shell=config.cmake_require_shell, cwd=build_dir
+    )
 
     if mode == BuildMode.DEBUG:
         COMPILE_COMMANDS_FNAME = "compile_commands.json"
@@ -119,7 +228,7 @@ def cmake(config: ProjectConfig, mode: BuildMode, fast: bool, trace: bool) -> No
             )
 
         with (config.base / COMPILE_COMMANDS_FNAME).open("w") as f:
-            subprocess.check_call(
+            await subprocess.check_call_async(
                 [
                     "compdb",
                     "-p",
@@ -132,6 +241,15 @@ def cmake(config: ProjectConfig, mode: BuildMode, fast: bool, trace: bool) -> No
             )
 
 
+async def _cmake_all(config: ProjectConfig, fast: bool, trace: bool) -> None:
+    # the build dirs are independent, so they can be configured concurrently
+    await asyncio.gather(
+        *[
+            cmake_async(config=config, mode=mode, fast=fast, trace=trace)
+            for mode in BuildMode
+        ]
+    )
+
+
 def cmake_all(config: ProjectConfig, fast: bool, trace: bool) -> None:
-    for mode in BuildMode:
-        cmake(config=config, mode=mode, fast=fast, trace=trace)
+    asyncio.run(_cmake_all(config=config, fast=fast, trace=trace))
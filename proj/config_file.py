@@ -1,14 +1,19 @@
 from pathlib import Path
 from dataclasses import dataclass
 from typing import (
+    Dict,
     Optional,
     Mapping,
     Tuple,
+    Iterable,
     Iterator,
     Union,
     FrozenSet,
 )
 from immutables import Map
+import functools
+import hashlib
+import pickle
 import string
 import re
 import io
@@ -37,6 +42,7 @@ from .targets import (
 import logging
 from .utils import (
     map_optional,
+    write_file_if_changed,
 )
 from .json import (
     Json,
@@ -76,6 +82,8 @@ class BinConfig:
     requires_cuda: bool
 
 
+# the collections derived from the targets are computed once per config, as
+# target parsing queries them repeatedly
 @dataclass(frozen=True)
 class ProjectConfig:
     project_name: str
@@ -95,6 +103,7 @@ class ProjectConfig:
     _fix_compile_commands: Optional[bool] = None
     _test_header_path: Optional[Path] = None
     _cuda_launch_cmd: Optional[Tuple[str, ...]] = None
+    _dtgen_builtin_layout: Optional[bool] = None
 
     @property
     def debug_build_dir(self) -> Path:
@@ -112,11 +121,15 @@ class ProjectConfig:
     def benchmark_html_dir(self) -> Path:
         return self.release_build_dir / "bencher"
 
+    @property
+    def benchmark_history_path(self) -> Path:
+        return self.base / "build/benchmark-history.sqlite"
+
     @property
     def doxygen_dir(self) -> Path:
         return self.base / "build/doxygen"
 
-    @property
+    @functools.cached_property
     def bin_names(self) -> Mapping[str, BinConfig]:
         return {
             target_name: target_config
@@ -124,7 +137,7 @@ class ProjectConfig:
             if isinstance(target_config, BinConfig)
         }
 
-    @property
+    @functools.cached_property
     def bin_targets(self) -> FrozenSet[Union[CpuBinTarget, CudaBinTarget]]:
         return frozenset(
             CudaBinTarget(GenericBinTarget(bin_name))
@@ -133,7 +146,7 @@ class ProjectConfig:
             for bin_name, conf in self.bin_names.items()
         )
 
-    @property
+    @functools.cached_property
     def lib_names(self) -> Mapping[str, LibConfig]:
         return {
             target_name: target_config
@@ -141,18 +154,18 @@ class ProjectConfig:
             if isinstance(target_config, LibConfig)
         }
 
-    @property
+    @functools.cached_property
     def lib_targets(self) -> Mapping[LibTarget, LibConfig]:
         return {LibTarget(k): v for k, v in self.lib_names.items()}
 
-    @property
+    @functools.cached_property
     def configured_names(self) -> ConfiguredNames:
         return ConfiguredNames(
-            bin_names=set(self.bin_names),
-            lib_names=set(self.lib_names.keys()),
+            bin_names=frozenset(self.bin_names),
+            lib_names=frozenset(self.lib_names.keys()),
         )
 
-    @property
+    @functools.cached_property
     def all_build_targets(self) -> Tuple[BuildTarget, ...]:
         return tuple(
             [
@@ -319,6 +332,7 @@ class ProjectConfig:
             **self.base_cmake_flags,
             **extra,
             "CMAKE_BUILD_TYPE": "Debug",
+            "CMAKE_EXPORT_COMPILE_COMMANDS": "ON",
             "FF_USE_CODE_COVERAGE": "ON",
         }
 
@@ -344,6 +358,13 @@ class ProjectConfig:
         else:
             return self._fix_compile_commands
 
+    @property
+    def dtgen_builtin_layout(self) -> bool:
+        if self._dtgen_builtin_layout is None:
+            return False
+        else:
+            return self._dtgen_builtin_layout
+
     @property
     def test_header_path(self) -> Path:
         if self._test_header_path is None:
@@ -507,15 +528,84 @@ def load_cmake_flags(x: object) -> Optional[Map[str, str]]:
     return map_optional(x, lambda y: require_dict_of(y, require_str, require_str))
 
 
+CONFIG_SNAPSHOT_FILENAME = ".proj-config-snapshot.pickle"
+
+# the snapshot contains pickled instances of the classes defined in these
+# files, so it can only be reused by the code that wrote it
+CONFIG_SNAPSHOT_SOURCES = (
+    Path(__file__),
+    Path(__file__).parent / "targets.py",
+)
+
+
+@functools.cache
+def get_config_source_hash() -> bytes:
+    h = hashlib.md5()
+    for p in CONFIG_SNAPSHOT_SOURCES:
+        h.update(p.read_bytes())
+    return h.digest()
+
+
+def get_config_snapshot_path(config_root: Path) -> Path:
+    return config_root / "build" / CONFIG_SNAPSHOT_FILENAME
+
+
+def get_config_snapshot_key(config_root: Path, raw: bytes) -> bytes:
+    h = hashlib.md5()
+    h.update(get_config_source_hash())
+    h.update(str(config_root).encode("utf-8") + b"\0")
+    h.update(raw)
+    return h.digest()
+
+
+def load_config_snapshot(config_root: Path, key: bytes) -> Optional[ProjectConfig]:
+    path = get_config_snapshot_path(config_root)
+    try:
+        with path.open("rb") as f:
+            snapshot_key, config = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        _l.warning("Ignoring malformed config snapshot at %s", path)
+        return None
+    if snapshot_key != key or not isinstance(config, ProjectConfig):
+        return None
+    return config
+
+
+def save_config_snapshot(config_root: Path, key: bytes, config: ProjectConfig) -> None:
+    # nothing is written until the project has been built, so that merely
+    # querying a fresh checkout leaves it untouched
+    if not (config_root / "build").is_dir():
+        return
+
+    # stores the derived collections along with the config itself
+    config.all_build_targets
+    config.configured_names
+
+    try:
+        write_file_if_changed(
+            get_config_snapshot_path(config_root), pickle.dumps((key, config))
+        )
+    except OSError as e:
+        _l.debug(f"Could not save config snapshot: {e}")
+
+
+# parsing and validating .proj.toml is the bulk of the cost of loading a
+# large project's config, so the validated config is kept in a snapshot that
+# is reused for as long as .proj.toml and the config code are unchanged
 def _load_config(d: Path) -> Optional[ProjectConfig]:
     config_root = find_config_root(d)
     if config_root is None:
         return None
 
-    with (config_root / ".proj.toml").open("r") as f:
-        raw = toml.loads(f.read())
-
-    return load_parsed_config(config_root, raw)
+    raw = (config_root / ".proj.toml").read_bytes()
+    key = get_config_snapshot_key(config_root, raw)
+    config = load_config_snapshot(config_root, key)
+    if config is None:
+        config = load_parsed_config(config_root, toml.loads(raw.decode("utf-8")))
+        save_config_snapshot(config_root, key, config)
+    return config
 
 
 class ConfigKey(StrEnum):
@@ -533,6 +623,7 @@ class ConfigKey(StrEnum):
     FIX_COMPILE_COMMANDS = "fix_compile_commands"
     TEST_HEADER_PATH = "test_header_path"
     CUDA_LAUNCH_CMD = "cuda_launch_cmd"
+    DTGEN_BUILTIN_LAYOUT = "dtgen_builtin_layout"
 
 
 def load_parsed_config(config_root: Path, raw: object) -> ProjectConfig:
@@ -566,6 +657,9 @@ def load_parsed_config(config_root: Path, raw: object) -> ProjectConfig:
         ),
         _test_header_path=load_path(raw.get(ConfigKey.TEST_HEADER_PATH)),
         _cuda_launch_cmd=load_str_tuple(raw.get(ConfigKey.CUDA_LAUNCH_CMD)),
+        _dtgen_builtin_layout=map_optional(
+            raw.get(ConfigKey.DTGEN_BUILTIN_LAYOUT), require_bool
+        ),
     )
 
 
@@ -597,12 +691,103 @@ def load_config(d: Path) -> ProjectConfig:
         return config
 
 
-def gen_ifndef_uid(p: Union[Path, str]) -> str:
+@dataclass(frozen=True, order=True)
+class LibInfo:
+    include_dir: Path
+    src_dir: Path
+    test_dir: Optional[Path]
+    benchmark_dir: Optional[Path]
+
+
+# caches the lookups that resolving paths within a project repeats: finding
+# and parsing the config for a path, and finding and describing the sublib
+# containing it. results are cached per directory, so resolving many paths
+# costs a constant amount of filesystem work per path rather than a walk up
+# to the filesystem root (and a reparse of the config) for every helper.
+# the cache is never invalidated, so a context should not outlive the
+# filesystem state it was created for
+class ProjectContext:
+    def __init__(self, config: Optional[ProjectConfig] = None) -> None:
+        self._config_roots: Dict[Path, Optional[Path]] = {}
+        self._configs: Dict[Path, ProjectConfig] = {}
+        self._sublib_roots: Dict[Path, Optional[Path]] = {}
+        self._lib_infos: Dict[Path, LibInfo] = {}
+        if config is not None:
+            base = config.base.resolve()
+            self._config_roots[base] = base
+            self._configs[base] = config
+
+    def find_config_root(self, d: Path) -> Optional[Path]:
+        d = Path(d).resolve()
+        visited = []
+        result: Optional[Path] = None
+        for _d in [d, *d.parents]:
+            if _d in self._config_roots:
+                result = self._config_roots[_d]
+                break
+            visited.append(_d)
+            if (_d / ".proj.toml").is_file():
+                result = _d
+                break
+        for _d in visited:
+            self._config_roots[_d] = result
+        return result
+
+    def get_config_root(self, d: Path) -> Path:
+        config_root = self.find_config_root(d)
+        if config_root is None:
+            # reuse the uncached lookup for its error message
+            return get_config_root(d)
+        return config_root
+
+    def get_config(self, p: Union[Path, str]) -> ProjectConfig:
+        config_root = self.get_config_root(Path(p).absolute())
+        config = self._configs.get(config_root)
+        if config is None:
+            config = load_config(config_root)
+            self._configs[config_root] = config
+        return config
+
+    def get_sublib_root(self, p: Path) -> Optional[Path]:
+        p = Path(p).resolve()
+        visited = []
+        result: Optional[Path] = None
+        for _p in [p, *p.parents]:
+            if _p in self._sublib_roots:
+                result = self._sublib_roots[_p]
+                break
+            visited.append(_p)
+            if (_p / "src").is_dir() and (_p / "include").is_dir():
+                result = _p
+                break
+        for _p in visited:
+            self._sublib_roots[_p] = result
+        return result
+
+    def get_lib_info(self, p: Path) -> LibInfo:
+        sublib_root = self.get_sublib_root(Path(p).absolute())
+        if sublib_root is None:
+            raise ValueError(f"Path {p} is not within a sublib")
+        lib_info = self._lib_infos.get(sublib_root)
+        if lib_info is None:
+            lib_info = _load_lib_info(sublib_root, self.get_config_root(sublib_root))
+            self._lib_infos[sublib_root] = lib_info
+        return lib_info
+
+
+def get_context(ctx: Optional[ProjectContext]) -> ProjectContext:
+    if ctx is None:
+        return ProjectContext()
+    else:
+        return ctx
+
+
+def gen_ifndef_uid(p: Union[Path, str], ctx: Optional[ProjectContext] = None) -> str:
+    ctx = get_context(ctx)
     p = Path(p).absolute()
-    config_root = find_config_root(p)
-    assert config_root is not None
+    config_root = ctx.get_config_root(p)
     relpath = p.relative_to(config_root)
-    config = load_config(p)
+    config = ctx.get_config(p)
     unfixed = f"_{config.ifndef_name}_" + str(relpath)
     return re.sub(r"[^a-zA-Z0-9_]", "_", unfixed).upper()
 
@@ -626,8 +811,8 @@ def get_lib_root(p: Path) -> Path:
     return config_root / "lib"
 
 
-def get_test_header_path(p: Path) -> Path:
-    config = load_config(p)
+def get_test_header_path(p: Path, ctx: Optional[ProjectContext] = None) -> Path:
+    config = get_context(ctx).get_config(p)
     return config.test_header_path
 
 
@@ -647,41 +832,16 @@ def with_suffix_removed(p: Path) -> Path:
     return p.with_suffix("")
 
 
-def get_sublib_root(p: Path) -> Optional[Path]:
-    p = Path(p).resolve()
-    assert p.is_absolute()
-
-    while True:
-        src_dir = p / "src"
-        include_dir = p / "include"
-
-        src_exists = src_dir.is_dir()
-        include_exists = include_dir.is_dir()
-
-        _l.debug(
-            "get_sublib_root checking %s for %s is dir (%s) and %s is dir (%s)",
-            p,
-            src_dir,
-            src_exists,
-            include_dir,
-            include_exists,
-        )
-
-        if src_exists and include_exists:
-            return p
-
-        if p == p.parent:
-            return None
-        else:
-            p = p.parent
+def get_sublib_root(p: Path, ctx: Optional[ProjectContext] = None) -> Optional[Path]:
+    return get_context(ctx).get_sublib_root(p)
 
 
-def get_src_dir(p: Path) -> Optional[Path]:
-    return map_optional(get_sublib_root(p), lambda pp: pp / "src")
+def get_src_dir(p: Path, ctx: Optional[ProjectContext] = None) -> Optional[Path]:
+    return map_optional(get_context(ctx).get_sublib_root(p), lambda pp: pp / "src")
 
 
-def get_include_dir(p: Path) -> Optional[Path]:
-    return map_optional(get_sublib_root(p), lambda pp: pp / "include")
+def get_include_dir(p: Path, ctx: Optional[ProjectContext] = None) -> Optional[Path]:
+    return map_optional(get_context(ctx).get_sublib_root(p), lambda pp: pp / "include")
 
 
 def with_project_specific_extension_removed(p: Path, config: ProjectConfig) -> Path:
@@ -739,27 +899,50 @@ class PathInfo:
         }
 
 
-def get_path_info(p: Path) -> PathInfo:
-    public_header_info = get_public_header_info(p)
-    private_header_info = get_private_header_info(p)
+def get_path_info(p: Path, ctx: Optional[ProjectContext] = None) -> PathInfo:
+    ctx = get_context(ctx)
+    public_header_info = get_public_header_info(p, ctx)
+    private_header_info = get_private_header_info(p, ctx)
     return PathInfo(
-        include=get_include_path(p),
+        include=get_include_path(p, ctx),
         public_header=public_header_info,
         private_header=private_header_info,
-        header=try_get_header_path(p),
-        source=get_source_path(p),
-        test_source=get_test_source_path(p),
-        benchmark_source=get_benchmark_source_path(p),
+        header=try_get_header_path(p, ctx),
+        source=get_source_path(p, ctx),
+        test_source=get_test_source_path(p, ctx),
+        benchmark_source=get_benchmark_source_path(p, ctx),
     )
 
 
-def get_subrelpath(p: Path, config: Optional[ProjectConfig] = None) -> Path:
+# resolves many paths at once, reusing the config and sublib lookups between
+# them. yields None for paths that cannot be resolved (outside any project or
+# sublib, or outside its include and src directories) so that one bad path
+# does not stop the rest from being resolved
+def get_path_infos(
+    paths: Iterable[Path], ctx: Optional[ProjectContext] = None
+) -> Iterator[Optional[PathInfo]]:
+    ctx = get_context(ctx)
+    for p in paths:
+        try:
+            yield get_path_info(p, ctx)
+        except (FileNotFoundError, ValueError, RuntimeError):
+            _l.warning(f"Could not get path info for {p}")
+            yield None
+
+
+def get_subrelpath(
+    p: Path,
+    config: Optional[ProjectConfig] = None,
+    ctx: Optional[ProjectContext] = None,
+) -> Path:
+    ctx = get_context(ctx)
     p = Path(p).absolute()
     if config is None:
-        config = load_config(p)
+        config = ctx.get_config(p)
 
-    sublib_root = get_sublib_root(p)
-    assert sublib_root is not None
+    sublib_root = ctx.get_sublib_root(p)
+    if sublib_root is None:
+        raise ValueError(f"Path {p} is not within a sublib")
 
     include_dir = sublib_root / "include"
     assert include_dir.is_dir()
@@ -786,36 +969,30 @@ def get_subrelpath(p: Path, config: Optional[ProjectConfig] = None) -> Path:
     )
 
 
-def get_possible_spec_paths(p: Path) -> Iterator[Path]:
+def get_possible_spec_paths(
+    p: Path, ctx: Optional[ProjectContext] = None
+) -> Iterator[Path]:
+    ctx = get_context(ctx)
     p = Path(p).absolute()
-    config = get_config(p)
+    config = ctx.get_config(p)
     assert p.name.endswith(".dtg.cc") or p.name.endswith(
         ".dtg" + config.header_extension
     )
-    subrelpath = get_subrelpath(p)
-    include_dir = get_include_dir(p)
+    subrelpath = get_subrelpath(p, config, ctx)
+    include_dir = get_include_dir(p, ctx)
     assert include_dir is not None
-    src_dir = get_src_dir(p)
+    src_dir = get_src_dir(p, ctx)
     assert src_dir is not None
     for d in [include_dir, src_dir]:
         for ext in [".struct.toml", ".enum.toml", ".variant.toml"]:
             yield d / with_suffix_appended(with_suffix_removed(subrelpath), ext)
 
 
-@dataclass(frozen=True, order=True)
-class LibInfo:
-    include_dir: Path
-    src_dir: Path
-    test_dir: Optional[Path]
-    benchmark_dir: Optional[Path]
-
+def get_lib_info(p: Path, ctx: Optional[ProjectContext] = None) -> LibInfo:
+    return get_context(ctx).get_lib_info(p)
 
-def get_lib_info(p: Path) -> LibInfo:
-    p = Path(p).absolute()
-    sublib_root = get_sublib_root(p)
-    assert sublib_root is not None
-    config_root = get_config_root(p)
 
+def _load_lib_info(sublib_root: Path, config_root: Path) -> LibInfo:
     include_dir = sublib_root / "include"
     assert include_dir.is_dir()
 
@@ -844,12 +1021,13 @@ def get_lib_info(p: Path) -> LibInfo:
     )
 
 
-def get_public_header_path(p: Path) -> Path:
-    config = get_config(p)
+def get_public_header_path(p: Path, ctx: Optional[ProjectContext] = None) -> Path:
+    ctx = get_context(ctx)
+    config = ctx.get_config(p)
 
-    lib_info = get_lib_info(p)
+    lib_info = ctx.get_lib_info(p)
 
-    subrelpath = get_subrelpath(p)
+    subrelpath = get_subrelpath(p, config, ctx)
     subrelpath_with_extension = with_suffix_appended(
         subrelpath, config.header_extension
     )
@@ -857,20 +1035,23 @@ def get_public_header_path(p: Path) -> Path:
     return lib_info.include_dir / subrelpath_with_extension
 
 
-def get_public_header_info(p: Path) -> HeaderInfo:
-    path = get_public_header_path(p)
+def get_public_header_info(p: Path, ctx: Optional[ProjectContext] = None) -> HeaderInfo:
+    ctx = get_context(ctx)
+    path = get_public_header_path(p, ctx)
     return HeaderInfo(
         path=path,
-        ifndef=gen_ifndef_uid(path),
+        # path is relative to the project root rather than the working directory
+        ifndef=gen_ifndef_uid(ctx.get_config_root(p) / path, ctx),
     )
 
 
-def get_private_header_path(p: Path) -> Path:
-    config = get_config(p)
+def get_private_header_path(p: Path, ctx: Optional[ProjectContext] = None) -> Path:
+    ctx = get_context(ctx)
+    config = ctx.get_config(p)
 
-    lib_info = get_lib_info(p)
+    lib_info = ctx.get_lib_info(p)
 
-    subrelpath = get_subrelpath(p)
+    subrelpath = get_subrelpath(p, config, ctx)
     subrelpath_with_extension = with_suffix_appended(
         subrelpath, config.header_extension
     )
@@ -878,27 +1059,34 @@ def get_private_header_path(p: Path) -> Path:
     return lib_info.src_dir / subrelpath_with_extension
 
 
-def get_private_header_info(p: Path) -> HeaderInfo:
-    path = get_private_header_path(p)
+def get_private_header_info(
+    p: Path, ctx: Optional[ProjectContext] = None
+) -> HeaderInfo:
+    ctx = get_context(ctx)
+    path = get_private_header_path(p, ctx)
     return HeaderInfo(
         path=path,
-        ifndef=gen_ifndef_uid(path),
+        # path is relative to the project root rather than the working directory
+        ifndef=gen_ifndef_uid(ctx.get_config_root(p) / path, ctx),
     )
 
 
-def try_get_header_path(p: Path) -> Optional[Path]:
+def try_get_header_path(
+    p: Path, ctx: Optional[ProjectContext] = None
+) -> Optional[Path]:
     try:
-        return get_header_path(p)
+        return get_header_path(p, ctx)
     except RuntimeError:
         return None
 
 
-def get_header_path(p: Path) -> Path:
-    config = get_config(p)
+def get_header_path(p: Path, ctx: Optional[ProjectContext] = None) -> Path:
+    ctx = get_context(ctx)
+    config = ctx.get_config(p)
 
-    lib_info = get_lib_info(p)
+    lib_info = ctx.get_lib_info(p)
 
-    subrelpath = get_subrelpath(p)
+    subrelpath = get_subrelpath(p, config, ctx)
     subrelpath_with_extension = with_suffix_appended(
         subrelpath, config.header_extension
     )
@@ -913,37 +1101,47 @@ def get_header_path(p: Path) -> Path:
         raise RuntimeError([public_include, private_include])
 
 
-def get_include_path(p: Path) -> Path:
-    lib_info = get_lib_info(p)
-    header_path = get_public_header_path(p)
+def get_include_path(p: Path, ctx: Optional[ProjectContext] = None) -> Path:
+    ctx = get_context(ctx)
+    lib_info = ctx.get_lib_info(p)
+    header_path = get_public_header_path(p, ctx)
     return header_path.relative_to(lib_info.include_dir)
 
 
-def get_source_path(p: Path) -> Path:
+def get_source_path(p: Path, ctx: Optional[ProjectContext] = None) -> Path:
+    ctx = get_context(ctx)
     p = Path(p).absolute()
 
-    lib_info = get_lib_info(p)
+    lib_info = ctx.get_lib_info(p)
 
-    return lib_info.src_dir / with_suffix_appended(get_subrelpath(p), ".cc")
+    return lib_info.src_dir / with_suffix_appended(get_subrelpath(p, ctx=ctx), ".cc")
 
 
-def get_test_source_path(p: Path) -> Optional[Path]:
+def get_test_source_path(
+    p: Path, ctx: Optional[ProjectContext] = None
+) -> Optional[Path]:
+    ctx = get_context(ctx)
     p = Path(p).absolute()
 
-    lib_info = get_lib_info(p)
+    lib_info = ctx.get_lib_info(p)
 
     if lib_info.test_dir is None:
         return None
     else:
         return (
-            lib_info.test_dir / "src" / with_suffix_appended(get_subrelpath(p), ".cc")
+            lib_info.test_dir
+            / "src"
+            / with_suffix_appended(get_subrelpath(p, ctx=ctx), ".cc")
         )
 
 
-def get_benchmark_source_path(p: Path) -> Optional[Path]:
+def get_benchmark_source_path(
+    p: Path, ctx: Optional[ProjectContext] = None
+) -> Optional[Path]:
+    ctx = get_context(ctx)
     p = Path(p).absolute()
 
-    lib_info = get_lib_info(p)
+    lib_info = ctx.get_lib_info(p)
 
     if lib_info.benchmark_dir is None:
         return None
@@ -951,7 +1149,7 @@ def get_benchmark_source_path(p: Path) -> Optional[Path]:
         return (
             lib_info.benchmark_dir
             / "src"
-            / with_suffix_appended(get_subrelpath(p), ".cc")
+            / with_suffix_appended(get_subrelpath(p, ctx=ctx), ".cc")
         )
 
 
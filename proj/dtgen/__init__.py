@@ -1,3 +1,7 @@
 from .project import (
     run_dtgen as run_dtgen,
 )
+from .watch import (
+    is_dtgen_watch_running as is_dtgen_watch_running,
+    watch_dtgen as watch_dtgen,
+)
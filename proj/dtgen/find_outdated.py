@@ -1,21 +1,25 @@
 from proj.config_file import (
     ProjectConfig,
-    get_possible_spec_paths,
+)
+from .manifest import (
+    DtgenTree,
+    scan_dtgen_tree,
+    update_dtgen_manifest,
 )
 from pathlib import Path
 from typing import (
     Iterator,
+    Optional,
 )
-import itertools
 
 
-def find_outdated(root: Path, config: ProjectConfig) -> Iterator[Path]:
-    for p in itertools.chain(
-        root.rglob("**/*.dtg" + config.header_extension),
-        root.rglob("**/*.dtg.cc"),
-    ):
-        if not any(
-            possible_spec_path.is_file()
-            for possible_spec_path in get_possible_spec_paths(p)
-        ):
+def find_outdated(
+    root: Path, config: ProjectConfig, tree: Optional[DtgenTree] = None
+) -> Iterator[Path]:
+    if tree is None:
+        tree = scan_dtgen_tree(root, config)
+    manifest = update_dtgen_manifest(root, config, tree.spec_paths)
+    expected = {root / p for p in manifest.all_outputs}
+    for p in tree.generated_paths:
+        if p not in expected:
             yield p
@@ -0,0 +1,1193 @@
+from dataclasses import dataclass, replace
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+import heapq
+import re
+
+# Lays out the C++ emitted by the dtgen renderers the way clang-format would
+# with the project's .clang-format-for-format-sh (LLVM-based, 80 columns,
+# 2-space indent, no bin-packing), so that generated files can be written
+# without a clang-format process per file. This only understands the subset
+# of C++ that dtgen generates.
+
+COLUMN_LIMIT = 80
+INDENT_WIDTH = 2
+CONTINUATION_INDENT_WIDTH = 4
+
+PENALTY_EXCESS_CHARACTER = 1000000
+PENALTY_BREAK_ASSIGNMENT = 2
+PENALTY_BREAK_BEFORE_FIRST_CALL_PARAMETER = 19
+PENALTY_BREAK_FIRST_LESS_LESS = 120
+PENALTY_BREAK_STRING = 1000
+PENALTY_RETURN_TYPE_ON_ITS_OWN_LINE = 60
+
+# give up on finding the optimal layout for a line after exploring this many
+# states, as clang-format does
+MAX_STATES = 5000
+
+TOKEN_RE = re.compile(
+    r"""
+    (?P<line_comment>//[^\n]*)
+    | (?P<block_comment>/\*.*?\*/)
+    | (?P<string>"(?:\\.|[^"\\\n])*")
+    | (?P<char>'(?:\\.|[^'\\\n])*')
+    | (?P<number>\.?\d[\w.']*)
+    | (?P<word>[A-Za-z_]\w*)
+    | (?P<punct>::|->|\.\.\.|<<=|<<|<=|>=|==|!=|&&|\|\||[-+*/%^&|]=|\+\+|--|[{}()\[\];,<>=+\-*/%&|^!~?:.])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+PP_RE = re.compile(r"#[^\n]*")
+
+KEYWORDS = frozenset(
+    [
+        "break",
+        "case",
+        "class",
+        "const",
+        "constexpr",
+        "default",
+        "delete",
+        "else",
+        "enum",
+        "explicit",
+        "friend",
+        "if",
+        "inline",
+        "namespace",
+        "noexcept",
+        "operator",
+        "override",
+        "private",
+        "protected",
+        "public",
+        "return",
+        "static",
+        "struct",
+        "switch",
+        "template",
+        "throw",
+        "typename",
+        "union",
+        "using",
+        "virtual",
+        "while",
+        "for",
+    ]
+)
+
+# keywords after which a unary operator or a parenthesized expression follows
+EXPRESSION_KEYWORDS = frozenset(["return", "case", "throw"])
+
+CONTROL_KEYWORDS = frozenset(["if", "switch", "while", "for", "catch"])
+
+RECORD_KEYWORDS = frozenset(["struct", "class", "union"])
+
+# binding precedences, following clang's prec::Level
+PRECEDENCE: Dict[str, int] = {
+    ",": 1,
+    "=": 2,
+    "+=": 2,
+    "-=": 2,
+    "*=": 2,
+    "/=": 2,
+    "%=": 2,
+    "^=": 2,
+    "|=": 2,
+    "&=": 2,
+    "<<=": 2,
+    "?": 3,
+    "||": 4,
+    "&&": 5,
+    "|": 6,
+    "^": 7,
+    "&": 8,
+    "==": 9,
+    "!=": 9,
+    "<": 10,
+    ">": 10,
+    "<=": 10,
+    ">=": 10,
+    "<<": 12,
+    ">>": 12,
+    "+": 13,
+    "-": 13,
+    "*": 14,
+    "/": 14,
+    "%": 14,
+}
+ASSIGNMENT_PRECEDENCE = 2
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+    newlines_before: int
+    column: int
+    # filled in by _annotate
+    role: str = ""
+    # parenthesis nesting, used to weigh line breaks like clang-format's
+    # binding strength
+    binding_strength: int = 0
+    # index of the matching bracket for openers and closers
+    match: Optional[int] = None
+    # for openers: whether the bracketed list contains top-level commas
+    has_commas: bool = False
+    # for openers: whether they are part of an operand of a binary operator
+    in_binary_expression: bool = False
+    split_penalty: int = 0
+    can_break_before: bool = False
+    space_before: bool = False
+
+    @property
+    def is_comment(self) -> bool:
+        return self.kind in ("line_comment", "block_comment")
+
+
+def tokenize(code: str) -> List[Token]:
+    result = []
+    pos = 0
+    newlines = 0
+    line_start = 0
+    at_line_start = True
+    while pos < len(code):
+        c = code[pos]
+        if c == "\n":
+            newlines += 1
+            at_line_start = True
+            pos += 1
+            line_start = pos
+            continue
+        if c.isspace():
+            pos += 1
+            continue
+        if c == "#" and at_line_start:
+            m = PP_RE.match(code, pos)
+            assert m is not None
+            result.append(Token("pp", m.group().rstrip(), newlines, pos - line_start))
+        else:
+            m = TOKEN_RE.match(code, pos)
+            if m is None:
+                raise ValueError(f"Cannot tokenize {code[pos:pos + 20]!r}")
+            kind = m.lastgroup
+            assert kind is not None
+            text = m.group()
+            if kind == "block_comment":
+                text = "\n".join(l.rstrip() for l in text.split("\n"))
+            if kind == "string" and len(result) > 0 and result[-1].kind == "string":
+                # adjacent literals are rejoined so that they are split again
+                # wherever the column limit requires
+                result[-1].text = result[-1].text[:-1] + text[1:]
+            else:
+                result.append(Token(kind, text, newlines, pos - line_start))
+        pos = m.end()
+        newlines = 0
+        at_line_start = False
+    return result
+
+
+@dataclass
+class Line:
+    level: int
+    tokens: List[Token]
+    blank_before: bool = False
+    # the kind of block opened by this line, if any
+    opens: Optional[str] = None
+    # whether the line is a statement inside a function body, as opposed
+    # to a declaration
+    in_code: bool = False
+
+    @property
+    def is_pp(self) -> bool:
+        return self.tokens[0].kind == "pp"
+
+
+@dataclass
+class _Block:
+    kind: str
+    level: int
+    name: str = ""
+    in_label: bool = False
+
+    @property
+    def body_level(self) -> int:
+        if self.kind == "namespace":
+            return self.level
+        elif self.kind == "switch":
+            return self.level + (2 if self.in_label else 1)
+        else:
+            return self.level + 1
+
+
+def _block_kind(cur: Sequence[Token], depth: int) -> Optional[str]:
+    if depth > 0 or len(cur) == 0:
+        return None
+    if cur[0].text == "}":
+        cur = cur[1:]
+    first = cur[0].text
+    last = cur[-1].text
+    if first == "namespace":
+        return "namespace"
+    elif first in RECORD_KEYWORDS:
+        return "record"
+    elif first == "enum":
+        return "enum"
+    elif first == "switch":
+        return "switch"
+    elif first in CONTROL_KEYWORDS or first == "else":
+        return "control"
+    elif first in ("case", "default") and last == ":":
+        return "case"
+    elif last in (")", "const", "override", "noexcept"):
+        return "function"
+    else:
+        return None
+
+
+def _find_closing_brace(tokens: Sequence[Token], i: int) -> int:
+    depth = 0
+    for j in range(i, len(tokens)):
+        if tokens[j].text == "{":
+            depth += 1
+        elif tokens[j].text == "}":
+            depth -= 1
+            if depth == 0:
+                return j
+    raise ValueError("Unbalanced braces")
+
+
+def _namespace_comment(name: str) -> Token:
+    if name == "":
+        text = "// namespace"
+    else:
+        text = f"// namespace {name}"
+    return Token("line_comment", text, 0, 0)
+
+
+def split_lines(tokens: Sequence[Token]) -> List[Line]:
+    lines: List[Line] = []
+    stack: List[_Block] = []
+    cur: List[Token] = []
+    cur_level = 0
+    # brackets opened on the current line that are not blocks
+    depth: List[str] = []
+    angle_balance = 0
+    # a closing brace is kept on the current line until we know whether a
+    # `;` or `else` follows it
+    pending_close = False
+    skip_namespace_comment = False
+
+    def level() -> int:
+        return stack[-1].body_level if len(stack) > 0 else 0
+
+    def flush() -> None:
+        nonlocal cur, depth, pending_close, angle_balance
+        if len(cur) > 0:
+            in_code = any(
+                b.kind in ("function", "control", "switch", "case") for b in stack
+            )
+            lines.append(Line(cur_level, cur, in_code=in_code))
+        cur = []
+        depth = []
+        pending_close = False
+        angle_balance = 0
+
+    def append(t: Token) -> None:
+        nonlocal cur_level
+        if len(cur) == 0:
+            cur_level = level()
+        cur.append(t)
+
+    i = 0
+    while i < len(tokens):
+        t = tokens[i]
+        i += 1
+
+        if skip_namespace_comment:
+            skip_namespace_comment = False
+            if (
+                t.kind == "line_comment"
+                and t.newlines_before == 0
+                and t.text.startswith("// namespace")
+            ):
+                continue
+
+        if pending_close:
+            if t.text in (";", "else"):
+                pending_close = False
+            else:
+                flush()
+
+        if t.kind == "pp":
+            flush()
+            lines.append(Line(0, [t]))
+        elif t.kind == "line_comment":
+            if len(cur) == 0 or t.newlines_before > 0:
+                flush()
+                append(t)
+            else:
+                cur.append(t)
+            flush()
+        elif t.kind == "block_comment":
+            flush()
+            append(t)
+            flush()
+        elif t.text == "{" and _block_kind(cur, len(depth)) is not None:
+            kind = _block_kind(cur, len(depth))
+            assert kind is not None
+            end = _find_closing_brace(tokens, i - 1)
+            if end == i and kind in ("function", "record"):
+                # empty bodies stay on the line that opens them
+                t.role = "block_open"
+                tokens[end].role = "block_close"
+                cur.extend([t, tokens[end]])
+                i = end + 1
+                if kind == "function":
+                    flush()
+                continue
+            if kind == "case":
+                assert len(stack) > 0 and stack[-1].kind == "switch"
+            t.role = "block_open"
+            append(t)
+            name = ""
+            if kind == "namespace":
+                name = "".join(x.text for x in cur[1:-1])
+            block = _Block(kind=kind, level=cur_level, name=name)
+            flush()
+            lines[-1].opens = kind
+            stack.append(block)
+        elif t.text == "}" and len(depth) == 0:
+            flush()
+            block = stack.pop()
+            cur_level = block.level
+            t.role = "block_close"
+            cur.append(t)
+            if block.kind == "namespace":
+                cur.append(_namespace_comment(block.name))
+                flush()
+                skip_namespace_comment = True
+            else:
+                pending_close = True
+        elif (
+            t.text in ACCESS_SPECIFIERS
+            and len(cur) == 0
+            and len(stack) > 0
+            and stack[-1].kind == "record"
+            and tokens[i].text == ":"
+        ):
+            # access specifiers are outdented by one level and separated from
+            # whatever precedes them in the record by a blank line
+            lines.append(
+                Line(
+                    stack[-1].level,
+                    [t, tokens[i]],
+                    blank_before=lines[-1].opens != "record",
+                )
+            )
+            i += 1
+        elif (
+            t.text in ("case", "default")
+            and len(cur) == 0
+            and len(stack) > 0
+            and stack[-1].kind == "switch"
+        ):
+            stack[-1].in_label = False
+            append(t)
+            while i < len(tokens) and tokens[i].text != ":":
+                append(tokens[i])
+                i += 1
+            append(tokens[i])
+            i += 1
+            if tokens[i].text != "{":
+                flush()
+                stack[-1].in_label = True
+        else:
+            append(t)
+            if t.text in ("(", "[", "{"):
+                depth.append(t.text)
+            elif t.text in (")", "]", "}"):
+                depth.pop()
+            elif t.text == ";" and len(depth) == 0:
+                flush()
+            elif t.text == "," and len(depth) == 0 and stack[-1].kind == "enum":
+                flush()
+            elif cur[0].text == "template" and t.text in ("<", ">"):
+                angle_balance += 1 if t.text == "<" else -1
+                if angle_balance == 0:
+                    flush()
+
+    flush()
+    return lines
+
+
+ASSIGNMENT_OPERATORS = frozenset(
+    op for op, prec in PRECEDENCE.items() if prec == ASSIGNMENT_PRECEDENCE
+)
+
+ACCESS_SPECIFIERS = frozenset(["public", "protected", "private"])
+
+SPECIFIERS = frozenset(
+    ["static", "explicit", "virtual", "inline", "constexpr", "friend"]
+)
+
+OPENERS = {"(": ")", "[": "]", "{": "}"}
+
+BINDING_STRENGTH = {"(": 1, "{": 1, "[": 10, "<": 12}
+
+
+def _is_adjacent(a: Token, b: Token) -> bool:
+    return b.newlines_before == 0 and a.column + len(a.text) == b.column
+
+
+def _match_brackets(tokens: List[Token]) -> List[Token]:
+    result: List[Token] = []
+    stack: List[int] = []
+    i = 0
+    while i < len(tokens):
+        t = tokens[i]
+        prev = result[-1] if len(result) > 0 else None
+        i += 1
+        if prev is not None and prev.text == "operator" and t.kind == "punct":
+            t.role = "operator_name"
+            result.append(t)
+            if t.text == "(":
+                tokens[i].role = "operator_name"
+                result.append(tokens[i])
+                i += 1
+            else:
+                while tokens[i].text != "(":
+                    tokens[i].role = "operator_name"
+                    result.append(tokens[i])
+                    i += 1
+            continue
+
+        if (
+            t.text == "<"
+            and prev is not None
+            and (
+                prev.text == "template"
+                or (
+                    prev.kind == "word"
+                    and prev.text not in KEYWORDS
+                    and _is_adjacent(prev, t)
+                )
+            )
+        ):
+            t.role = "template_open"
+            stack.append(len(result))
+        elif (
+            t.text == ">"
+            and len(stack) > 0
+            and result[stack[-1]].role == "template_open"
+        ):
+            t.role = "template_close"
+            t.match = stack[-1]
+            result[stack.pop()].match = len(result)
+        elif (
+            t.text == ">"
+            and i < len(tokens)
+            and tokens[i].text == ">"
+            and _is_adjacent(t, tokens[i])
+        ):
+            t = Token("punct", ">>", t.newlines_before, t.column)
+            i += 1
+        elif t.role in ("block_open", "block_close"):
+            pass
+        elif t.text in OPENERS:
+            stack.append(len(result))
+        elif t.text in (")", "]", "}"):
+            t.match = stack[-1]
+            result[stack.pop()].match = len(result)
+        result.append(t)
+    return result
+
+
+def _annotate_roles(tokens: List[Token]) -> None:
+    is_label = tokens[0].text in ("case", "default") or (
+        tokens[0].text in ACCESS_SPECIFIERS and len(tokens) == 2
+    )
+    depth = 0
+    seen_question = False
+    for k, t in enumerate(tokens):
+        prev = tokens[k - 1] if k > 0 else None
+        if t.text in OPENERS or t.role == "template_open":
+            depth += 1
+        elif t.match is not None and t.match < k:
+            depth -= 1
+
+        if t.role != "":
+            continue
+        if t.kind != "punct":
+            t.role = t.kind
+        elif t.text in ("&", "&&", "*"):
+            if prev is not None and (
+                prev.role == "template_close"
+                or (prev.kind == "word" and prev.text not in EXPRESSION_KEYWORDS)
+            ):
+                t.role = "pointer"
+            elif (
+                prev is None
+                or prev.text in OPENERS
+                or prev.role
+                in (
+                    "binary",
+                    "assign",
+                    "unary",
+                )
+                or prev.text in (",", "return", "throw", "case")
+            ):
+                t.role = "unary"
+            else:
+                t.role = "binary"
+        elif t.text in ("!", "~"):
+            t.role = "unary"
+        elif t.text in ("+", "-") and (
+            prev is None
+            or prev.text in OPENERS
+            or prev.text in (",", "return", "throw", "case")
+            or prev.role in ("binary", "assign", "unary")
+        ):
+            t.role = "unary"
+        elif t.text == ":":
+            if is_label and depth == 0:
+                t.role = "case_colon"
+                is_label = False
+            elif seen_question:
+                t.role = "binary"
+            else:
+                t.role = "ctor_colon"
+        elif t.text == "?":
+            seen_question = True
+            t.role = "binary"
+        elif t.text in ASSIGNMENT_OPERATORS:
+            t.role = "assign"
+        elif t.text in PRECEDENCE and t.text != ",":
+            t.role = "binary"
+        elif t.text == "{":
+            t.role = "brace_open"
+        elif t.text == "}":
+            t.role = "brace_close"
+        else:
+            t.role = t.text
+
+
+def _is_call_paren(prev: Token) -> bool:
+    return (
+        (prev.kind == "word" and prev.text not in KEYWORDS)
+        or prev.text in (")", "]", "}", "operator", "decltype", "static_assert")
+        or prev.role in ("template_close", "operator_name", "brace_close")
+    )
+
+
+def _space_before(prev: Token, t: Token) -> bool:
+    p = prev.text
+    c = t.text
+    if t.kind == "line_comment":
+        return True
+    if c in (",", ";", ")", "]") or t.role in ("brace_close", "template_close"):
+        return False
+    if p in ("(", "[") or prev.role in ("brace_open", "template_open", "unary"):
+        return False
+    if p in (".", "->", "::") or c in (".", "->", "..."):
+        return False
+    if p == ",":
+        return True
+    if c == "::":
+        return prev.kind == "word" and (
+            prev.text in KEYWORDS or not _is_adjacent(prev, t)
+        )
+    if t.role == "operator_name":
+        return False
+    if t.role == "template_open":
+        return p == "template"
+    if prev.role == "pointer":
+        return False
+    if t.role == "pointer":
+        return True
+    if c == "(":
+        if p in CONTROL_KEYWORDS or p in EXPRESSION_KEYWORDS:
+            return True
+        return not _is_call_paren(prev)
+    if t.role == "brace_open":
+        return not (
+            prev.kind == "word" or prev.role in ("template_close", "operator_name")
+        )
+    if t.role == "block_close":
+        return prev.role != "block_open"
+    if c == "[":
+        return False
+    if t.role == "case_colon":
+        return False
+    return True
+
+
+def _binding_strengths(tokens: Sequence[Token]) -> List[int]:
+    result: List[int] = []
+    strength = 1
+    stack: List[int] = []
+    for t in tokens:
+        if t.match is not None and t.match < len(result):
+            strength -= stack.pop()
+        result.append(strength)
+        if t.text in OPENERS or t.role == "template_open":
+            weight = BINDING_STRENGTH["<" if t.role == "template_open" else t.text]
+            stack.append(weight)
+            strength += weight
+    return result
+
+
+def _find_declaration_paren(tokens: Sequence[Token], in_code: bool) -> Optional[int]:
+    if in_code or tokens[0].text in ("template", "return", "using", "typedef"):
+        return None
+    for k, t in enumerate(tokens):
+        if t.role in ("assign", "block_open", "brace_open"):
+            return None
+        if t.text == "(" and t.role != "operator_name":
+            return k if k > 0 else None
+    return None
+
+
+def _find_declaration_name(tokens: Sequence[Token], paren: int) -> Optional[int]:
+    k = paren - 1
+    if tokens[k].role == "operator_name" or tokens[k].text == "operator":
+        return None
+    while k >= 2 and tokens[k - 1].text == "::":
+        qualifier = tokens[k - 2]
+        if qualifier.role == "template_close":
+            assert qualifier.match is not None
+            k = qualifier.match - 1
+        else:
+            k = k - 2
+    if k == 0 or tokens[k].kind != "word":
+        return None
+    if all(t.text in SPECIFIERS for t in tokens[:k]):
+        return None
+    return k
+
+
+def _split_penalty(
+    tokens: Sequence[Token],
+    k: int,
+    declaration_name: Optional[int],
+    declaration_paren: Optional[int],
+) -> Optional[int]:
+    t = tokens[k]
+    prev = tokens[k - 1]
+    if t.is_comment or t.kind == "pp":
+        return None
+    if k == declaration_name:
+        return PENALTY_RETURN_TYPE_ON_ITS_OWN_LINE
+    if t.role == "ctor_colon":
+        return 0
+    if t.role == "block_close" and prev.role == "block_open":
+        # only happens when the merged empty body does not fit
+        return 1
+    if t.text == "<<" and t.role == "binary":
+        first = all(x.text != "<<" for x in tokens[:k] if x.role == "binary")
+        return PENALTY_BREAK_FIRST_LESS_LESS if first else 1
+    if prev.text == "<<" and prev.role == "binary":
+        return None
+    if prev.text in ("(", "[") or prev.role == "brace_open":
+        if t.text in (")", "]") or t.role == "brace_close":
+            return None
+        if k - 1 == declaration_paren:
+            return 100
+        return PENALTY_BREAK_BEFORE_FIRST_CALL_PARAMETER
+    if prev.role == "template_open":
+        if t.role == "template_close":
+            return None
+        return 100
+    if prev.text == ",":
+        return 1 if t.kind != "line_comment" else None
+    if prev.role == "assign":
+        return PENALTY_BREAK_ASSIGNMENT
+    if prev.role == "binary" and prev.text not in ("?", ":"):
+        return PRECEDENCE.get(prev.text, 3)
+    if t.text in ("?",) or (t.text == ":" and t.role == "binary"):
+        return 3
+    if prev.role == "ctor_colon":
+        return None
+    return None
+
+
+def _annotate(tokens: List[Token], in_code: bool) -> Tuple[List[Token], Optional[int]]:
+    tokens = _match_brackets(tokens)
+    _annotate_roles(tokens)
+    strengths = _binding_strengths(tokens)
+
+    declaration_paren = _find_declaration_paren(tokens, in_code)
+    declaration_name = None
+    if declaration_paren is not None:
+        declaration_name = _find_declaration_name(tokens, declaration_paren)
+
+    _mark_binary_operands(tokens)
+    for k, t in enumerate(tokens):
+        # the braces of a block do not bind to the tokens around them
+        t.binding_strength = 0 if t.role == "block_close" else strengths[k]
+        if t.match is not None and t.match > k:
+            t.has_commas = _has_top_level_comma(tokens, k)
+        if k == 0:
+            continue
+        t.space_before = _space_before(tokens[k - 1], t)
+        penalty = _split_penalty(tokens, k, declaration_name, declaration_paren)
+        t.can_break_before = penalty is not None
+        if penalty is not None:
+            t.split_penalty = 20 * t.binding_strength + penalty
+    return tokens, declaration_name
+
+
+def _mark_binary_operands(tokens: Sequence[Token]) -> None:
+    # scopes are identified by the index of their opener, -1 for the line
+    scopes = [-1]
+    scope_of: Dict[int, int] = {}
+    binary_scopes = set()
+    for k, t in enumerate(tokens):
+        if t.match is not None and t.match < k:
+            scopes.pop()
+        if t.role == "binary":
+            binary_scopes.add(scopes[-1])
+        if t.match is not None and t.match > k:
+            scope_of[k] = scopes[-1]
+            scopes.append(k)
+    for k, scope in scope_of.items():
+        tokens[k].in_binary_expression = scope in binary_scopes
+
+
+def _has_top_level_comma(tokens: Sequence[Token], opener: int) -> bool:
+    end = tokens[opener].match
+    assert end is not None
+    k = opener + 1
+    while k < end:
+        t = tokens[k]
+        if t.text == ",":
+            return True
+        if t.match is not None and t.match > k:
+            k = t.match
+        k += 1
+    return False
+
+
+def _split_string(text: str, column: int) -> List[str]:
+    pieces = []
+    rest = text[1:-1]
+    while column + len(rest) + 2 > COLUMN_LIMIT:
+        max_chars = COLUMN_LIMIT - column - 2
+        split = rest.rfind(" ", 0, max_chars)
+        if split <= 0:
+            break
+        pieces.append(f'"{rest[:split + 1]}"')
+        rest = rest[split + 1 :]
+    pieces.append(f'"{rest}"')
+    return pieces
+
+
+# modes of a bracketed list with several elements: with bin-packing disabled
+# the elements either all stay on one line or each start on a new line
+FREE = 0
+PACKED = 1
+ONE_PER_LINE = 2
+
+
+@dataclass(frozen=True)
+class _Frame:
+    opener: int
+    mode: int
+    # column of elements that start on a new line
+    indent: int
+    # column at which the current element starts
+    last_space: int
+    # column that operands of a broken binary expression align to
+    operand_start: int
+    first_lessless: int = -1
+    # whether the current operand has been broken across lines, in which case
+    # the following binary operator must be followed by a break as well
+    operand_broken: bool = False
+
+
+@dataclass(frozen=True)
+class _State:
+    i: int
+    column: int
+    frames: Tuple[_Frame, ...]
+    broke: bool
+
+
+@dataclass(frozen=True)
+class _Node:
+    state: _State
+    parent: Optional["_Node"]
+    newline: bool
+    # column the token leading to this state was placed at
+    column: int
+
+
+def _replace_top(frames: List[_Frame], **kwargs: int) -> None:
+    f = frames[-1]
+    frames[-1] = _Frame(
+        opener=kwargs.get("opener", f.opener),
+        mode=kwargs.get("mode", f.mode),
+        indent=kwargs.get("indent", f.indent),
+        last_space=kwargs.get("last_space", f.last_space),
+        operand_start=kwargs.get("operand_start", f.operand_start),
+        first_lessless=kwargs.get("first_lessless", f.first_lessless),
+    )
+
+
+def _token_width(t: Token) -> int:
+    return len(t.text) + (1 if t.space_before else 0)
+
+
+class _LineBreaker:
+    def __init__(
+        self, tokens: Sequence[Token], indent: int, declaration_name: Optional[int]
+    ) -> None:
+        self.tokens = tokens
+        self.indent = indent
+        self.declaration_name = declaration_name
+        self.remaining = [0] * (len(tokens) + 1)
+        for k in reversed(range(len(tokens))):
+            self.remaining[k] = self.remaining[k + 1] + _token_width(tokens[k])
+
+    def initial(self) -> _State:
+        base = _Frame(
+            opener=-1,
+            mode=FREE,
+            indent=self.indent + CONTINUATION_INDENT_WIDTH,
+            last_space=self.indent,
+            operand_start=self.indent + CONTINUATION_INDENT_WIDTH,
+        )
+        frames = [base]
+        _, column = self._place(self.tokens[0], self.indent)
+        return self._after_token(_State(1, column, tuple(frames), False), frames)[0]
+
+    def _place(self, t: Token, column: int) -> Tuple[int, int]:
+        penalty = 0
+        if t.kind == "string" and column + len(t.text) > COLUMN_LIMIT:
+            pieces = _split_string(t.text, column)
+            penalty += PENALTY_BREAK_STRING * (len(pieces) - 1)
+            for piece in pieces:
+                excess = column + len(piece) - COLUMN_LIMIT
+                if excess > 0:
+                    penalty += PENALTY_EXCESS_CHARACTER * excess
+            return penalty, column + len(pieces[-1])
+        end = column + len(t.text)
+        if end > COLUMN_LIMIT and t.kind != "line_comment":
+            penalty += PENALTY_EXCESS_CHARACTER * (end - COLUMN_LIMIT)
+        return penalty, end
+
+    def _after_token(self, state: _State, frames: List[_Frame]) -> List[_State]:
+        t = self.tokens[state.i - 1]
+        if (t.text in OPENERS or t.role == "template_open") and t.match is not None:
+            modes = [FREE]
+            if t.has_commas and t.role != "template_open":
+                modes = [PACKED, ONE_PER_LINE]
+            parent = frames[-1]
+            if t.in_binary_expression:
+                base = parent.operand_start
+            else:
+                base = parent.last_space
+            return [
+                _State(
+                    state.i,
+                    state.column,
+                    tuple(
+                        [
+                            *frames,
+                            _Frame(
+                                opener=state.i - 1,
+                                mode=mode,
+                                indent=base + CONTINUATION_INDENT_WIDTH,
+                                last_space=base,
+                                operand_start=base + CONTINUATION_INDENT_WIDTH,
+                            ),
+                        ]
+                    ),
+                    state.broke,
+                )
+                for mode in modes
+            ]
+        return [_State(state.i, state.column, tuple(frames), state.broke)]
+
+    def successors(self, state: _State, newline: bool) -> List[Tuple[int, int, _State]]:
+        i = state.i
+        t = self.tokens[i]
+        prev = self.tokens[i - 1]
+        frames = list(state.frames)
+        if t.match is not None and t.match < i:
+            frames.pop()
+        f = frames[-1]
+        after_opener = i == f.opener + 1
+
+        penalty = 0
+        if newline:
+            if not t.can_break_before:
+                return []
+            for fr in frames:
+                if fr.mode == PACKED and not (fr is f and after_opener):
+                    return []
+            penalty += t.split_penalty
+            frames = [replace(fr, operand_broken=True) for fr in frames[:-1]] + [f]
+            if after_opener:
+                column = f.last_space + CONTINUATION_INDENT_WIDTH
+                _replace_top(
+                    frames, indent=column, last_space=column, operand_start=column
+                )
+            elif prev.text == ",":
+                column = f.indent
+                _replace_top(
+                    frames,
+                    last_space=column,
+                    operand_start=column,
+                    operand_broken=False,
+                )
+            elif t.text == "<<" and t.role == "binary":
+                column = f.first_lessless if f.first_lessless >= 0 else f.operand_start
+            elif prev.role == "assign":
+                column = f.last_space + CONTINUATION_INDENT_WIDTH
+                _replace_top(frames, operand_start=column, operand_broken=False)
+            elif prev.role == "binary":
+                column = f.operand_start
+            elif t.role == "ctor_colon":
+                column = self.indent + CONTINUATION_INDENT_WIDTH
+                _replace_top(
+                    frames,
+                    indent=column + 2,
+                    last_space=column + 2,
+                    operand_start=column + 2,
+                )
+            elif t.role == "block_close":
+                column = self.indent
+            elif i == self.declaration_name:
+                # breaking after a very short return type such as `void` is
+                # never worth it
+                if state.column <= CONTINUATION_INDENT_WIDTH:
+                    return []
+                column = self.indent + CONTINUATION_INDENT_WIDTH
+                _replace_top(frames, last_space=column)
+            else:
+                column = f.last_space + CONTINUATION_INDENT_WIDTH
+        else:
+            if f.mode == ONE_PER_LINE and prev.text == "," and t.kind != "line_comment":
+                return []
+            if prev.role == "binary" and prev.text != "<<" and f.operand_broken:
+                return []
+            column = state.column + (1 if t.space_before else 0)
+            if t.role == "ctor_colon" and (
+                state.broke or state.column + self.remaining[i] > COLUMN_LIMIT
+            ):
+                return []
+            if after_opener:
+                # opening a scope without breaking does not move the column
+                # that a break directly after a nested opener indents from,
+                # unless the scope is a list whose elements align
+                if f.mode == FREE:
+                    _replace_top(frames, indent=column, operand_start=column)
+                else:
+                    _replace_top(
+                        frames, indent=column, last_space=column, operand_start=column
+                    )
+            elif prev.text == ",":
+                _replace_top(
+                    frames,
+                    last_space=column,
+                    operand_start=column,
+                    operand_broken=False,
+                )
+            elif prev.role == "assign" or (
+                prev.text in ("return", "throw") and f.opener == -1
+            ):
+                _replace_top(frames, operand_start=column, operand_broken=False)
+            elif prev.role == "ctor_colon":
+                _replace_top(
+                    frames, indent=column, last_space=column, operand_start=column
+                )
+
+        if t.text == "<<" and t.role == "binary" and frames[-1].first_lessless < 0:
+            _replace_top(frames, first_lessless=column)
+
+        place_penalty, end = self._place(t, column)
+        penalty += place_penalty
+        next_state = _State(i + 1, end, tuple(frames), state.broke or newline)
+        return [(penalty, column, s) for s in self._after_token(next_state, frames)]
+
+    def solve(self) -> List[Tuple[bool, int]]:
+        start = _Node(self.initial(), None, False, self.indent)
+        queue: List[Tuple[int, int, _Node]] = [(0, 0, start)]
+        seen = set()
+        count = 0
+        while len(queue) > 0:
+            penalty, _, node = heapq.heappop(queue)
+            state = node.state
+            if state.i == len(self.tokens):
+                result = []
+                n: Optional[_Node] = node
+                while n is not None:
+                    result.append((n.newline, n.column))
+                    n = n.parent
+                return list(reversed(result))
+            if state in seen:
+                continue
+            seen.add(state)
+            if len(seen) > MAX_STATES:
+                break
+            for newline in (False, True):
+                for added, column, next_state in self.successors(state, newline):
+                    count += 1
+                    heapq.heappush(
+                        queue,
+                        (
+                            penalty + added,
+                            count,
+                            _Node(next_state, node, newline, column),
+                        ),
+                    )
+        return self._unbroken()
+
+    def _unbroken(self) -> List[Tuple[bool, int]]:
+        result = [(False, self.indent)]
+        column = self.indent + len(self.tokens[0].text)
+        for t in self.tokens[1:]:
+            if t.space_before:
+                column += 1
+            result.append((False, column))
+            column += len(t.text)
+        return result
+
+    def render(self) -> List[str]:
+        result: List[str] = []
+        current = ""
+        for t, (newline, column) in zip(self.tokens, self.solve()):
+            if newline or len(current) == 0:
+                if len(current) > 0:
+                    result.append(current)
+                current = " " * column
+            elif t.space_before:
+                current += " "
+            if t.kind == "string" and column + len(t.text) > COLUMN_LIMIT:
+                pieces = _split_string(t.text, column)
+                current += pieces[0]
+                for piece in pieces[1:]:
+                    result.append(current)
+                    current = " " * column + piece
+            else:
+                current += t.text
+        result.append(current)
+        return result
+
+
+INCLUDE_RE = re.compile(r"#\s*include\s*(?P<path>[<\"][^>\"]*[>\"])")
+
+
+def _include_priority(path: str) -> int:
+    if re.match(r'^"(llvm|llvm-c|clang|clang-c)/', path, re.IGNORECASE):
+        return 2
+    elif re.match(r'^(<|"(gtest|gmock|isl|json)/)', path, re.IGNORECASE):
+        return 3
+    else:
+        return 1
+
+
+def _sort_includes(lines: List[Line]) -> List[Line]:
+    result: List[Line] = []
+    block: List[Tuple[Tuple[int, str], Line]] = []
+
+    def flush_block() -> None:
+        if len(block) == 0:
+            return
+        newlines_before = block[0][1].tokens[0].newlines_before
+        seen = set()
+        for key, line in sorted(block, key=lambda b: b[0]):
+            if key not in seen:
+                seen.add(key)
+                line.tokens[0].newlines_before = 1
+                result.append(line)
+        result[len(result) - len(seen)].tokens[0].newlines_before = newlines_before
+        block.clear()
+
+    for line in lines:
+        m = INCLUDE_RE.match(line.tokens[0].text) if line.is_pp else None
+        if m is None or (len(block) > 0 and line.tokens[0].newlines_before > 1):
+            flush_block()
+        if m is None:
+            result.append(line)
+        else:
+            path = m.group("path")
+            block.append(((_include_priority(path), path), line))
+    flush_block()
+    return result
+
+
+def _join_short_enums(lines: List[Line]) -> List[Line]:
+    result: List[Line] = []
+    k = 0
+    while k < len(lines):
+        line = lines[k]
+        k += 1
+        if line.opens != "enum":
+            result.append(line)
+            continue
+        end = k
+        while lines[end].tokens[0].text != "}":
+            end += 1
+        body = lines[k:end]
+        tokens = [*line.tokens]
+        for l in body:
+            tokens.extend(l.tokens)
+        tokens.extend(lines[end].tokens)
+        width = line.level * INDENT_WIDTH + sum(len(t.text) + 1 for t in tokens) - 1
+        if width <= COLUMN_LIMIT and not any(
+            t.is_comment or t.newlines_before > 1 for l in body for t in l.tokens
+        ):
+            result.append(Line(line.level, tokens, in_code=line.in_code))
+            k = end + 1
+        else:
+            result.append(line)
+    return result
+
+
+def _render_comment(t: Token, indent: int) -> List[str]:
+    lines = t.text.split("\n")
+    delta = indent - t.column
+    result = [" " * indent + lines[0]]
+    for l in lines[1:]:
+        if delta >= 0:
+            result.append(" " * delta + l if l != "" else l)
+        else:
+            stripped = len(l) - len(l.lstrip(" "))
+            result.append(l[min(stripped, -delta) :])
+    return result
+
+
+def _render_line(line: Line) -> List[str]:
+    indent = line.level * INDENT_WIDTH
+    first = line.tokens[0]
+    if line.is_pp:
+        return [first.text]
+    if len(line.tokens) == 1 and first.is_comment:
+        return _render_comment(first, indent)
+    tokens, declaration_name = _annotate(list(line.tokens), line.in_code)
+    return _LineBreaker(tokens, indent, declaration_name).render()
+
+
+def layout_cpp(code: str) -> str:
+    lines = _join_short_enums(_sort_includes(split_lines(tokenize(code))))
+    result: List[str] = []
+    after_access_specifier = False
+    for line in lines:
+        if line.blank_before or (
+            len(result) > 0
+            and line.tokens[0].newlines_before > 1
+            and line.tokens[0].text != "}"
+            and not after_access_specifier
+        ):
+            result.append("")
+        after_access_specifier = line.tokens[0].text in ACCESS_SPECIFIERS
+        result.extend(_render_line(line))
+    return "\n".join(l.rstrip() for l in result).strip("\n") + "\n"
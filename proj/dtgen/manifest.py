@@ -0,0 +1,178 @@
+from proj.config_file import (
+    ProjectConfig,
+    ProjectContext,
+    get_source_path,
+)
+from proj.utils import write_file_if_changed
+from pathlib import Path
+from typing import (
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from dataclasses import dataclass
+from .. import json as json
+from ..json import (
+    Json,
+)
+import logging
+import os
+
+_l = logging.getLogger(__name__)
+
+DTGEN_MANIFEST_FILENAME = ".proj-dtgen-manifest.json"
+DTGEN_MANIFEST_VERSION = 1
+
+SPEC_SUFFIXES = (".struct.toml", ".enum.toml", ".variant.toml")
+
+PRUNED_DIR_NAMES = frozenset([".git"])
+
+
+def get_pruned_dirs(root: Path) -> FrozenSet[Path]:
+    return frozenset(
+        [
+            root / "triton",
+            root / "deps",
+            root / "build",
+        ]
+    )
+
+
+@dataclass(frozen=True)
+class DtgenTree:
+    spec_paths: Tuple[Path, ...]
+    generated_paths: Tuple[Path, ...]
+
+
+def scan_dtgen_tree(root: Path, config: ProjectConfig) -> DtgenTree:
+    pruned = {str(p) for p in get_pruned_dirs(root)}
+    generated_suffixes = (".dtg" + config.header_extension, ".dtg.cc")
+
+    spec_paths: List[Path] = []
+    generated_paths: List[Path] = []
+    to_visit = [str(root)]
+    while len(to_visit) > 0:
+        with os.scandir(to_visit.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in PRUNED_DIR_NAMES and entry.path not in pruned:
+                        to_visit.append(entry.path)
+                elif entry.name.endswith(SPEC_SUFFIXES):
+                    spec_paths.append(Path(entry.path))
+                elif entry.name.endswith(generated_suffixes):
+                    generated_paths.append(Path(entry.path))
+
+    return DtgenTree(
+        spec_paths=tuple(sorted(spec_paths)),
+        generated_paths=tuple(sorted(generated_paths)),
+    )
+
+
+def get_spec_output_paths(
+    root: Path,
+    config: ProjectConfig,
+    spec_path: Path,
+    ctx: Optional[ProjectContext] = None,
+) -> Tuple[Path, Path]:
+    header_path = root / spec_path.with_suffix("").with_suffix(
+        ".dtg" + config.header_extension
+    )
+    source_path = root / get_source_path(header_path, ctx)
+    return (header_path, source_path)
+
+
+# maps each spec file (relative to the project root) to the files generated
+# from it, so that finding out-of-date generated files does not need to
+# reload the config for every generated file in the tree
+@dataclass(frozen=True)
+class DtgenManifest:
+    header_extension: str
+    outputs: Mapping[Path, Tuple[Path, ...]]
+
+    @property
+    def all_outputs(self) -> FrozenSet[Path]:
+        return frozenset(p for ps in self.outputs.values() for p in ps)
+
+    def json(self) -> Json:
+        return {
+            "version": DTGEN_MANIFEST_VERSION,
+            "header_extension": self.header_extension,
+            "outputs": {
+                str(spec): [str(p) for p in ps]
+                for spec, ps in sorted(self.outputs.items())
+            },
+        }
+
+    @staticmethod
+    def from_json(j: Json) -> Optional["DtgenManifest"]:
+        assert isinstance(j, dict)
+        if j.get("version") != DTGEN_MANIFEST_VERSION:
+            return None
+        header_extension = j["header_extension"]
+        assert isinstance(header_extension, str)
+        outputs = j["outputs"]
+        assert isinstance(outputs, dict)
+        result = {}
+        for spec, ps in outputs.items():
+            assert isinstance(ps, list)
+            assert all(isinstance(p, str) for p in ps)
+            result[Path(spec)] = tuple(Path(p) for p in ps)
+        return DtgenManifest(header_extension=header_extension, outputs=result)
+
+
+def get_dtgen_manifest_path(root: Path) -> Path:
+    return root / "build" / DTGEN_MANIFEST_FILENAME
+
+
+def load_dtgen_manifest(root: Path) -> Optional[DtgenManifest]:
+    path = get_dtgen_manifest_path(root)
+    try:
+        with path.open("r") as f:
+            return DtgenManifest.from_json(json.loads(f.read()))
+    except FileNotFoundError:
+        return None
+    except (ValueError, AssertionError, KeyError):
+        _l.warning("Ignoring malformed dtgen manifest at %s", path)
+        return None
+
+
+def save_dtgen_manifest(root: Path, manifest: DtgenManifest) -> None:
+    write_file_if_changed(
+        get_dtgen_manifest_path(root),
+        json.dumps(manifest.json(), indent=2).encode("utf-8"),
+    )
+
+
+def update_dtgen_manifest(
+    root: Path,
+    config: ProjectConfig,
+    spec_paths: Sequence[Path],
+) -> DtgenManifest:
+    existing = load_dtgen_manifest(root)
+    if existing is None or existing.header_extension != config.header_extension:
+        previous: Mapping[Path, Tuple[Path, ...]] = {}
+    else:
+        previous = existing.outputs
+
+    ctx = ProjectContext(config)
+    outputs = {}
+    for spec_path in spec_paths:
+        relpath = spec_path.relative_to(root)
+        if relpath in previous:
+            outputs[relpath] = previous[relpath]
+        else:
+            _l.debug(f"Adding {relpath} to dtgen manifest")
+            outputs[relpath] = tuple(
+                p.relative_to(root)
+                for p in get_spec_output_paths(root, config, spec_path, ctx)
+            )
+
+    manifest = DtgenManifest(
+        header_extension=config.header_extension, outputs=outputs
+    )
+    if manifest != existing:
+        save_dtgen_manifest(root, manifest)
+    return manifest
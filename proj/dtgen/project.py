@@ -1,8 +1,9 @@
 from proj.config_file import (
     ProjectConfig,
+    ProjectContext,
     gen_ifndef_uid,
+    get_config,
     get_include_path,
-    get_source_path,
 )
 from proj.format import run_formatter
 from os import PathLike
@@ -14,8 +15,17 @@ from typing import (
     Union,
     Any,
     Mapping,
+    Tuple,
+    List,
 )
 from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import hashlib
+import io
+import multiprocessing
+import tempfile
 from .struct.render import (
     render_header as render_struct_header,
     render_source as render_struct_source,
@@ -41,34 +51,26 @@ from .variant.render import (
     render_source as render_variant_source,
 )
 from proj.hash import get_file_hash
+from proj.utils import write_file_if_changed
 from .. import json as json
 from ..json import (
     Json,
 )
 import logging
 from .find_outdated import find_outdated
+from .layout import layout_cpp
+from .manifest import (
+    get_spec_output_paths,
+    scan_dtgen_tree,
+)
 
 _l = logging.getLogger(__name__)
 
 
-def find_files(root: Path) -> Iterator[Path]:
-    patterns = ["*.struct.toml", "*.enum.toml", "*.variant.toml"]
-    blacklist = [
-        root / "triton",
-        root / "deps",
-        root / "build",
-    ]
-
-    def is_blacklisted(p: Path) -> bool:
-        for blacklisted in blacklist:
-            if found.is_relative_to(blacklisted):
-                return True
-        return False
-
-    for pattern in patterns:
-        for found in root.rglob(pattern):
-            if not is_blacklisted(found):
-                yield found
+def find_files(root: Path, config: Optional[ProjectConfig] = None) -> Iterator[Path]:
+    if config is None:
+        config = get_config(root)
+    yield from scan_dtgen_tree(root, config).spec_paths
 
 
 def render_disclaimer(spec_path: Path, root: Path, f: TextIO) -> None:
@@ -77,12 +79,81 @@ def render_disclaimer(spec_path: Path, root: Path, f: TextIO) -> None:
     f.write(f"// {spec_path.relative_to(root)}\n")
 
 
-def render_proj_metadata(spec_path: Path, root: Path, f: TextIO) -> None:
-    _hash = get_file_hash(spec_path)
-    assert _hash is not None
-    proj_metadata = {"generated_from": _hash.hex()}
+@dataclass(frozen=True)
+class GenerationKey:
+    spec_hash: bytes
+    generator_hash: bytes
+
+    def json(self) -> Json:
+        return {
+            "generated_from": self.spec_hash.hex(),
+            "generator": self.generator_hash.hex(),
+        }
+
+    @staticmethod
+    def from_json(j: Json) -> Optional["GenerationKey"]:
+        if not isinstance(j, dict):
+            return None
+        spec_hash = j.get("generated_from")
+        generator_hash = j.get("generator")
+        if not (isinstance(spec_hash, str) and isinstance(generator_hash, str)):
+            return None
+        return GenerationKey(
+            spec_hash=bytes.fromhex(spec_hash),
+            generator_hash=bytes.fromhex(generator_hash),
+        )
+
+
+DTGEN_SOURCE_DIR = Path(__file__).parent
+
+# the modules whose code determines the generated bytes. the rest of dtgen
+# (the watcher, the manifest, scheduling) is deliberately left out, as every
+# change to the generator hash rewrites every generated file
+DTGEN_RENDER_SOURCES = (
+    "render_utils.py",
+    "enum/spec.py",
+    "enum/render.py",
+    "struct/spec.py",
+    "struct/render.py",
+    "variant/spec.py",
+    "variant/render.py",
+)
+
+DTGEN_LAYOUT_SOURCE = "layout.py"
+
+# the parts of rendering implemented in this file (the includes, header guards
+# and proj-data blocks) are not hashed, so bump this whenever they change
+DTGEN_RENDER_VERSION = 1
+
+
+@functools.cache
+def get_generator_source_hash(builtin_layout: bool) -> bytes:
+    h = hashlib.md5()
+    h.update(str(DTGEN_RENDER_VERSION).encode("utf-8") + b"\0")
+    sources = list(DTGEN_RENDER_SOURCES)
+    if builtin_layout:
+        sources.append(DTGEN_LAYOUT_SOURCE)
+    for name in sources:
+        h.update(name.encode("utf-8") + b"\0")
+        h.update((DTGEN_SOURCE_DIR / name).read_bytes())
+    return h.digest()
+
+
+# identifies everything other than the spec itself that affects the generated
+# files: the generator's own code and the rendering options
+def get_generator_hash(config: ProjectConfig) -> bytes:
+    h = hashlib.md5()
+    h.update(get_generator_source_hash(config.dtgen_builtin_layout))
+    h.update(config.header_extension.encode("utf-8") + b"\0")
+    h.update(b"builtin" if config.dtgen_builtin_layout else b"clang-format")
+    style_hash = get_file_hash(config.base / ".clang-format-for-format-sh")
+    h.update(b"" if style_hash is None else style_hash)
+    return h.digest()
+
+
+def render_proj_metadata(key: GenerationKey, f: TextIO) -> None:
     f.write("/* proj-data\n")
-    f.write(json.dumps(proj_metadata, sort_keys=True, indent=2))
+    f.write(json.dumps(key.json(), sort_keys=True, indent=2))
     f.write("\n*/\n")
 
 
@@ -116,7 +187,7 @@ def load_proj_metadata(p: Path) -> Optional[Json]:
     return found
 
 
-def get_existing_hash(p: Path) -> Optional[bytes]:
+def get_existing_generation_key(p: Path) -> Optional[GenerationKey]:
     if not p.is_file():
         return None
 
@@ -124,129 +195,370 @@ def get_existing_hash(p: Path) -> Optional[bytes]:
     if _loaded is None:
         return None
 
-    assert isinstance(_loaded, dict)
-    as_hex_str = _loaded.get("generated_from", None)
-    if as_hex_str is None:
-        return None
+    return GenerationKey.from_json(_loaded)
 
-    return bytes.fromhex(as_hex_str)
 
+def needs_generate_to_path(key: GenerationKey, root: Path, out: Path) -> bool:
+    existing = get_existing_generation_key(out)
+    _l.debug(f"Generation key of {out.relative_to(root)}: {existing} vs {key}")
+    return existing != key
 
-def needs_generate_to_path(spec_path: Path, root: Path, out: Path) -> bool:
-    if not out.is_file():
-        return True
 
-    spec_mtime = spec_path.stat().st_mtime
-    out_mtime = out.stat().st_mtime
+@dataclass(frozen=True)
+class GeneratedFile:
+    spec_path: Path
+    path: Path
+    contents: str
 
-    _l.debug(f"Spec modified time: {spec_mtime!r} vs Out modified time {out_mtime!r}")
-    return spec_mtime > out_mtime
 
-
-def generate_header(
+def render_header_file(
     spec: Union[StructSpec, EnumSpec, VariantSpec],
+    key: GenerationKey,
     spec_path: Path,
     root: Path,
     out: Path,
-    force: bool,
-) -> bool:
-    if not (force or needs_generate_to_path(spec_path=spec_path, root=root, out=out)):
-        _l.debug(
-            f"No generation needed for {spec_path.relative_to(root)} -> {out.relative_to(root)}"
-        )
-        return False
-
-    _l.info(f"Regenerating {spec_path.relative_to(root)} -> {out.relative_to(root)}")
-
-    out.parent.mkdir(exist_ok=True, parents=True)
-    with out.open("w") as f:
-        render_disclaimer(spec_path=spec_path, root=root, f=f)
-        render_proj_metadata(spec_path=spec_path, root=root, f=f)
-        ifndef = gen_ifndef_uid(out)
-        f.write("\n")
-        f.write(f"#ifndef {ifndef}\n")
-        f.write(f"#define {ifndef}\n")
-        f.write("\n")
-        if isinstance(spec, StructSpec):
-            render_struct_header(spec, f)
-        elif isinstance(spec, VariantSpec):
-            render_variant_header(spec, f)
-        else:
-            assert isinstance(spec, EnumSpec)
-            render_enum_header(spec, f)
-        f.write("\n")
-        f.write(f"#endif // {ifndef}\n")
-
-    return True
+    ctx: Optional[ProjectContext] = None,
+) -> str:
+    f = io.StringIO()
+    render_disclaimer(spec_path=spec_path, root=root, f=f)
+    render_proj_metadata(key, f=f)
+    ifndef = gen_ifndef_uid(out, ctx)
+    f.write("\n")
+    f.write(f"#ifndef {ifndef}\n")
+    f.write(f"#define {ifndef}\n")
+    f.write("\n")
+    if isinstance(spec, StructSpec):
+        render_struct_header(spec, f)
+    elif isinstance(spec, VariantSpec):
+        render_variant_header(spec, f)
+    else:
+        assert isinstance(spec, EnumSpec)
+        render_enum_header(spec, f)
+    f.write("\n")
+    f.write(f"#endif // {ifndef}\n")
+    return f.getvalue()
 
 
-def generate_source(
+def render_source_file(
     spec: Union[StructSpec, EnumSpec, VariantSpec],
+    key: GenerationKey,
     include_path: Path,
     spec_path: Path,
     root: Path,
-    out: Path,
-    force: bool,
-) -> bool:
-    if not (force or needs_generate_to_path(spec_path=spec_path, root=root, out=out)):
-        _l.info(
-            f"No generation needed for {spec_path.relative_to(root)} -> {out.relative_to(root)}"
-        )
-        return False
-
-    _l.info(f"Regenerating {spec_path.relative_to(root)} -> {out.relative_to(root)}")
-
-    out.parent.mkdir(exist_ok=True, parents=True)
-    with out.open("w") as f:
-        render_disclaimer(spec_path=spec_path, root=root, f=f)
-        render_proj_metadata(spec_path=spec_path, root=root, f=f)
-        f.write("\n")
-        f.write(f'#include "{include_path}"\n')
-        f.write("\n")
-        if isinstance(spec, StructSpec):
-            render_struct_source(spec, f)
-        elif isinstance(spec, VariantSpec):
-            render_variant_source(spec, f)
-        else:
-            assert isinstance(spec, EnumSpec)
-            render_enum_source(spec, f)
-
-    return True
+) -> str:
+    f = io.StringIO()
+    render_disclaimer(spec_path=spec_path, root=root, f=f)
+    render_proj_metadata(key, f=f)
+    f.write("\n")
+    f.write(f'#include "{include_path}"\n')
+    f.write("\n")
+    if isinstance(spec, StructSpec):
+        render_struct_source(spec, f)
+    elif isinstance(spec, VariantSpec):
+        render_variant_source(spec, f)
+    else:
+        assert isinstance(spec, EnumSpec)
+        render_enum_source(spec, f)
+    return f.getvalue()
 
 
-def generate_files(
-    root: Path, config: ProjectConfig, spec_path: Path, force: bool
-) -> Iterator[Path]:
+def load_spec(spec_path: Path) -> Union[StructSpec, EnumSpec, VariantSpec]:
     suffix = "".join(spec_path.suffixes[-2:])
 
-    spec: Union[StructSpec, EnumSpec, VariantSpec]
     if suffix == ".struct.toml":
-        spec = load_struct_spec(spec_path)
+        return load_struct_spec(spec_path)
     elif suffix == ".variant.toml":
-        spec = load_variant_spec(spec_path)
+        return load_variant_spec(spec_path)
     else:
         assert suffix == ".enum.toml"
-        spec = load_enum_spec(spec_path)
+        return load_enum_spec(spec_path)
+
 
-    header_path = root / spec_path.with_suffix("").with_suffix(
-        ".dtg" + config.header_extension
+# which of the outputs of a spec have to be rendered. this only needs the
+# hash of the spec and the metadata of the existing outputs, so it is cheap to
+# compute for every spec up front
+@dataclass(frozen=True)
+class RenderPlan:
+    spec_path: Path
+    key: GenerationKey
+    header_path: Path
+    source_path: Path
+    needs_header: bool
+    needs_source: bool
+
+    @property
+    def needs_render(self) -> bool:
+        return self.needs_header or self.needs_source
+
+
+def plan_render(
+    root: Path,
+    config: ProjectConfig,
+    spec_path: Path,
+    force: bool,
+    generator_hash: bytes,
+    ctx: ProjectContext,
+) -> RenderPlan:
+    header_path, source_path = get_spec_output_paths(root, config, spec_path, ctx)
+
+    spec_hash = get_file_hash(spec_path)
+    assert spec_hash is not None
+    key = GenerationKey(spec_hash=spec_hash, generator_hash=generator_hash)
+
+    needs_header = force or needs_generate_to_path(
+        key=key, root=root, out=header_path
+    )
+    needs_source = force or needs_generate_to_path(
+        key=key, root=root, out=source_path
     )
-    source_path = root / get_source_path(header_path)
-    include_path = get_include_path(header_path)
 
-    if generate_header(
-        spec=spec, spec_path=spec_path, root=root, out=header_path, force=force
-    ):
-        yield header_path
-    if generate_source(
-        spec=spec,
-        include_path=include_path,
+    for out, needed in [(header_path, needs_header), (source_path, needs_source)]:
+        if needed:
+            _l.info(
+                f"Regenerating {spec_path.relative_to(root)} -> {out.relative_to(root)}"
+            )
+        else:
+            _l.debug(
+                f"No generation needed for {spec_path.relative_to(root)} -> {out.relative_to(root)}"
+            )
+
+    return RenderPlan(
         spec_path=spec_path,
+        key=key,
+        header_path=header_path,
+        source_path=source_path,
+        needs_header=needs_header,
+        needs_source=needs_source,
+    )
+
+
+def render_files(
+    root: Path,
+    config: ProjectConfig,
+    spec_path: Path,
+    force: bool,
+    generator_hash: bytes,
+    ctx: Optional[ProjectContext] = None,
+) -> Tuple[GeneratedFile, ...]:
+    if ctx is None:
+        ctx = ProjectContext(config)
+    plan = plan_render(root, config, spec_path, force, generator_hash, ctx)
+    return render_planned_files(root, config, plan, ctx)
+
+
+def render_planned_files(
+    root: Path,
+    config: ProjectConfig,
+    plan: RenderPlan,
+    ctx: ProjectContext,
+) -> Tuple[GeneratedFile, ...]:
+    if not plan.needs_render:
+        return ()
+
+    spec_path = plan.spec_path
+    key = plan.key
+    header_path = plan.header_path
+    source_path = plan.source_path
+    include_path = get_include_path(header_path, ctx)
+    spec = load_spec(spec_path)
+
+    def finish(contents: str) -> str:
+        if config.dtgen_builtin_layout:
+            return layout_cpp(contents)
+        else:
+            return contents
+
+    result = []
+    if plan.needs_header:
+        result.append(
+            GeneratedFile(
+                spec_path=spec_path,
+                path=header_path,
+                contents=finish(
+                    render_header_file(
+                        spec=spec,
+                        key=key,
+                        spec_path=spec_path,
+                        root=root,
+                        out=header_path,
+                        ctx=ctx,
+                    )
+                ),
+            )
+        )
+    if plan.needs_source:
+        result.append(
+            GeneratedFile(
+                spec_path=spec_path,
+                path=source_path,
+                contents=finish(
+                    render_source_file(
+                        spec=spec,
+                        key=key,
+                        include_path=include_path,
+                        spec_path=spec_path,
+                        root=root,
+                    )
+                ),
+            )
+        )
+    return tuple(result)
+
+
+def write_generated_file(generated: GeneratedFile) -> bool:
+    return write_file_if_changed(generated.path, generated.contents.encode("utf-8"))
+
+
+# formats the generated files in a staging directory, then only writes the
+# outputs whose formatted contents differ from what is already on disk, so
+# that rerendering identical files does not trigger rebuilds
+def write_formatted_generated_files(
+    config: ProjectConfig,
+    generated: Sequence[GeneratedFile],
+    jobs: int,
+) -> List[Path]:
+    if len(generated) == 0:
+        return []
+
+    with tempfile.TemporaryDirectory() as d:
+        staged = []
+        for i, g in enumerate(generated):
+            # keep the file name so the formatter detects the same language
+            staged_path = Path(d) / str(i) / g.path.name
+            staged_path.parent.mkdir()
+            staged_path.write_text(g.contents)
+            staged.append(staged_path)
+
+        # formatting everything at once avoids spawning a formatter per spec
+        run_formatter(config, staged, jobs=jobs)
+
+        written = []
+        for g, staged_path in zip(generated, staged):
+            if write_file_if_changed(g.path, staged_path.read_bytes()):
+                written.append(g.path)
+            else:
+                _l.debug(f"Contents of {g.path} are unchanged, leaving it untouched")
+    return written
+
+
+def generate_files(
+    root: Path, config: ProjectConfig, spec_path: Path, force: bool
+) -> Iterator[Path]:
+    for generated in render_files(
+        root=root,
+        config=config,
+        spec_path=spec_path,
+        force=force,
+        generator_hash=get_generator_hash(config),
+    ):
+        if write_generated_file(generated):
+            yield generated.path
+
+
+# set up once in each render worker by _init_render_worker, so that tasks
+# only have to carry their RenderPlan and the workers share a ProjectContext
+_worker_root: Optional[Path] = None
+_worker_config: Optional[ProjectConfig] = None
+_worker_ctx: Optional[ProjectContext] = None
+
+
+def _init_render_worker(root: Path, config: ProjectConfig) -> None:
+    global _worker_root, _worker_config, _worker_ctx
+    _worker_root = root
+    _worker_config = config
+    _worker_ctx = ProjectContext(config)
+
+
+def _render_in_worker(plan: RenderPlan) -> Tuple[GeneratedFile, ...]:
+    assert _worker_root is not None
+    assert _worker_config is not None
+    assert _worker_ctx is not None
+    return render_planned_files(_worker_root, _worker_config, plan, _worker_ctx)
+
+
+def _render_all_files(
+    root: Path,
+    config: ProjectConfig,
+    spec_paths: Sequence[Path],
+    force: bool,
+    jobs: int,
+) -> Iterator[Tuple[Path, Tuple[GeneratedFile, ...]]]:
+    generator_hash = get_generator_hash(config)
+    ctx = ProjectContext(config)
+
+    def add_spec_note(e: Exception, spec_path: Path) -> None:
+        e.add_note(f"while generating files from {spec_path}")
+
+    # checking which outputs are out of date is cheap, so it is done here and
+    # only the specs that actually need rendering are sent to the workers. in
+    # particular, no workers are started when everything is up to date
+    plans = []
+    for spec_path in spec_paths:
+        try:
+            plans.append(
+                plan_render(root, config, spec_path, force, generator_hash, ctx)
+            )
+        except Exception as e:
+            add_spec_note(e, spec_path)
+            raise
+    to_render = [plan for plan in plans if plan.needs_render]
+
+    if jobs <= 1 or len(to_render) <= 1:
+        for plan in to_render:
+            try:
+                yield (plan.spec_path, render_planned_files(root, config, plan, ctx))
+            except Exception as e:
+                add_spec_note(e, plan.spec_path)
+                raise
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(to_render)),
+        initializer=_init_render_worker,
+        initargs=(root, config),
+    ) as pool:
+        futures = [pool.submit(_render_in_worker, plan) for plan in to_render]
+        # results are consumed in input order so that output does not depend
+        # on which worker finishes first
+        for plan, future in zip(to_render, futures):
+            try:
+                yield (plan.spec_path, future.result())
+            except Exception as e:
+                for f in futures:
+                    f.cancel()
+                add_spec_note(e, plan.spec_path)
+                raise
+
+
+# renders and writes the files generated from `spec_paths`, returning the
+# paths of the files whose contents changed
+def regenerate_files(
+    root: Path,
+    config: ProjectConfig,
+    spec_paths: Sequence[Path],
+    force: bool,
+    jobs: int,
+) -> List[Path]:
+    all_generated: List[GeneratedFile] = []
+    for spec_path, rendered in _render_all_files(
         root=root,
-        out=source_path,
+        config=config,
+        spec_paths=spec_paths,
         force=force,
+        jobs=jobs,
     ):
-        yield source_path
+        all_generated.extend(rendered)
+
+    if config.dtgen_builtin_layout:
+        # already laid out in the style clang-format would produce, so the
+        # formatter does not need to run at all
+        written = [g.path for g in all_generated if write_generated_file(g)]
+    else:
+        written = write_formatted_generated_files(config, all_generated, jobs=jobs)
+    _l.info(
+        f"Rendered {len(all_generated)} files, of which {len(written)} changed"
+    )
+    return written
 
 
 def run_dtgen(
@@ -255,22 +567,25 @@ def run_dtgen(
     force: bool,
     files: Optional[Sequence[PathLike[str]]] = None,
     delete_outdated: bool = True,
+    jobs: Optional[int] = None,
 ) -> None:
+    tree = scan_dtgen_tree(root, config)
     if files is None:
-        files = list(find_files(root))
+        files = list(tree.spec_paths)
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
     _l.info("Running dtgen on following files:")
     for f in files:
         _l.info(f"- {f}")
-    for spec_path in files:
-        generated = list(
-            generate_files(
-                root=root, config=config, spec_path=Path(spec_path), force=force
-            )
-        )
-        if len(generated) > 0:
-            run_formatter(config, generated)
+    regenerate_files(
+        root=root,
+        config=config,
+        spec_paths=[Path(f) for f in files],
+        force=force,
+        jobs=jobs,
+    )
 
-    for outdated in find_outdated(root, config):
+    for outdated in find_outdated(root, config, tree):
         if delete_outdated:
             _l.info(f"Removing out-of-date file at {outdated}")
             outdated.unlink()
@@ -0,0 +1,363 @@
+from proj.config_file import (
+    ProjectConfig,
+    ProjectContext,
+)
+from proj.failure import fail_with_error
+from proj.hash import get_file_hash
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from .manifest import (
+    PRUNED_DIR_NAMES,
+    SPEC_SUFFIXES,
+    get_pruned_dirs,
+    get_spec_output_paths,
+    scan_dtgen_tree,
+    update_dtgen_manifest,
+)
+from .project import (
+    regenerate_files,
+    run_dtgen,
+)
+import contextlib
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import logging
+import os
+import select
+import struct
+import time
+
+_l = logging.getLogger(__name__)
+
+DTGEN_WATCH_LOCK_FILENAME = ".proj-dtgen-watch.lock"
+
+# how long to keep collecting events after the first one, so that an editor
+# saving through a temporary file results in a single regeneration
+SETTLE_SECONDS = 0.05
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def get_dtgen_watch_lock_path(root: Path) -> Path:
+    return root / "build" / DTGEN_WATCH_LOCK_FILENAME
+
+
+# the watcher holds an exclusive lock on the lock file for as long as it runs,
+# so that a watcher that died without cleaning up is never reported as running
+def is_dtgen_watch_running(root: Path) -> bool:
+    try:
+        f = get_dtgen_watch_lock_path(root).open("r")
+    except FileNotFoundError:
+        return False
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+
+@contextlib.contextmanager
+def hold_dtgen_watch_lock(root: Path) -> Iterator[None]:
+    path = get_dtgen_watch_lock_path(root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fail_with_error(f"dtgen is already being watched for {root}")
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def is_spec_path(p: Path) -> bool:
+    return p.name.endswith(SPEC_SUFFIXES)
+
+
+def iter_watched_dirs(root: Path, start: Optional[Path] = None) -> Iterator[Path]:
+    pruned = {str(p) for p in get_pruned_dirs(root)}
+    to_visit = [str(root if start is None else start)]
+    while len(to_visit) > 0:
+        d = to_visit.pop()
+        yield Path(d)
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if (
+                        entry.is_dir(follow_symlinks=False)
+                        and entry.name not in PRUNED_DIR_NAMES
+                        and entry.path not in pruned
+                    ):
+                        to_visit.append(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+class PollingSpecWatcher:
+    def __init__(self, root: Path, config: ProjectConfig, interval: float) -> None:
+        self.root = root
+        self.config = config
+        self.interval = interval
+        self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> Dict[Path, Tuple[int, int]]:
+        result = {}
+        for p in scan_dtgen_tree(self.root, self.config).spec_paths:
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            result[p] = (st.st_mtime_ns, st.st_size)
+        return result
+
+    # returns the spec files that were created, modified or deleted since the
+    # last call
+    def poll(self) -> Set[Path]:
+        snapshot = self._take_snapshot()
+        changed = {
+            p
+            for p in snapshot.keys() | self.snapshot.keys()
+            if snapshot.get(p) != self.snapshot.get(p)
+        }
+        self.snapshot = snapshot
+        return changed
+
+    def wait(self, timeout: float) -> Set[Path]:
+        time.sleep(min(timeout, self.interval))
+        return self.poll()
+
+    def close(self) -> None:
+        pass
+
+
+class InotifySpecWatcher:
+    def __init__(self, root: Path, config: ProjectConfig) -> None:
+        self.root = root
+        self.config = config
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("Could not find libc")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd: int = fd
+        self.dirs: Dict[int, Path] = {}
+        try:
+            for d in iter_watched_dirs(root):
+                self._add_watch(d)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add_watch(self, d: Path) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # the directory may have been removed before we got to it
+            if err == errno.ENOENT:
+                return
+            raise OSError(err, os.strerror(err), str(d))
+        self.dirs[wd] = d
+
+    def _remove_watches_under(self, removed: Path) -> None:
+        for wd, d in list(self.dirs.items()):
+            if d.is_relative_to(removed):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+    def _read_events(self) -> Set[Path]:
+        changed: Set[Path] = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, name_len = INOTIFY_EVENT.unpack_from(buf, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(buf[offset : offset + name_len].rstrip(b"\0"))
+                offset += name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    _l.warning("Missed file events, rescanning all dtgen specs")
+                    changed.update(scan_dtgen_tree(self.root, self.config).spec_paths)
+                    # rechecks every known spec, including deleted ones
+                    changed.add(self.root)
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                d = self.dirs.get(wd)
+                if d is None or name == "":
+                    continue
+                p = d / name
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed.update(self._watch_new_dir(p))
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        # specs that were inside are gone without any events
+                        # of their own if the directory was moved away
+                        self._remove_watches_under(p)
+                        changed.add(p)
+                elif is_spec_path(p):
+                    changed.add(p)
+
+    # specs can be created inside a new directory before its watch is added,
+    # so any already in it are reported as changed
+    def _watch_new_dir(self, new_dir: Path) -> Set[Path]:
+        changed: Set[Path] = set()
+        for d in iter_watched_dirs(self.root, start=new_dir):
+            self._add_watch(d)
+            with contextlib.suppress(FileNotFoundError):
+                changed.update(p for p in d.iterdir() if is_spec_path(p))
+        return changed
+
+    def wait(self, timeout: float) -> Set[Path]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return set()
+        time.sleep(SETTLE_SECONDS)
+        return self._read_events()
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def make_spec_watcher(
+    root: Path, config: ProjectConfig, poll: bool, poll_interval: float
+) -> Union[InotifySpecWatcher, PollingSpecWatcher]:
+    if not poll:
+        try:
+            return InotifySpecWatcher(root, config)
+        except (OSError, AttributeError) as e:
+            _l.warning(
+                f"Could not watch for changes with inotify ({e}), polling instead"
+            )
+    return PollingSpecWatcher(root, config, poll_interval)
+
+
+def get_spec_hashes(specs: List[Path]) -> Dict[Path, bytes]:
+    result = {}
+    for p in specs:
+        h = get_file_hash(p)
+        if h is not None:
+            result[p] = h
+    return result
+
+
+# brings the generated files up to date with the given possibly-changed specs
+# and removed directories, using the in-memory spec hashes to skip specs whose
+# contents did not change. returns the paths of the files that were written
+# or removed
+def process_spec_changes(
+    root: Path,
+    config: ProjectConfig,
+    spec_hashes: Dict[Path, bytes],
+    changed: Set[Path],
+    jobs: int,
+) -> List[Path]:
+    removed_dirs = [p for p in changed if not is_spec_path(p)]
+    candidates = {p for p in changed if is_spec_path(p)}
+    candidates.update(
+        p for p in spec_hashes if any(p.is_relative_to(d) for d in removed_dirs)
+    )
+
+    ctx = ProjectContext(config)
+    to_regenerate = []
+    removed = []
+    for spec_path in sorted(candidates):
+        new_hash = get_file_hash(spec_path)
+        if new_hash == spec_hashes.get(spec_path):
+            continue
+        if new_hash is None:
+            del spec_hashes[spec_path]
+            for out in get_spec_output_paths(root, config, spec_path, ctx):
+                if out.exists():
+                    _l.info(f"Removing out-of-date file at {out}")
+                    out.unlink()
+                    removed.append(out)
+        else:
+            spec_hashes[spec_path] = new_hash
+            to_regenerate.append(spec_path)
+
+    written: List[Path] = []
+    if len(to_regenerate) > 0:
+        for spec_path in to_regenerate:
+            _l.info(f"Regenerating {spec_path.relative_to(root)}")
+        written = regenerate_files(
+            root=root,
+            config=config,
+            spec_paths=to_regenerate,
+            force=False,
+            jobs=jobs,
+        )
+    if len(to_regenerate) > 0 or len(removed) > 0:
+        update_dtgen_manifest(root, config, sorted(spec_hashes))
+    return [*written, *removed]
+
+
+def watch_dtgen(
+    root: Path,
+    config: ProjectConfig,
+    jobs: int,
+    poll: bool = False,
+    poll_interval: float = 1.0,
+    should_stop: Callable[[], bool] = lambda: False,
+) -> None:
+    with hold_dtgen_watch_lock(root):
+        # the watcher is created and the specs hashed before the initial
+        # generation, so edits made while it runs are picked up by the first
+        # wait rather than lost
+        watcher = make_spec_watcher(root, config, poll, poll_interval)
+        try:
+            spec_hashes = get_spec_hashes(
+                list(scan_dtgen_tree(root, config).spec_paths)
+            )
+            run_dtgen(root=root, config=config, force=False, jobs=jobs)
+            _l.info(f"Watching {len(spec_hashes)} dtgen specs under {root} for changes")
+            while not should_stop():
+                changed = watcher.wait(timeout=poll_interval)
+                if len(changed) > 0:
+                    process_spec_changes(root, config, spec_hashes, changed, jobs)
+        except KeyboardInterrupt:
+            _l.info("Stopped watching dtgen specs")
+        finally:
+            watcher.close()
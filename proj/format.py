@@ -1,11 +1,17 @@
 from pathlib import Path
+import asyncio
 import logging
-import subprocess
+import math
+import multiprocessing
+import os
+from . import subprocess_trace as subprocess
 from os import PathLike
 from typing import (
+    List,
     Sequence,
     Optional,
     Iterator,
+    Union,
 )
 from .config_file import ProjectConfig
 
@@ -35,12 +41,81 @@ def find_files(config: ProjectConfig) -> Iterator[Path]:
                 yield found
 
 
+# files handed to a single clang-format process when splitting the work
+# across jobs, below which process startup dominates
+MIN_FILES_PER_CHUNK = 16
+
+
+def get_max_command_length() -> int:
+    try:
+        arg_max = os.sysconf("SC_ARG_MAX")
+    except (ValueError, OSError):
+        arg_max = -1
+    if arg_max <= 0:
+        arg_max = 128 * 1024
+    # the environment shares the same limit as the arguments, and leave some
+    # headroom beyond that
+    env_size = sum(len(k) + len(v) + 2 for k, v in os.environ.items())
+    return max(arg_max // 2 - env_size, 4096)
+
+
+def _arg_length(arg: Union[str, PathLike[str]]) -> int:
+    # the string, its terminating null byte, and the argv pointer to it
+    return len(os.fsencode(arg)) + 1 + 8
+
+
+def chunk_files(
+    command: Sequence[str],
+    files: Sequence[PathLike[str]],
+    max_command_length: int,
+    num_chunks: int = 1,
+) -> List[List[PathLike[str]]]:
+    command_length = sum(_arg_length(arg) for arg in command)
+    max_files_per_chunk = max(math.ceil(len(files) / max(num_chunks, 1)), 1)
+
+    chunks: List[List[PathLike[str]]] = []
+    current: List[PathLike[str]] = []
+    current_length = command_length
+    for f in files:
+        length = _arg_length(f)
+        if len(current) > 0 and (
+            current_length + length > max_command_length
+            or len(current) >= max_files_per_chunk
+        ):
+            chunks.append(current)
+            current = []
+            current_length = command_length
+        current.append(f)
+        current_length += length
+    if len(current) > 0:
+        chunks.append(current)
+    return chunks
+
+
+async def _run_chunks(
+    commands: Sequence[Sequence[str]],
+    jobs: int,
+) -> None:
+    limiter = subprocess.ProcessLimiter(jobs)
+    await asyncio.gather(
+        *[
+            subprocess.check_call_async(
+                command, stderr=subprocess.STDOUT, limiter=limiter
+            )
+            for command in commands
+        ]
+    )
+
+
 def _run_clang_format(
     root: Path,
     args: Sequence[str],
     files: Sequence[PathLike[str]],
     use_default_style: bool = False,
+    jobs: Optional[int] = None,
 ) -> None:
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
     command = ["ff-clang-format"]
     if not use_default_style:
         style_file = root / ".clang-format-for-format-sh"
@@ -50,11 +125,28 @@ def _run_clang_format(
         _l.debug(f"Running command {command} on 1 file: {files[0]}")
     else:
         _l.debug(f"Running command {command} on {len(files)} files")
-    subprocess.check_call(command + [*files], stderr=subprocess.STDOUT)
+    if len(files) == 0:
+        return
+
+    chunks = chunk_files(
+        command,
+        files,
+        max_command_length=get_max_command_length(),
+        num_chunks=min(jobs, math.ceil(len(files) / MIN_FILES_PER_CHUNK)),
+    )
+    _l.debug(f"Split {len(files)} files into {len(chunks)} clang-format invocations")
+    asyncio.run(
+        _run_chunks(
+            [[*command, *[str(f) for f in chunk]] for chunk in chunks],
+            jobs=jobs,
+        )
+    )
 
 
 def run_formatter_check(
-    config: ProjectConfig, files: Optional[Sequence[PathLike[str]]] = None
+    config: ProjectConfig,
+    files: Optional[Sequence[PathLike[str]]] = None,
+    jobs: Optional[int] = None,
 ) -> None:
     if files is None:
         files = list(find_files(config=config))
@@ -65,11 +157,14 @@ def run_formatter_check(
         root=config.base,
         args=["--dry-run", "--Werror"],
         files=files,
+        jobs=jobs,
     )
 
 
 def run_formatter(
-    config: ProjectConfig, files: Optional[Sequence[PathLike[str]]] = None
+    config: ProjectConfig,
+    files: Optional[Sequence[PathLike[str]]] = None,
+    jobs: Optional[int] = None,
 ) -> None:
     if files is None:
         files = list(find_files(config=config))
@@ -80,4 +175,5 @@ def run_formatter(
         root=config.base,
         args=["-i"],  # in-place
         files=files,
+        jobs=jobs,
     )
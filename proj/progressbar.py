@@ -1,6 +1,7 @@
 import logging
 from abc import abstractmethod
 import contextlib
+import threading
 from typing import (
     Optional,
     Type,
@@ -29,6 +30,10 @@ class ProgressBar(contextlib.AbstractContextManager["ProgressBar"]):
     def update(self, incr: int = 1, force: bool = False) -> None:
         ...
 
+    # prints a line of output alongside the bar
+    def write(self, line: str) -> None:
+        print(line)
+
 
 class FakeProgressBar(ProgressBar):
     def update(self, incr: int = 1, force: bool = False) -> None:
@@ -46,6 +51,31 @@ class FakeProgressBar(ProgressBar):
         pass
 
 
+class SynchronizedProgressBar(ProgressBar):
+    def __init__(self, wrapped: ProgressBar) -> None:
+        self._wrapped = wrapped
+        self._lock = threading.Lock()
+
+    def update(self, incr: int = 1, force: bool = False) -> None:
+        with self._lock:
+            self._wrapped.update(incr=incr, force=force)
+
+    def write(self, line: str) -> None:
+        with self._lock:
+            self._wrapped.write(line)
+
+    def __enter__(self) -> "SynchronizedProgressBar":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> Optional[bool]:
+        pass
+
+
 class EnlightenProgressBar(ProgressBar):
     def __init__(self, enlighten_bar: EnlightenPB) -> None:
         self._enlighten_bar = enlighten_bar
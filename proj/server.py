@@ -0,0 +1,141 @@
+from .client import (
+    get_server_socket_path,
+    is_server_running,
+)
+from .config_file import (
+    ProjectConfig,
+    ProjectContext,
+    dump_config,
+    gen_ifndef_uid,
+    get_include_path,
+    get_path_info,
+    get_test_header_path,
+    load_config,
+)
+from .failure import fail_with_error
+from .json import Json
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    Optional,
+    Tuple,
+)
+import contextlib
+import json
+import logging
+import os
+import socketserver
+import threading
+
+_l = logging.getLogger(__name__)
+
+
+# the server keeps the parsed config for as long as .proj.toml is unchanged.
+# everything derived from the rest of the filesystem (sublibs, their
+# directories) is cheap to recompute and changes as files are created, so it
+# is only cached for the duration of a single request
+class ProjectServerState:
+    def __init__(self, config: ProjectConfig) -> None:
+        self.root = config.base
+        self._lock = threading.Lock()
+        self._config = config
+        self._config_stamp = self._get_config_stamp()
+
+    def _get_config_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = (self.root / ".proj.toml").stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get_context(self) -> ProjectContext:
+        with self._lock:
+            stamp = self._get_config_stamp()
+            if stamp != self._config_stamp:
+                _l.info(f"Reloading config for {self.root}")
+                self._config = load_config(self.root)
+                self._config_stamp = stamp
+            return ProjectContext(self._config)
+
+
+SERVER_COMMANDS: Dict[str, Callable[[ProjectContext, Path], Json]] = {
+    "root": lambda ctx, p: str(ctx.get_config_root(p)),
+    "config": lambda ctx, p: dump_config(ctx.get_config(p)),
+    "query-path": lambda ctx, p: get_path_info(p, ctx).json(),
+    "ifndef": lambda ctx, p: gen_ifndef_uid(p, ctx),
+    "include": lambda ctx, p: str(get_include_path(p, ctx)),
+    "test-header": lambda ctx, p: str(get_test_header_path(p, ctx)),
+}
+
+
+def answer_request(state: ProjectServerState, request: Json) -> Json:
+    if not isinstance(request, dict):
+        return {"error": "Request must be a json object"}
+    command = request.get("command")
+    path = request.get("path")
+    if command not in SERVER_COMMANDS:
+        return {"error": f"Unknown command {command!r}"}
+    if not isinstance(path, str) or not os.path.isabs(path):
+        return {"error": "Request path must be an absolute path"}
+
+    try:
+        result = SERVER_COMMANDS[command](state.get_context(), Path(path))
+    except Exception as e:
+        # the client falls back to answering the request itself, which
+        # reports the error properly
+        _l.debug(f"Failed to answer {request}", exc_info=True)
+        return {"error": f"{type(e).__name__}: {e}"}
+    return {"result": result}
+
+
+class ProjectServerRequestHandler(socketserver.StreamRequestHandler):
+    server: "ProjectServer"
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response: Json = {"error": "Request is not valid json"}
+            else:
+                response = answer_request(self.server.state, request)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class ProjectServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, state: ProjectServerState) -> None:
+        self.state = state
+        super().__init__(str(socket_path), ProjectServerRequestHandler)
+
+
+@contextlib.contextmanager
+def make_project_server(config: ProjectConfig) -> Iterator[ProjectServer]:
+    # the client finds the socket through the resolved project root
+    root = config.base.resolve()
+    socket_path = Path(get_server_socket_path(str(root)))
+    if socket_path.exists():
+        if is_server_running(str(root)):
+            fail_with_error(f"proj serve is already running for {root}")
+        # left behind by a server that did not shut down cleanly
+        socket_path.unlink()
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with ProjectServer(socket_path, ProjectServerState(config)) as server:
+        try:
+            yield server
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+
+def run_server(config: ProjectConfig) -> None:
+    with make_project_server(config) as server:
+        _l.info(f"Serving queries for {config.base}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            _l.info("Stopped serving queries")
@@ -5,11 +5,27 @@ from subprocess import (
     DEVNULL as DEVNULL,
     CalledProcessError as CalledProcessError,
     PIPE,
+    STDOUT as STDOUT,
     CompletedProcess as CompletedProcess,
 )
 import sys
 import io
+import os
+import contextlib
+import json
+import resource
+import threading
+import time
+import codecs
+import locale
+import selectors
 from typing import (
+    TYPE_CHECKING,
+    AsyncContextManager,
+    Awaitable,
+    Callable,
+    List,
+    Type,
     Sequence,
     Tuple,
     Union,
@@ -19,31 +35,217 @@ from typing import (
     Mapping,
 )
 from pathlib import Path
+from types import TracebackType
+from dataclasses import dataclass
+from .json import Json
 
+# asyncio takes longer to import than everything else here combined, and most
+# commands never run a process asynchronously
+if TYPE_CHECKING:
+    import asyncio
 
 _l = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class ProcessSpan:
+    command: str
+    cwd: Optional[str]
+    pid: int
+    start: float
+    end: float
+    returncode: Optional[int]
+    user_cpu: Optional[float]
+    sys_cpu: Optional[float]
+    max_rss_kb: Optional[int]
+
+    @property
+    def wall_time(self) -> float:
+        return self.end - self.start
+
+
+_trace_lock = threading.Lock()
+_trace_start: float = 0.0
+_trace_spans: Optional[List[ProcessSpan]] = None
+
+
+def start_tracing() -> None:
+    global _trace_start, _trace_spans
+    with _trace_lock:
+        _trace_start = time.perf_counter()
+        _trace_spans = []
+
+
+def stop_tracing() -> List[ProcessSpan]:
+    global _trace_spans
+    with _trace_lock:
+        spans = _trace_spans
+        _trace_spans = None
+    return [] if spans is None else spans
+
+
+def _record_span(
+    command: Any,
+    cwd: Optional[Union[str, Path]],
+    pid: int,
+    start: float,
+    returncode: Optional[int],
+    rusage: Optional[resource.struct_rusage],
+) -> None:
+    end = time.perf_counter()
+    if isinstance(command, str):
+        pretty_cmd = command
+    else:
+        pretty_cmd = shlex.join(str(c) for c in command)
+    span = ProcessSpan(
+        command=pretty_cmd,
+        cwd=None if cwd is None else str(cwd),
+        pid=pid,
+        start=start,
+        end=end,
+        returncode=returncode,
+        user_cpu=None if rusage is None else rusage.ru_utime,
+        sys_cpu=None if rusage is None else rusage.ru_stime,
+        max_rss_kb=None if rusage is None else rusage.ru_maxrss,
+    )
+    _l.debug(
+        "Process %d (%s) exited with %s after %.3fs",
+        pid,
+        pretty_cmd,
+        returncode,
+        span.wall_time,
+    )
+    with _trace_lock:
+        if _trace_spans is not None:
+            _trace_spans.append(span)
+
+
+def spans_to_chrome_trace(spans: Sequence[ProcessSpan]) -> Json:
+    def to_us(t: float) -> float:
+        return (t - _trace_start) * 1e6
+
+    return {
+        "displayTimeUnit": "ms",
+        "traceEvents": [
+            {
+                "name": span.command,
+                "cat": "process",
+                "ph": "X",
+                "ts": to_us(span.start),
+                "dur": span.wall_time * 1e6,
+                "pid": os.getpid(),
+                # every child gets its own track, as children launched
+                # concurrently would otherwise overlap on a single one
+                "tid": span.pid,
+                "args": {
+                    "cwd": span.cwd,
+                    "returncode": span.returncode,
+                    "wall_time_s": span.wall_time,
+                    "user_cpu_s": span.user_cpu,
+                    "sys_cpu_s": span.sys_cpu,
+                    "max_rss_kb": span.max_rss_kb,
+                },
+            }
+            for span in spans
+        ],
+    }
+
+
+def write_chrome_trace(spans: Sequence[ProcessSpan], path: Path) -> None:
+    with path.open("w") as f:
+        f.write(json.dumps(spans_to_chrome_trace(spans)))
+
+
+class _TracedPopen(subprocess.Popen):
+    # reaps the child with os.wait4 rather than os.waitpid so that its
+    # resource usage can be recorded
+    def __init__(self, args, **kwargs):
+        self._trace_start = time.perf_counter()
+        self._trace_cwd = kwargs.get("cwd")
+        self._trace_recorded = False
+        super().__init__(args, **kwargs)
+
+    def _reaped(self, status: int, rusage: Optional[resource.struct_rusage]) -> None:
+        self.returncode = os.waitstatus_to_exitcode(status)
+        self._record(rusage)
+
+    def _record(self, rusage: Optional[resource.struct_rusage]) -> None:
+        if not self._trace_recorded:
+            self._trace_recorded = True
+            _record_span(
+                self.args,
+                cwd=self._trace_cwd,
+                pid=self.pid,
+                start=self._trace_start,
+                returncode=self.returncode,
+                rusage=rusage,
+            )
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                (pid, status, rusage) = os.wait4(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                pass
+            else:
+                if pid == self.pid:
+                    self._reaped(status, rusage)
+        result = super().poll()
+        if result is not None:
+            self._record(None)
+        return result
+
+    def wait(self, timeout=None):
+        if self.returncode is None and timeout is None:
+            try:
+                (_, status, rusage) = os.wait4(self.pid, 0)
+            except ChildProcessError:
+                pass
+            else:
+                self._reaped(status, rusage)
+        result = super().wait(timeout=timeout)
+        self._record(None)
+        return result
+
+
+def _run(command, *, input=None, check=False, **kwargs):
+    with _TracedPopen(command, **kwargs) as proc:
+        try:
+            (stdout, stderr) = proc.communicate(input)
+        except BaseException:
+            proc.kill()
+            raise
+        returncode = proc.poll()
+    if check and returncode != 0:
+        raise CalledProcessError(
+            returncode=returncode,
+            cmd=command,
+            output=stdout,
+            stderr=stderr,
+        )
+    return CompletedProcess(command, returncode, stdout, stderr)
+
+
 def check_call(command, **kwargs):
     if kwargs.get("shell", False):
         pretty_cmd = " ".join(command)
         _l.info(f"+++ $ {pretty_cmd}")
-        subprocess.check_call(pretty_cmd, **kwargs)
+        _run(pretty_cmd, check=True, **kwargs)
     else:
         pretty_cmd = shlex.join(command)
         _l.info(f"+++ $ {pretty_cmd}")
-        subprocess.check_call(command, **kwargs)
+        _run(command, check=True, **kwargs)
 
 
 def check_output(command, **kwargs):
     if kwargs.get("shell", False):
         pretty_cmd = " ".join(command)
         _l.info(f"+++ $ {pretty_cmd}")
-        return subprocess.check_output(pretty_cmd, **kwargs)
+        return _run(pretty_cmd, stdout=PIPE, check=True, **kwargs).stdout
     else:
         pretty_cmd = shlex.join(command)
         _l.info(f"+++ $ {pretty_cmd}")
-        return subprocess.check_output(command, **kwargs)
+        return _run(command, stdout=PIPE, check=True, **kwargs).stdout
 
 
 def tee_output_bytes(
@@ -72,6 +274,30 @@ def tee_output_str(
     return result
 
 
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def _make_text_decoder() -> io.IncrementalNewlineDecoder:
+    # matches the decoding done by Popen(..., text=True)
+    return io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(locale.getpreferredencoding(False))(),
+        translate=True,
+    )
+
+
+def _pump_pipes(pipes: Sequence[Tuple[IO[bytes], Callable[[bytes], None]]]) -> None:
+    with selectors.DefaultSelector() as selector:
+        for pipe, on_data in pipes:
+            selector.register(pipe, selectors.EVENT_READ, on_data)
+        while len(selector.get_map()) > 0:
+            for key, _ in selector.select():
+                data = os.read(key.fd, READ_CHUNK_SIZE)
+                if len(data) == 0:
+                    selector.unregister(key.fileobj)
+                else:
+                    key.data(data)
+
+
 def _tee_output(
     command: Union[str, Sequence[str]],
     *,
@@ -90,60 +316,75 @@ def _tee_output(
             pretty_cmd = shlex.join(command)
             _l.info(f"+++ $ {pretty_cmd}")
 
-    proc = subprocess.Popen(
-        command, stdout=PIPE, stderr=PIPE, bufsize=0, text=text, shell=shell
-    )
-    stderrs: Any
-    stdouts: Any
+    if stdout is None:
+        stdout = sys.stdout if text else sys.stdout.buffer
+    if stderr is None:
+        stderr = sys.stderr if text else sys.stderr.buffer
+
+    proc = _TracedPopen(command, stdout=PIPE, stderr=PIPE, bufsize=0, shell=shell)
+    assert proc.stdout is not None
+    assert proc.stderr is not None
+
+    stdout_chunks: List[Any] = []
+    stderr_chunks: List[Any] = []
+
+    def make_tee(
+        chunks: List[Any], output: Any
+    ) -> Tuple[Callable[[bytes], None], Callable[[], None]]:
+        if text:
+            decoder = _make_text_decoder()
+
+            def on_data(data: bytes) -> None:
+                decoded = decoder.decode(data)
+                if len(decoded) > 0:
+                    chunks.append(decoded)
+                    output.write(decoded)
+
+            def finish() -> None:
+                decoded = decoder.decode(b"", final=True)
+                if len(decoded) > 0:
+                    chunks.append(decoded)
+                    output.write(decoded)
+                output.flush()
+
+        else:
+
+            def on_data(data: bytes) -> None:
+                chunks.append(data)
+                output.write(data)
+
+            def finish() -> None:
+                output.flush()
+
+        return (on_data, finish)
+
+    (on_stdout, finish_stdout) = make_tee(stdout_chunks, stdout)
+    (on_stderr, finish_stderr) = make_tee(stderr_chunks, stderr)
+
+    with proc:
+        _pump_pipes([(proc.stdout, on_stdout), (proc.stderr, on_stderr)])
+        returncode = proc.wait()
+    finish_stdout()
+    finish_stderr()
+
+    result: Union[Tuple[bytes, bytes], Tuple[str, str]]
     if text:
-        if stdout is None:
-            stdout = sys.stdout
-        if stderr is None:
-            stderr = sys.stderr
-        stderrs = (io.StringIO(), stderr)
-        stdouts = (io.StringIO(), stdout)
+        result = ("".join(stdout_chunks), "".join(stderr_chunks))
     else:
-        if stdout is None:
-            stdout = sys.stdout.buffer
-        if stderr is None:
-            stderr = sys.stderr.buffer
-        stderrs = (io.BytesIO(), stderr)
-        stdouts = (io.BytesIO(), stdout)
-
-    def write_both(output, contents):
-        output[0].write(contents)
-        output[1].write(contents)
-
-    returncode = None
-    while True:
-        returncode = proc.poll()
-        if returncode is None:
-            assert proc.stderr is not None
-            assert proc.stdout is not None
-            write_both(stderrs, proc.stderr.read())
-            write_both(stdouts, proc.stdout.read())
-        else:
-            (remaining_stdout, remaining_stderr) = proc.communicate()
-            write_both(stderrs, remaining_stderr)
-            write_both(stdouts, remaining_stdout)
-            break
-    stderrs[0].flush()
-    stderrs[1].flush()
-    stdouts[0].flush()
-    stdouts[1].flush()
+        result = (b"".join(stdout_chunks), b"".join(stderr_chunks))
     if returncode == 0:
-        return (stdouts[0].getvalue(), stderrs[0].getvalue())
+        return result
     else:
         assert returncode > 0
         raise CalledProcessError(
             returncode=returncode,
             cmd=command,
-            output=stdouts[0].getvalue(),
-            stderr=stderrs[0].getvalue(),
+            output=result[0],
+            stderr=result[1],
         )
 
 
-def hook_stdout(command, *, stdout_hook, **kwargs):
+def hook_stdout(command, *, stdout_hook, capture_output=True, **kwargs):
     if kwargs.get("shell", False):
         pretty_cmd = " ".join(command)
     else:
@@ -152,27 +393,34 @@ def hook_stdout(command, *, stdout_hook, **kwargs):
 
     assert isinstance(command, str) == kwargs.get("shell", False)
 
-    proc = subprocess.Popen(command, stdout=PIPE, text=True, bufsize=1, **kwargs)
+    proc = _TracedPopen(command, stdout=PIPE, bufsize=0, **kwargs)
+    assert proc.stdout is not None
 
-    output = ""
+    output: List[str] = []
+    decoder = _make_text_decoder()
+    partial_line = ""
 
     def process(s: str) -> None:
-        nonlocal output
         if len(s) > 0:
-            output += s
+            if capture_output:
+                output.append(s)
             stdout_hook(s)
 
-    while True:
-        returncode = proc.poll()
-        if returncode is None:
-            assert proc.stdout is not None
-            process(proc.stdout.readline())
-        else:
-            (remaining_stdout, _) = proc.communicate()
-            process(remaining_stdout)
-            break
+    # the hook is called once per line, as it was when reading with readline
+    def on_data(data: bytes) -> None:
+        nonlocal partial_line
+        lines = (partial_line + decoder.decode(data)).split("\n")
+        partial_line = lines.pop()
+        for line in lines:
+            process(line + "\n")
+
+    with proc:
+        _pump_pipes([(proc.stdout, on_data)])
+        returncode = proc.wait()
+    process(partial_line + decoder.decode(b"", final=True))
+
     if returncode == 0:
-        return output
+        return "".join(output)
     else:
         assert returncode > 0
         raise CalledProcessError(
@@ -197,7 +445,7 @@ def run(
     else:
         pretty_cmd = shlex.join(command)
         _l.info(f"+++ $ {pretty_cmd} (cwd = {cwd})")
-    return subprocess.run(
+    result = _run(
         command,
         stdout=stdout,
         stderr=stderr,
@@ -207,3 +455,227 @@ def run(
         cwd=cwd,
         check=check,
     )
+    assert isinstance(result, CompletedProcess)
+    return result
+
+
+class ProcessLimiter:
+    def __init__(self, max_concurrent: int) -> None:
+        import asyncio
+
+        assert max_concurrent >= 1
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def __aenter__(self) -> "ProcessLimiter":
+        await self._semaphore.acquire()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self._semaphore.release()
+
+
+def _limit(
+    limiter: Optional[ProcessLimiter],
+) -> AsyncContextManager[Optional[ProcessLimiter]]:
+    if limiter is None:
+        return contextlib.nullcontext()
+    else:
+        return limiter
+
+
+async def _create_process(
+    command: Union[str, Sequence[str]],
+    *,
+    stdout: Optional[Union[IO[Any], int]],
+    stderr: Optional[Union[IO[Any], int]],
+    shell: bool,
+    env: Optional[Mapping[str, str]],
+    cwd: Optional[Path],
+) -> "asyncio.subprocess.Process":
+    import asyncio
+
+    if shell:
+        if not isinstance(command, str):
+            command = " ".join(command)
+        _l.info(f"+++ $ {command} (cwd = {cwd})")
+        return await asyncio.create_subprocess_shell(
+            command, stdout=stdout, stderr=stderr, env=env, cwd=cwd
+        )
+    else:
+        assert not isinstance(command, str)
+        _l.info(f"+++ $ {shlex.join(command)} (cwd = {cwd})")
+        return await asyncio.create_subprocess_exec(
+            *command, stdout=stdout, stderr=stderr, env=env, cwd=cwd
+        )
+
+
+# asyncio reaps its children itself, so the spans of processes run
+# asynchronously have no resource usage
+async def _wait_or_kill(
+    proc: "asyncio.subprocess.Process",
+    communicate: Awaitable[Tuple[Optional[bytes], Optional[bytes]]],
+    command: Union[str, Sequence[str]],
+    cwd: Optional[Path],
+    start: float,
+) -> Tuple[Optional[bytes], Optional[bytes]]:
+    import asyncio
+
+    try:
+        return await communicate
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    finally:
+        _record_span(
+            command,
+            cwd=cwd,
+            pid=proc.pid,
+            start=start,
+            returncode=proc.returncode,
+            rusage=None,
+        )
+
+
+def _decode(data: Optional[bytes], text: bool) -> Union[bytes, str, None]:
+    if data is None or not text:
+        return data
+    return _make_text_decoder().decode(data, final=True)
+
+
+async def run_async(
+    command: Union[str, Sequence[str]],
+    stdout: Optional[Union[IO[Any], int]] = None,
+    stderr: Optional[Union[IO[Any], int]] = None,
+    text: bool = False,
+    shell: bool = False,
+    env: Optional[Mapping[str, str]] = None,
+    cwd: Optional[Path] = None,
+    check: bool = False,
+    limiter: Optional[ProcessLimiter] = None,
+) -> CompletedProcess:
+    async with _limit(limiter):
+        start = time.perf_counter()
+        proc = await _create_process(
+            command, stdout=stdout, stderr=stderr, shell=shell, env=env, cwd=cwd
+        )
+        (stdout_data, stderr_data) = await _wait_or_kill(
+            proc, proc.communicate(), command=command, cwd=cwd, start=start
+        )
+    assert proc.returncode is not None
+
+    result = CompletedProcess(
+        args=command,
+        returncode=proc.returncode,
+        stdout=_decode(stdout_data, text),
+        stderr=_decode(stderr_data, text),
+    )
+    if check:
+        result.check_returncode()
+    return result
+
+
+async def check_call_async(
+    command: Union[str, Sequence[str]],
+    stdout: Optional[Union[IO[Any], int]] = None,
+    stderr: Optional[Union[IO[Any], int]] = None,
+    shell: bool = False,
+    env: Optional[Mapping[str, str]] = None,
+    cwd: Optional[Path] = None,
+    limiter: Optional[ProcessLimiter] = None,
+) -> None:
+    await run_async(
+        command,
+        stdout=stdout,
+        stderr=stderr,
+        shell=shell,
+        env=env,
+        cwd=cwd,
+        check=True,
+        limiter=limiter,
+    )
+
+
+async def check_output_async(
+    command: Union[str, Sequence[str]],
+    stderr: Optional[Union[IO[Any], int]] = None,
+    text: bool = False,
+    shell: bool = False,
+    env: Optional[Mapping[str, str]] = None,
+    cwd: Optional[Path] = None,
+    limiter: Optional[ProcessLimiter] = None,
+) -> Union[bytes, str]:
+    result = await run_async(
+        command,
+        stdout=PIPE,
+        stderr=stderr,
+        text=text,
+        shell=shell,
+        env=env,
+        cwd=cwd,
+        check=True,
+        limiter=limiter,
+    )
+    output = result.stdout
+    assert isinstance(output, (bytes, str))
+    return output
+
+
+async def hook_stdout_async(
+    command: Union[str, Sequence[str]],
+    *,
+    stdout_hook: Callable[[str], None],
+    capture_output: bool = True,
+    shell: bool = False,
+    env: Optional[Mapping[str, str]] = None,
+    cwd: Optional[Path] = None,
+    limiter: Optional[ProcessLimiter] = None,
+) -> str:
+    output: List[str] = []
+    decoder = _make_text_decoder()
+    partial_line = ""
+
+    def process(s: str) -> None:
+        if len(s) > 0:
+            if capture_output:
+                output.append(s)
+            stdout_hook(s)
+
+    async def pump(stream: "asyncio.StreamReader") -> Tuple[None, None]:
+        nonlocal partial_line
+        while True:
+            data = await stream.read(READ_CHUNK_SIZE)
+            if len(data) == 0:
+                break
+            lines = (partial_line + decoder.decode(data)).split("\n")
+            partial_line = lines.pop()
+            for line in lines:
+                process(line + "\n")
+        await proc.wait()
+        return (None, None)
+
+    async with _limit(limiter):
+        start = time.perf_counter()
+        proc = await _create_process(
+            command, stdout=PIPE, stderr=None, shell=shell, env=env, cwd=cwd
+        )
+        assert proc.stdout is not None
+        await _wait_or_kill(
+            proc, pump(proc.stdout), command=command, cwd=cwd, start=start
+        )
+    process(partial_line + decoder.decode(b"", final=True))
+
+    assert proc.returncode is not None
+    if proc.returncode == 0:
+        return "".join(output)
+    else:
+        raise CalledProcessError(
+            returncode=proc.returncode,
+            cmd=command,
+        )
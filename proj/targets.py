@@ -511,7 +511,12 @@ class CpuTestCaseTarget:
         return CpuRunTarget(
             dataclasses.replace(
                 generic_run_target,
-                args=tuple([f"--test-case={self.test_case_name}"]),
+                args=tuple(
+                    [
+                        f"--test-suite={self.test_suite.test_suite_name}",
+                        f"--test-case={self.test_case_name}",
+                    ]
+                ),
             ),
         )
 
@@ -535,7 +540,12 @@ class CudaTestCaseTarget:
         return CudaRunTarget(
             dataclasses.replace(
                 generic_run_target,
-                args=tuple([f"--test-case={self.test_case_name}"]),
+                args=tuple(
+                    [
+                        f"--test-suite={self.test_suite.test_suite_name}",
+                        f"--test-case={self.test_case_name}",
+                    ]
+                ),
             ),
         )
 
@@ -0,0 +1,170 @@
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    Mapping,
+    Tuple,
+    Optional,
+    cast,
+)
+from dataclasses import dataclass
+from . import subprocess_trace as subprocess
+from . import json
+from .json import (
+    Json,
+)
+from xml.etree import ElementTree
+import logging
+import os
+import sys
+import tempfile
+
+_l = logging.getLogger(__name__)
+
+TEST_LISTING_CACHE_FILENAME = ".proj-test-listing-cache.json"
+
+
+@dataclass(frozen=True, eq=True)
+class BinaryIdentity:
+    size: int
+    mtime_ns: int
+
+    @staticmethod
+    def for_path(p: Path) -> "BinaryIdentity":
+        stat = p.stat()
+        return BinaryIdentity(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+    def json(self) -> Json:
+        return {
+            "size": self.size,
+            "mtime_ns": self.mtime_ns,
+        }
+
+    @staticmethod
+    def from_json(j: Json) -> "BinaryIdentity":
+        assert isinstance(j, dict)
+        assert isinstance(j["size"], int)
+        assert isinstance(j["mtime_ns"], int)
+        return BinaryIdentity(
+            size=j["size"],
+            mtime_ns=j["mtime_ns"],
+        )
+
+
+@dataclass(frozen=True, eq=True)
+class BinaryTestListing:
+    identity: BinaryIdentity
+    test_cases_by_suite: Mapping[str, Tuple[str, ...]]
+
+    def json(self) -> Json:
+        return {
+            "identity": self.identity.json(),
+            "test_cases_by_suite": {
+                k: list(v) for k, v in self.test_cases_by_suite.items()
+            },
+        }
+
+    @staticmethod
+    def from_json(j: Json) -> "BinaryTestListing":
+        assert isinstance(j, dict)
+        test_cases_by_suite = j["test_cases_by_suite"]
+        assert isinstance(test_cases_by_suite, dict)
+        result: Dict[str, Tuple[str, ...]] = {}
+        for suite_name, test_case_names in test_cases_by_suite.items():
+            assert isinstance(test_case_names, list)
+            assert all(isinstance(n, str) for n in test_case_names)
+            result[suite_name] = tuple(cast(List[str], test_case_names))
+        return BinaryTestListing(
+            identity=BinaryIdentity.from_json(j["identity"]),
+            test_cases_by_suite=result,
+        )
+
+
+def get_test_listing_cache_path(build_dir: Path) -> Path:
+    return build_dir / TEST_LISTING_CACHE_FILENAME
+
+
+def parse_doctest_xml_listing(xml: bytes) -> Dict[str, Tuple[str, ...]]:
+    root = ElementTree.fromstring(xml)
+    result: Dict[str, List[str]] = {}
+    for elem in root.iter("TestCase"):
+        name = elem.get("name")
+        assert name is not None
+        # doctest leaves out empty attributes, so cases outside of any
+        # TEST_SUITE have no testsuite attribute
+        suite_name = elem.get("testsuite", "")
+        result.setdefault(suite_name, []).append(name)
+    return {k: tuple(v) for k, v in result.items()}
+
+
+def _load_cache(build_dir: Path) -> Dict[str, BinaryTestListing]:
+    path = get_test_listing_cache_path(build_dir)
+    try:
+        with path.open("r") as f:
+            raw = json.loads(f.read())
+        assert isinstance(raw, dict)
+        return {k: BinaryTestListing.from_json(v) for k, v in raw.items()}
+    except FileNotFoundError:
+        return {}
+    except (ValueError, AssertionError, KeyError):
+        _l.warning("Ignoring malformed test listing cache at %s", path)
+        return {}
+
+
+def _save_cache(build_dir: Path, cache: Mapping[str, BinaryTestListing]) -> None:
+    path = get_test_listing_cache_path(build_dir)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w") as f:
+        f.write(
+            json.dumps(
+                {k: v.json() for k, v in cache.items()}, sort_keys=True, indent=2
+            )
+        )
+    os.replace(tmp_path, path)
+
+
+def _run_list_test_cases(executable: Path, build_dir: Path) -> Dict[str, Tuple[str, ...]]:
+    with tempfile.TemporaryDirectory() as d:
+        out_path = Path(d) / "listing.xml"
+        subprocess.check_call(
+            [
+                str(executable),
+                "--list-test-cases",
+                "--reporters=xml",
+                f"--out={out_path}",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=sys.stdout,
+            cwd=build_dir,
+            env=os.environ,
+        )
+        return parse_doctest_xml_listing(out_path.read_bytes())
+
+
+def list_test_cases_in_binary(
+    executable: Path,
+    build_dir: Path,
+) -> Mapping[str, Tuple[str, ...]]:
+    assert not executable.is_absolute()
+
+    identity = BinaryIdentity.for_path(build_dir / executable)
+    key = str(executable)
+
+    cache = _load_cache(build_dir)
+    cached: Optional[BinaryTestListing] = cache.get(key)
+    if cached is not None and cached.identity == identity:
+        _l.debug("Using cached test listing for %s", executable)
+        return cached.test_cases_by_suite
+
+    _l.debug("Test listing for %s is missing or stale, regenerating", executable)
+    listing = BinaryTestListing(
+        identity=identity,
+        test_cases_by_suite=_run_list_test_cases(executable, build_dir),
+    )
+    cache[key] = listing
+    _save_cache(build_dir, cache)
+    return listing.test_cases_by_suite
+
@@ -0,0 +1,198 @@
+from pathlib import Path
+from typing import (
+    Dict,
+    FrozenSet,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+from dataclasses import dataclass
+from . import subprocess_trace as subprocess
+from . import json
+from .json import (
+    Json,
+)
+from .config_file import (
+    ProjectConfig,
+)
+from .targets import (
+    CpuTestCaseTarget,
+    CudaTestCaseTarget,
+)
+from .test_timings import (
+    get_test_timing_key,
+)
+import hashlib
+import logging
+import os
+import re
+
+_l = logging.getLogger(__name__)
+
+TEST_RESULT_CACHE_FILENAME = ".proj-test-result-cache.json"
+
+LDD_LINE_RE = re.compile(r"^\s*(?P<name>\S+)\s+=>\s+(?P<path>/\S+)")
+
+
+@dataclass(frozen=True, eq=True)
+class CachedTestCaseResult:
+    binary_hash: str
+    duration: float
+
+    def json(self) -> Json:
+        return {
+            "binary_hash": self.binary_hash,
+            "duration": self.duration,
+        }
+
+    @staticmethod
+    def from_json(j: Json) -> "CachedTestCaseResult":
+        assert isinstance(j, dict)
+        assert isinstance(j["binary_hash"], str)
+        assert isinstance(j["duration"], (int, float))
+        return CachedTestCaseResult(
+            binary_hash=j["binary_hash"],
+            duration=float(j["duration"]),
+        )
+
+
+def get_test_result_cache_path(build_dir: Path) -> Path:
+    return build_dir / TEST_RESULT_CACHE_FILENAME
+
+
+def parse_ldd_output(output: str) -> Tuple[Path, ...]:
+    result = []
+    for line in output.splitlines():
+        match = LDD_LINE_RE.match(line)
+        if match is not None:
+            result.append(Path(match.group("path")))
+    return tuple(result)
+
+
+def get_project_shared_library_dependencies(
+    config: ProjectConfig,
+    executable: Path,
+    build_dir: Path,
+) -> Tuple[Path, ...]:
+    project_libs = frozenset(
+        (build_dir / lib.so_path).resolve() for lib in config.lib_targets
+    )
+
+    resolved: Optional[FrozenSet[Path]]
+    try:
+        output = subprocess.check_output(
+            ["ldd", str(executable)],
+            stderr=subprocess.DEVNULL,
+            env=os.environ,
+            text=True,
+        )
+        resolved = frozenset(p.resolve() for p in parse_ldd_output(output))
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        _l.debug(
+            "Failed to resolve shared libraries of %s, assuming it depends on all project libraries",
+            executable,
+        )
+        resolved = None
+
+    if resolved is None:
+        deps = project_libs
+    else:
+        deps = project_libs.intersection(resolved)
+
+    return tuple(sorted(p for p in deps if p.is_file()))
+
+
+def get_test_binary_hash(
+    config: ProjectConfig,
+    test_case: Union[CpuTestCaseTarget, CudaTestCaseTarget],
+    build_dir: Path,
+) -> str:
+    executable = build_dir / test_case.test_suite.run_target.executable_path
+    h = hashlib.md5()
+    for arg in config.cmd_for_run_target(test_case.test_suite.run_target):
+        h.update(arg.encode("utf-8") + b"\0")
+    for p in [
+        executable,
+        *get_project_shared_library_dependencies(config, executable, build_dir),
+    ]:
+        h.update(str(p).encode("utf-8") + b"\0")
+        # test binaries and libraries with debug info can be hundreds of MB,
+        # so they are hashed in chunks rather than read into memory
+        with p.open("rb") as f:
+            h.update(hashlib.file_digest(f, "md5").digest())
+    return h.hexdigest()
+
+
+def load_test_result_cache(build_dir: Path) -> Dict[str, CachedTestCaseResult]:
+    path = get_test_result_cache_path(build_dir)
+    try:
+        with path.open("r") as f:
+            raw = json.loads(f.read())
+        assert isinstance(raw, dict)
+        return {k: CachedTestCaseResult.from_json(v) for k, v in raw.items()}
+    except FileNotFoundError:
+        return {}
+    except (ValueError, AssertionError, KeyError):
+        _l.warning("Ignoring malformed test result cache at %s", path)
+        return {}
+
+
+def save_test_result_cache(
+    build_dir: Path, cache: Mapping[str, CachedTestCaseResult]
+) -> None:
+    path = get_test_result_cache_path(build_dir)
+    # unique to this process, as several proj processes may share a build dir
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w") as f:
+        f.write(
+            json.dumps({k: v.json() for k, v in cache.items()}, sort_keys=True, indent=2)
+        )
+    os.replace(tmp_path, path)
+
+
+def get_binary_hashes(
+    config: ProjectConfig,
+    test_cases: Sequence[Union[CpuTestCaseTarget, CudaTestCaseTarget]],
+    build_dir: Path,
+) -> Dict[Union[CpuTestCaseTarget, CudaTestCaseTarget], str]:
+    by_suite: Dict[object, str] = {}
+    result = {}
+    for test_case in test_cases:
+        if test_case.test_suite not in by_suite:
+            by_suite[test_case.test_suite] = get_test_binary_hash(
+                config, test_case, build_dir
+            )
+        result[test_case] = by_suite[test_case.test_suite]
+    return result
+
+
+def lookup_cached_passes(
+    cache: Mapping[str, CachedTestCaseResult],
+    binary_hashes: Mapping[Union[CpuTestCaseTarget, CudaTestCaseTarget], str],
+) -> Dict[Union[CpuTestCaseTarget, CudaTestCaseTarget], CachedTestCaseResult]:
+    result = {}
+    for test_case, binary_hash in binary_hashes.items():
+        cached = cache.get(get_test_timing_key(test_case))
+        if cached is not None and cached.binary_hash == binary_hash:
+            result[test_case] = cached
+    return result
+
+
+def update_test_result_cache(
+    build_dir: Path,
+    binary_hashes: Mapping[Union[CpuTestCaseTarget, CudaTestCaseTarget], str],
+    results: Mapping[Union[CpuTestCaseTarget, CudaTestCaseTarget], Tuple[bool, float]],
+) -> None:
+    cache = load_test_result_cache(build_dir)
+    for test_case, (did_pass, duration) in results.items():
+        key = get_test_timing_key(test_case)
+        if did_pass:
+            cache[key] = CachedTestCaseResult(
+                binary_hash=binary_hashes[test_case],
+                duration=duration,
+            )
+        elif key in cache:
+            del cache[key]
+    save_test_result_cache(build_dir, cache)
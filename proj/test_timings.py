@@ -0,0 +1,131 @@
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    Iterable,
+    Mapping,
+    Sequence,
+    Tuple,
+    Union,
+    Optional,
+)
+from .targets import (
+    CpuTestCaseTarget,
+    CudaTestCaseTarget,
+)
+from . import json
+import logging
+import os
+
+_l = logging.getLogger(__name__)
+
+TEST_TIMINGS_FILENAME = ".proj-test-timings.json"
+
+
+def get_test_timings_path(build_dir: Path) -> Path:
+    return build_dir / TEST_TIMINGS_FILENAME
+
+
+def get_test_timing_key(test_case: Union[CpuTestCaseTarget, CudaTestCaseTarget]) -> str:
+    return f"{test_case.test_suite.test_suite_name}:{test_case.test_case_name}"
+
+
+def load_test_timings(build_dir: Path) -> Dict[str, float]:
+    path = get_test_timings_path(build_dir)
+    try:
+        with path.open("r") as f:
+            raw = json.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        _l.warning("Ignoring malformed test timing database at %s", path)
+        return {}
+
+    if not isinstance(raw, dict):
+        _l.warning("Ignoring malformed test timing database at %s", path)
+        return {}
+
+    return {
+        k: float(v)
+        for k, v in raw.items()
+        if isinstance(v, (int, float))
+    }
+
+
+def save_test_timings(build_dir: Path, timings: Mapping[str, float]) -> None:
+    path = get_test_timings_path(build_dir)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    # unique to this process, as several proj processes may share a build dir
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w") as f:
+        f.write(json.dumps(dict(timings), sort_keys=True, indent=2))
+    os.replace(tmp_path, path)
+
+
+def update_test_timings(
+    build_dir: Path,
+    durations: Iterable[
+        Tuple[Union[CpuTestCaseTarget, CudaTestCaseTarget], float]
+    ],
+) -> None:
+    timings = load_test_timings(build_dir)
+    for test_case, duration in durations:
+        timings[get_test_timing_key(test_case)] = duration
+    save_test_timings(build_dir, timings)
+
+
+def get_expected_duration(
+    timings: Mapping[str, float],
+    test_case: Union[CpuTestCaseTarget, CudaTestCaseTarget],
+) -> Optional[float]:
+    return timings.get(get_test_timing_key(test_case))
+
+
+def schedule_longest_first(
+    test_cases: Sequence[Union[CpuTestCaseTarget, CudaTestCaseTarget]],
+    timings: Mapping[str, float],
+) -> Tuple[Union[CpuTestCaseTarget, CudaTestCaseTarget], ...]:
+    # test cases without a recorded duration could be arbitrarily slow, so
+    # they are started before any test case with a known duration
+    def sort_key(
+        test_case: Union[CpuTestCaseTarget, CudaTestCaseTarget],
+    ) -> float:
+        expected = get_expected_duration(timings, test_case)
+        if expected is None:
+            return float("-inf")
+        else:
+            return -expected
+
+    return tuple(sorted(test_cases, key=sort_key))
+
+
+def shard_test_cases(
+    test_cases: Sequence[Union[CpuTestCaseTarget, CudaTestCaseTarget]],
+    timings: Mapping[str, float],
+    num_shards: int,
+) -> Tuple[Tuple[Union[CpuTestCaseTarget, CudaTestCaseTarget], ...], ...]:
+    assert num_shards >= 1
+
+    known = [
+        d
+        for d in (get_expected_duration(timings, t) for t in test_cases)
+        if d is not None
+    ]
+    if len(known) > 0:
+        default_duration = max(known)
+    else:
+        default_duration = 1.0
+
+    shards: List[List[Union[CpuTestCaseTarget, CudaTestCaseTarget]]] = [
+        [] for _ in range(num_shards)
+    ]
+    loads = [0.0 for _ in range(num_shards)]
+    for test_case in schedule_longest_first(test_cases, timings):
+        expected = get_expected_duration(timings, test_case)
+        if expected is None:
+            expected = default_duration
+        lightest = min(range(num_shards), key=lambda i: loads[i])
+        shards[lightest].append(test_case)
+        loads[lightest] += expected
+
+    return tuple(tuple(shard) for shard in shards)
@@ -4,10 +4,17 @@ from typing import (
     Union,
     Iterable,
     Tuple,
+    Dict,
+    Callable,
+    Optional,
+    List,
+    cast,
 )
 from .targets import (
+    CpuRunTarget,
     CpuTestSuiteTarget,
     CpuTestCaseTarget,
+    CudaRunTarget,
     CudaTestSuiteTarget,
     CudaTestCaseTarget,
     GenericTestSuiteTarget,
@@ -29,8 +36,18 @@ from .utils import (
     concatmap,
 )
 import itertools
+import time
+import math
+import tempfile
+from xml.etree import ElementTree
 from dataclasses import (
     dataclass,
+    replace,
+)
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    Future,
+    as_completed,
 )
 from .progressbar import (
     get_progress_manager,
@@ -38,6 +55,21 @@ from .progressbar import (
 from .terminal_colors import (
     TermColor,
 )
+from .test_listing import (
+    list_test_cases_in_binary,
+)
+from .test_result_cache import (
+    get_binary_hashes,
+    load_test_result_cache,
+    lookup_cached_passes,
+    update_test_result_cache,
+)
+from .test_timings import (
+    load_test_timings,
+    update_test_timings,
+    schedule_longest_first,
+    shard_test_cases,
+)
 
 _l = logging.getLogger(__name__)
 
@@ -63,20 +95,12 @@ def list_test_cases_in_single_suite(
     suite: Union[CpuTestSuiteTarget, CudaTestSuiteTarget],
     build_dir: Path,
 ) -> Iterator[Union[CpuTestCaseTarget, CudaTestCaseTarget]]:
-    output = subprocess.check_output(
-        [
-            str(suite.run_target.executable_path),
-            "--list-test-cases",
-            f"--test-suite={suite.test_suite_name}",
-        ],
-        stderr=sys.stdout,
-        cwd=build_dir,
-        env=os.environ,
-        text=True,
-    ).splitlines()[2:-2]
+    test_cases_by_suite = list_test_cases_in_binary(
+        suite.run_target.executable_path, build_dir
+    )
 
-    for line in output:
-        yield suite.get_test_case(line)
+    for test_case_name in test_cases_by_suite.get(suite.test_suite_name, tuple()):
+        yield suite.get_test_case(test_case_name)
 
 
 def list_test_cases_in_suite(
@@ -128,8 +152,8 @@ def resolve_test_case_target_using_build(
         _l.debug("Was able to resolve type of test case %s to be %s without build. Returning...", test_case, result_without_build)
         return result_without_build
     else:
-        all_test_cases_in_suite = list_test_cases_in_suite(
-            test_case.test_suite, build_dir
+        all_test_cases_in_suite = list(
+            list_test_cases_in_suite(test_case.test_suite, build_dir)
         )
         cpu_test_case_names = [
             t.test_case_name
@@ -165,6 +189,7 @@ class TestCaseResult:
     did_pass: bool
     stderr: bytes
     stdout: bytes
+    duration: float
 
 
 def run_test_case(
@@ -191,6 +216,7 @@ def run_test_case(
         )
         sys.exit(0)
     else:
+        start = time.monotonic()
         completed_process = subprocess.run(
             command=cmd,
             stdout=subprocess.PIPE,
@@ -198,12 +224,202 @@ def run_test_case(
             cwd=cwd,
             env=env,
         )
+        end = time.monotonic()
 
         return TestCaseResult(
             did_pass=(completed_process.returncode == 0),
             stderr=completed_process.stderr,
             stdout=completed_process.stdout,
+            duration=(end - start),
+        )
+
+
+def can_batch_test_case(
+    test_case: Union[CpuTestCaseTarget, CudaTestCaseTarget],
+) -> bool:
+    # doctest treats these characters specially in --test-case filters, so test
+    # cases with them in their names are always run on their own
+    return not any(c in test_case.test_case_name for c in "*?\\")
+
+
+def escape_doctest_filter(s: str) -> str:
+    return s.replace(",", "\\,")
+
+
+# runs all of the given test cases, which must be from the same suite, in a
+# single invocation. the suite filter keeps same-named test cases from other
+# suites in the binary from running as part of the batch
+def get_test_case_batch_run_target(
+    test_cases: Sequence[Union[CpuTestCaseTarget, CudaTestCaseTarget]],
+) -> Union[CpuRunTarget, CudaRunTarget]:
+    run_target = test_cases[0].run_target
+    args = (
+        f"--test-suite={escape_doctest_filter(test_cases[0].test_suite.test_suite_name)}",
+        "--test-case="
+        + ",".join(escape_doctest_filter(t.test_case_name) for t in test_cases),
+    )
+    return replace(
+        run_target,
+        generic_run_target=replace(run_target.generic_run_target, args=args),
+    )
+
+
+@dataclass(frozen=True, eq=True)
+class DoctestCaseReport:
+    did_pass: bool
+    duration: float
+
+
+def parse_doctest_xml_report(
+    xml: bytes,
+    test_suite_name: str,
+) -> Dict[str, DoctestCaseReport]:
+    # the report is parsed incrementally so that results for test cases that
+    # finished before a crash are still recovered from a truncated file
+    parser: ElementTree.XMLPullParser[ElementTree.Element] = (
+        ElementTree.XMLPullParser(events=("start", "end"))
+    )
+    try:
+        parser.feed(xml)
+    except ElementTree.ParseError:
+        _l.debug("Failed to fully parse doctest xml report")
+
+    result: Dict[str, DoctestCaseReport] = {}
+    current_suite: Optional[str] = None
+    try:
+        for event, elem in cast(
+            Iterator[Tuple[str, ElementTree.Element]], parser.read_events()
+        ):
+            if event == "start" and elem.tag == "TestSuite":
+                current_suite = elem.get("name")
+            elif event == "end" and elem.tag == "TestCase":
+                if current_suite != test_suite_name:
+                    continue
+                name = elem.get("name")
+                overall = elem.find("OverallResultsAsserts")
+                if name is None or overall is None:
+                    continue
+                report = DoctestCaseReport(
+                    did_pass=(overall.get("test_case_success") == "true"),
+                    duration=float(overall.get("duration", "0")),
+                )
+                previous = result.get(name)
+                if previous is not None:
+                    report = DoctestCaseReport(
+                        did_pass=(previous.did_pass and report.did_pass),
+                        duration=(previous.duration + report.duration),
+                    )
+                result[name] = report
+    except ElementTree.ParseError:
+        _l.debug("Failed to fully parse doctest xml report")
+
+    return result
+
+
+def run_test_case_batch(
+    config: ProjectConfig,
+    test_cases: Sequence[Union[CpuTestCaseTarget, CudaTestCaseTarget]],
+    build_dir: Path,
+) -> Tuple[TestCaseResult, ...]:
+    assert len(test_cases) >= 1
+    if len(test_cases) == 1:
+        return (
+            run_test_case(
+                config=config,
+                test_case=test_cases[0],
+                build_dir=build_dir,
+                debug=False,
+            ),
+        )
+
+    test_suite = test_cases[0].test_suite
+    assert all(t.test_suite == test_suite for t in test_cases)
+    assert all(can_batch_test_case(t) for t in test_cases)
+    _l.info("Running batch of %d test cases from %s", len(test_cases), test_suite)
+
+    cwd = build_dir / test_suite.run_target.executable_path.parent
+    with tempfile.TemporaryDirectory() as d:
+        report_path = Path(d) / "report.xml"
+        cmd = [
+            *config.cmd_for_run_target(get_test_case_batch_run_target(test_cases)),
+            "--case-sensitive=true",
+            "--duration=true",
+            "--reporters=xml",
+            f"--out={report_path}",
+        ]
+        completed_process = subprocess.run(
+            command=cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=os.environ,
         )
+        if report_path.is_file():
+            reports = parse_doctest_xml_report(
+                report_path.read_bytes(), test_suite.test_suite_name
+            )
+        else:
+            reports = {}
+
+    if completed_process.returncode != 0:
+        _l.info(
+            "Batch for %s exited with code %d, rerunning failed test cases individually",
+            test_suite,
+            completed_process.returncode,
+        )
+
+    results = []
+    for test_case in test_cases:
+        report = reports.get(test_case.test_case_name)
+        if report is not None and report.did_pass:
+            results.append(
+                TestCaseResult(
+                    did_pass=True,
+                    stderr=b"",
+                    stdout=b"",
+                    duration=report.duration,
+                )
+            )
+        else:
+            # failures (and test cases the batch never reported on, e.g., due
+            # to a crash) are rerun in isolation to get their output
+            results.append(
+                run_test_case(
+                    config=config,
+                    test_case=test_case,
+                    build_dir=build_dir,
+                    debug=False,
+                )
+            )
+    return tuple(results)
+
+
+def make_test_case_batches(
+    test_cases: Sequence[Union[CpuTestCaseTarget, CudaTestCaseTarget]],
+    batch_size: int,
+) -> Tuple[Tuple[Union[CpuTestCaseTarget, CudaTestCaseTarget], ...], ...]:
+    assert batch_size >= 1
+
+    batches: List[List[Union[CpuTestCaseTarget, CudaTestCaseTarget]]] = []
+    open_batches: Dict[
+        Union[CpuTestSuiteTarget, CudaTestSuiteTarget],
+        List[Union[CpuTestCaseTarget, CudaTestCaseTarget]],
+    ] = {}
+    for test_case in test_cases:
+        if not can_batch_test_case(test_case):
+            batches.append([test_case])
+            continue
+
+        batch = open_batches.get(test_case.test_suite)
+        if batch is None:
+            batch = []
+            open_batches[test_case.test_suite] = batch
+            batches.append(batch)
+        batch.append(test_case)
+        if len(batch) >= batch_size:
+            del open_batches[test_case.test_suite]
+
+    return tuple(tuple(batch) for batch in batches)
 
 
 @dataclass(frozen=True, eq=True)
@@ -260,6 +476,64 @@ def report_test_failure(
     msg(test_case_result.stderr)
 
 
+def run_test_cases(
+    config: ProjectConfig,
+    test_cases: Sequence[Union[CpuTestCaseTarget, CudaTestCaseTarget]],
+    build_dir: Path,
+    jobs: int,
+    cuda_jobs: int,
+    on_complete: Callable[[Union[CpuTestCaseTarget, CudaTestCaseTarget]], None],
+    batch_size: int = 1,
+) -> Tuple[TestCaseResult, ...]:
+    assert jobs >= 1
+    assert cuda_jobs >= 1
+    assert batch_size >= 1
+
+    # don't let batching leave workers idle
+    if len(test_cases) > 0:
+        batch_size = min(batch_size, math.ceil(len(test_cases) / jobs))
+    batches = make_test_case_batches(test_cases, batch_size)
+    _l.debug(
+        "Running %d test cases in %d batches with %d cpu workers and %d cuda workers",
+        len(test_cases),
+        len(batches),
+        jobs,
+        cuda_jobs,
+    )
+
+    results: Dict[Union[CpuTestCaseTarget, CudaTestCaseTarget], TestCaseResult] = {}
+    with ThreadPoolExecutor(
+        max_workers=jobs, thread_name_prefix="proj-test-cpu"
+    ) as cpu_pool, ThreadPoolExecutor(
+        max_workers=cuda_jobs, thread_name_prefix="proj-test-cuda"
+    ) as cuda_pool:
+        futures: Dict[
+            Future[Tuple[TestCaseResult, ...]],
+            Tuple[Union[CpuTestCaseTarget, CudaTestCaseTarget], ...],
+        ] = {}
+        for batch in batches:
+            if isinstance(batch[0], CudaTestCaseTarget):
+                pool = cuda_pool
+            else:
+                assert isinstance(batch[0], CpuTestCaseTarget)
+                pool = cpu_pool
+            future = pool.submit(
+                run_test_case_batch,
+                config=config,
+                test_cases=batch,
+                build_dir=build_dir,
+            )
+            futures[future] = batch
+
+        for future in as_completed(futures):
+            batch = futures[future]
+            for test_case, test_case_result in zip(batch, future.result()):
+                results[test_case] = test_case_result
+                on_complete(test_case)
+
+    return tuple(results[test_case] for test_case in test_cases)
+
+
 def run_test_suites(
     config: ProjectConfig,
     test_suites: Sequence[
@@ -267,6 +541,11 @@ def run_test_suites(
     ],
     build_dir: Path,
     debug: bool,
+    jobs: int = 1,
+    cuda_jobs: int = 1,
+    shard: Optional[Tuple[int, int]] = None,
+    batch_size: int = 1,
+    use_result_cache: bool = False,
 ) -> TestStatistics:
     _l.info("Running test suites %s", test_suites)
 
@@ -277,25 +556,99 @@ def run_test_suites(
         )
     )
 
+    timings = load_test_timings(build_dir)
+
+    if shard is not None:
+        (shard_index, num_shards) = shard
+        assert 0 <= shard_index < num_shards
+        in_shard = set(shard_test_cases(test_cases, timings, num_shards)[shard_index])
+        test_cases = tuple(t for t in test_cases if t in in_shard)
+        _l.info(
+            "Running %d test cases in shard %d/%d",
+            len(test_cases),
+            shard_index + 1,
+            num_shards,
+        )
+
     passed = []
     failed = []
 
+    test_case_results: Dict[
+        Union[CpuTestCaseTarget, CudaTestCaseTarget], TestCaseResult
+    ] = {}
+
+    binary_hashes: Dict[Union[CpuTestCaseTarget, CudaTestCaseTarget], str] = {}
+    if use_result_cache and not debug:
+        binary_hashes = get_binary_hashes(config, test_cases, build_dir)
+        cached_passes = lookup_cached_passes(
+            load_test_result_cache(build_dir), binary_hashes
+        )
+        _l.info(
+            "Skipping %d test cases which previously passed with identical binaries",
+            len(cached_passes),
+        )
+        for test_case, cached in cached_passes.items():
+            test_case_results[test_case] = TestCaseResult(
+                did_pass=True,
+                stderr=b"",
+                stdout=b"",
+                duration=cached.duration,
+            )
+    to_run = tuple(t for t in test_cases if t not in test_case_results)
+
     manager = get_progress_manager()
     with manager.counter(total=len(test_cases), desc="Running tests") as pbar:
-        for test_case in test_cases:
-            test_case_result = run_test_case(
-                config=config,
-                test_case=test_case,
-                build_dir=build_dir,
-                debug=debug,
+        pbar.update(incr=len(test_case_results))
+        if debug:
+            for test_case in to_run:
+                test_case_results[test_case] = run_test_case(
+                    config=config,
+                    test_case=test_case,
+                    build_dir=build_dir,
+                    debug=debug,
+                )
+                pbar.update()
+        else:
+            scheduled = schedule_longest_first(to_run, timings)
+            test_case_results.update(
+                zip(
+                    scheduled,
+                    run_test_cases(
+                        config=config,
+                        test_cases=scheduled,
+                        build_dir=build_dir,
+                        jobs=jobs,
+                        cuda_jobs=cuda_jobs,
+                        on_complete=lambda _: pbar.update(),
+                        batch_size=batch_size,
+                    ),
+                )
             )
-            pbar.update()
-            if test_case_result.did_pass:
-                passed.append(test_case)
-            else:
-                failed.append(test_case)
 
-                report_test_failure(test_case, test_case_result)
+    update_test_timings(
+        build_dir,
+        [(t, test_case_results[t].duration) for t in to_run],
+    )
+    if use_result_cache and not debug:
+        update_test_result_cache(
+            build_dir,
+            binary_hashes,
+            {
+                t: (test_case_results[t].did_pass, test_case_results[t].duration)
+                for t in to_run
+            },
+        )
+
+    # results are reported in listing order (rather than completion order) so
+    # that the output does not depend on scheduling
+    for test_case in test_cases:
+        test_case_result = test_case_results[test_case]
+        if test_case_result.did_pass:
+            passed.append(test_case)
+        else:
+            failed.append(test_case)
+
+            report_test_failure(test_case, test_case_result)
 
     return TestStatistics(
         passed=tuple(passed),
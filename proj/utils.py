@@ -7,6 +7,8 @@ from typing import (
     Iterable,
 )
 from functools import reduce
+from pathlib import Path
+import os
 
 T = TypeVar("T")
 T1 = TypeVar("T1")
@@ -46,3 +48,21 @@ def map_optional(x: Optional[T1], f: Callable[[T1], T2]) -> Optional[T2]:
         return x
     else:
         return f(x)
+
+
+# atomically replaces the contents of `path` with `contents`, leaving the file
+# (and so its mtime) untouched if it already has exactly those contents.
+# returns whether the file was written
+def write_file_if_changed(path: Path, contents: bytes) -> bool:
+    try:
+        if path.read_bytes() == contents:
+            return False
+    except FileNotFoundError:
+        pass
+
+    path.parent.mkdir(exist_ok=True, parents=True)
+    # unique to this process, as several proj processes may share a build dir
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(contents)
+    os.replace(tmp_path, path)
+    return True
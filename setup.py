@@ -10,6 +10,6 @@ setup(
         'typing-extensions',
     ], 
     entry_points={ 
-        'console_scripts': ['proj = proj.__main__:entrypoint' ] 
+        'console_scripts': ['proj = proj.client:entrypoint' ] 
     },
 )
@@ -9,6 +9,14 @@ from proj.config_file import (
 from proj.dtgen.find_outdated import (
     find_outdated,
 )
+from proj.dtgen.manifest import (
+    get_spec_output_paths,
+    load_dtgen_manifest,
+    scan_dtgen_tree,
+)
+from proj.dtgen.project import (
+    find_files,
+)
 from proj.config_file import (
     get_config,
 )
@@ -54,3 +62,42 @@ def test_get_possible_spec_paths():
         assert found == correct
 
 
+
+def test_scan_dtgen_tree_prunes_build_dir():
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+
+        (d / 'build/lib/person').mkdir(parents=True)
+        with (d / 'build/lib/person/ignored.struct.toml').open('w') as _:
+            pass
+        with (d / 'build/lib/person/ignored.dtg.cc').open('w') as _:
+            pass
+
+        tree = scan_dtgen_tree(d, config)
+        assert set(tree.spec_paths) == set(find_files(d, config))
+        assert all(not p.is_relative_to(d / 'build') for p in tree.spec_paths)
+        assert all(not p.is_relative_to(d / 'build') for p in tree.generated_paths)
+
+def test_find_outdated_uses_updated_manifest():
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        spec_path = d / 'lib/person/include/person/color.enum.toml'
+        header_path, source_path = get_spec_output_paths(d, config, spec_path)
+        with header_path.open('w') as _:
+            pass
+        with source_path.open('w') as _:
+            pass
+
+        assert list(find_outdated(d, config)) == []
+        manifest = load_dtgen_manifest(d)
+        assert manifest is not None
+        assert manifest.outputs[spec_path.relative_to(d)] == (
+            header_path.relative_to(d),
+            source_path.relative_to(d),
+        )
+
+        spec_path.unlink()
+        assert set(find_outdated(d, config)) == {header_path, source_path}
+        manifest = load_dtgen_manifest(d)
+        assert manifest is not None
+        assert spec_path.relative_to(d) not in manifest.outputs
@@ -0,0 +1,80 @@
+from proj.dtgen.layout import (
+    layout_cpp,
+)
+
+def test_layout_cpp_declarations() -> None:
+    code = (
+        '#include <string>\n'
+        '#include "person/person.dtg.h"\n'
+        '#include <functional>\n'
+        'namespace FlexFlow { struct Person { Person() = delete; '
+        'explicit Person(std::string const & first_name, std::string const & last_name, int const & age); '
+        'bool operator==(Person const &) const; std::string first_name; private: int age; }; } // namespace FlexFlow\n'
+        'namespace std { template <> struct hash<::FlexFlow::Person> { '
+        'size_t operator()(::FlexFlow::Person const &) const; }; }\n'
+    )
+
+    assert layout_cpp(code) == (
+        '#include "person/person.dtg.h"\n'
+        '#include <functional>\n'
+        '#include <string>\n'
+        'namespace FlexFlow {\n'
+        'struct Person {\n'
+        '  Person() = delete;\n'
+        '  explicit Person(std::string const &first_name,\n'
+        '                  std::string const &last_name,\n'
+        '                  int const &age);\n'
+        '  bool operator==(Person const &) const;\n'
+        '  std::string first_name;\n'
+        '\n'
+        'private:\n'
+        '  int age;\n'
+        '};\n'
+        '} // namespace FlexFlow\n'
+        'namespace std {\n'
+        'template <>\n'
+        'struct hash<::FlexFlow::Person> {\n'
+        '  size_t operator()(::FlexFlow::Person const &) const;\n'
+        '};\n'
+        '} // namespace std\n'
+    )
+
+def test_layout_cpp_function_bodies() -> None:
+    code = (
+        'namespace FlexFlow { enum class Color { RED, GREEN, BLUE }; '
+        'std::string format_as(Color x) { switch (x) { case Color::RED: return "RED"; '
+        'default: throw std::runtime_error(fmt::format("Unknown enum value for Color: {}", static_cast<size_t>(x))); } } '
+        'size_t hash(Color const &x) { size_t result = 0; '
+        'result ^= std::hash<std::string>{}(x.first_name) + 0x9e3779b9 + (result << 6) + (result >> 2); '
+        'return result; } }\n'
+    )
+
+    assert layout_cpp(code) == (
+        'namespace FlexFlow {\n'
+        'enum class Color { RED, GREEN, BLUE };\n'
+        'std::string format_as(Color x) {\n'
+        '  switch (x) {\n'
+        '    case Color::RED:\n'
+        '      return "RED";\n'
+        '    default:\n'
+        '      throw std::runtime_error(fmt::format("Unknown enum value for Color: {}",\n'
+        '                                           static_cast<size_t>(x)));\n'
+        '  }\n'
+        '}\n'
+        'size_t hash(Color const &x) {\n'
+        '  size_t result = 0;\n'
+        '  result ^= std::hash<std::string>{}(x.first_name) + 0x9e3779b9 +\n'
+        '            (result << 6) + (result >> 2);\n'
+        '  return result;\n'
+        '}\n'
+        '} // namespace FlexFlow\n'
+    )
+
+def test_layout_cpp_is_idempotent() -> None:
+    code = (
+        'template <typename T> struct MyList { MyList(T const &head, ::FlexFlow::MyList<T> const &tail) '
+        ': head(head), tail_ptr(std::make_shared<::FlexFlow::MyList<T>>(tail)) {} T head; };\n'
+    )
+
+    once = layout_cpp(code)
+    assert layout_cpp(once) == once
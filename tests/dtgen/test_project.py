@@ -0,0 +1,161 @@
+from ..project_utils import (
+    project_instance,
+)
+import proj.dtgen.project as dtgen_project
+from proj.dtgen.project import (
+    DTGEN_LAYOUT_SOURCE,
+    DTGEN_RENDER_SOURCES,
+    find_files,
+    get_generator_source_hash,
+    run_dtgen,
+)
+from proj.dtgen.layout import (
+    layout_cpp,
+)
+from proj.config_file import (
+    ProjectConfig,
+    get_config,
+)
+from os import PathLike
+from pathlib import Path
+import dataclasses
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Sequence,
+)
+import os
+import pytest
+
+def fake_run_formatter(config: ProjectConfig, files: Optional[Sequence[PathLike[str]]] = None, jobs: Optional[int] = None) -> None:
+    pass
+
+def read_generated(d: Path) -> Dict[Path, str]:
+    return {
+        p.relative_to(d): p.read_text()
+        for p in sorted([*d.rglob('*.dtg.hh'), *d.rglob('*.dtg.cc')])
+    }
+
+def test_parallel_dtgen_matches_serial(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dtgen_project, 'run_formatter', fake_run_formatter)
+
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        run_dtgen(root=d, config=config, force=True, jobs=1)
+        serial = read_generated(d)
+
+        for p in serial.keys():
+            (d / p).unlink()
+
+        run_dtgen(root=d, config=config, force=True, jobs=4)
+        parallel = read_generated(d)
+
+        assert len(serial) == 2 * len(list(find_files(d)))
+        assert parallel == serial
+
+def test_up_to_date_dtgen_starts_no_workers(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dtgen_project, 'run_formatter', fake_run_formatter)
+
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        run_dtgen(root=d, config=config, force=False, jobs=4)
+        before = read_generated(d)
+
+        def failing_pool(*args: object, **kwargs: object) -> None:
+            assert False
+
+        monkeypatch.setattr(dtgen_project, 'ProcessPoolExecutor', failing_pool)
+        run_dtgen(root=d, config=config, force=False, jobs=4)
+        assert read_generated(d) == before
+
+def test_parallel_dtgen_reports_failing_spec(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dtgen_project, 'run_formatter', fake_run_formatter)
+
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        broken = d / 'lib/person/include/person/broken.struct.toml'
+        broken.write_text('this is not = valid = toml')
+
+        with pytest.raises(Exception) as excinfo:
+            run_dtgen(root=d, config=config, force=True, jobs=4)
+
+        notes: List[str] = getattr(excinfo.value, '__notes__', [])
+        assert f'while generating files from {broken}' in notes
+
+def test_dtgen_regenerates_based_on_content_hash(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dtgen_project, 'run_formatter', fake_run_formatter)
+
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        spec = d / 'lib/person/include/person/color.enum.toml'
+        header = d / 'lib/person/include/person/color.dtg.hh'
+        source = d / 'lib/person/src/person/color.dtg.cc'
+
+        run_dtgen(root=d, config=config, force=True, jobs=1)
+        header_mtime = header.stat().st_mtime_ns
+        header_contents = header.read_text()
+
+        # only bumping the spec's mtime, as a checkout would, changes nothing
+        os.utime(spec, ns=(header_mtime + 10**9, header_mtime + 10**9))
+        run_dtgen(root=d, config=config, force=False, jobs=1)
+        assert header.stat().st_mtime_ns == header_mtime
+
+        # an output from before the generator hash was recorded is regenerated
+        source.write_text(source.read_text().replace('"generator"', '"unrelated"'))
+        run_dtgen(root=d, config=config, force=False, jobs=1)
+        assert '"generator"' in source.read_text()
+        assert header.stat().st_mtime_ns == header_mtime
+
+        spec.write_text(spec.read_text() + '\n')
+        run_dtgen(root=d, config=config, force=False, jobs=1)
+        assert header.read_text() != header_contents
+
+def test_forced_dtgen_leaves_unchanged_outputs_untouched(monkeypatch: pytest.MonkeyPatch) -> None:
+    formatted: List[Path] = []
+
+    def appending_formatter(config: ProjectConfig, files: Optional[Sequence[PathLike[str]]] = None, jobs: Optional[int] = None) -> None:
+        assert files is not None
+        for f in files:
+            p = Path(f)
+            p.write_text(p.read_text() + '// formatted\n')
+            formatted.append(p)
+
+    monkeypatch.setattr(dtgen_project, 'run_formatter', appending_formatter)
+
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        header = d / 'lib/person/include/person/color.dtg.hh'
+
+        run_dtgen(root=d, config=config, force=True, jobs=1)
+        assert header.read_text().endswith('// formatted\n')
+        assert all(not p.is_relative_to(d) for p in formatted)
+        before = read_generated(d)
+        mtimes = {p: (d / p).stat().st_mtime_ns for p in before}
+
+        run_dtgen(root=d, config=config, force=True, jobs=1)
+        assert read_generated(d) == before
+        assert {p: (d / p).stat().st_mtime_ns for p in before} == mtimes
+
+def test_builtin_layout_dtgen_skips_formatter(monkeypatch: pytest.MonkeyPatch) -> None:
+    def failing_formatter(config: ProjectConfig, files: Optional[Sequence[PathLike[str]]] = None, jobs: Optional[int] = None) -> None:
+        assert False
+
+    monkeypatch.setattr(dtgen_project, 'run_formatter', failing_formatter)
+
+    with project_instance('dtgen') as d:
+        config = dataclasses.replace(get_config(d), _dtgen_builtin_layout=True)
+        header = d / 'lib/person/include/person/color.dtg.hh'
+
+        run_dtgen(root=d, config=config, force=True, jobs=1)
+        contents = header.read_text()
+        assert '\nenum class Color {\n  RED,\n  BLUE,\n' in contents
+        assert layout_cpp(contents) == contents
+
+def test_generator_hash_only_covers_rendering_modules() -> None:
+    assert 'watch.py' not in DTGEN_RENDER_SOURCES
+    assert 'manifest.py' not in DTGEN_RENDER_SOURCES
+    assert DTGEN_LAYOUT_SOURCE not in DTGEN_RENDER_SOURCES
+    for name in [*DTGEN_RENDER_SOURCES, DTGEN_LAYOUT_SOURCE]:
+        assert (Path(dtgen_project.__file__).parent / name).is_file()
+    assert get_generator_source_hash(True) != get_generator_source_hash(False)
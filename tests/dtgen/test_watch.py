@@ -0,0 +1,148 @@
+from ..project_utils import (
+    project_instance,
+)
+import proj.dtgen.project as dtgen_project
+from proj.dtgen.project import (
+    run_dtgen,
+)
+from proj.dtgen.manifest import (
+    load_dtgen_manifest,
+    scan_dtgen_tree,
+)
+from proj.dtgen.watch import (
+    InotifySpecWatcher,
+    PollingSpecWatcher,
+    get_spec_hashes,
+    hold_dtgen_watch_lock,
+    is_dtgen_watch_running,
+    process_spec_changes,
+    watch_dtgen,
+)
+from proj.config_file import (
+    ProjectConfig,
+    get_config,
+)
+from os import PathLike
+from typing import (
+    List,
+    Optional,
+    Sequence,
+)
+import proj.dtgen.watch as dtgen_watch
+import os
+import pytest
+
+def fake_run_formatter(config: ProjectConfig, files: Optional[Sequence[PathLike[str]]] = None, jobs: Optional[int] = None) -> None:
+    pass
+
+def test_process_spec_changes(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dtgen_project, 'run_formatter', fake_run_formatter)
+
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        spec = d / 'lib/person/include/person/color.enum.toml'
+        header = d / 'lib/person/include/person/color.dtg.hh'
+        source = d / 'lib/person/src/person/color.dtg.cc'
+
+        run_dtgen(root=d, config=config, force=False, jobs=1)
+        spec_hashes = get_spec_hashes(list(scan_dtgen_tree(d, config).spec_paths))
+
+        # touching a spec without changing it does not regenerate anything
+        os.utime(spec)
+        assert process_spec_changes(d, config, spec_hashes, {spec}, jobs=1) == []
+
+        spec.write_text(spec.read_text().replace('YELLOW', 'GREEN'))
+        assert process_spec_changes(d, config, spec_hashes, {spec}, jobs=1) == [header, source]
+        assert 'GREEN' in header.read_text()
+
+        spec.unlink()
+        assert process_spec_changes(d, config, spec_hashes, {spec}, jobs=1) == [header, source]
+        assert not header.exists()
+        assert not source.exists()
+        manifest = load_dtgen_manifest(d)
+        assert manifest is not None
+        assert spec.relative_to(d) not in manifest.outputs
+
+def test_process_spec_changes_for_removed_directory(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dtgen_project, 'run_formatter', fake_run_formatter)
+
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        spec = d / 'lib/person/include/person/color.enum.toml'
+        header = d / 'lib/person/include/person/color.dtg.hh'
+
+        run_dtgen(root=d, config=config, force=False, jobs=1)
+        spec_hashes = get_spec_hashes(list(scan_dtgen_tree(d, config).spec_paths))
+
+        spec.rename(d / 'color.enum.toml.disable')
+        process_spec_changes(d, config, spec_hashes, {spec.parent}, jobs=1)
+        assert not header.exists()
+        assert spec not in spec_hashes
+
+def test_watch_dtgen_sees_edits_during_initial_generation(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(dtgen_project, 'run_formatter', fake_run_formatter)
+
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        spec = d / 'lib/person/include/person/color.enum.toml'
+        header = d / 'lib/person/include/person/color.dtg.hh'
+
+        def editing_run_dtgen(**kwargs: object) -> None:
+            run_dtgen(**kwargs) # type: ignore[arg-type]
+            spec.write_text(spec.read_text().replace('YELLOW', 'GREEN'))
+
+        monkeypatch.setattr(dtgen_watch, 'run_dtgen', editing_run_dtgen)
+
+        iterations: List[None] = []
+        def should_stop() -> bool:
+            iterations.append(None)
+            return len(iterations) > 1
+
+        watch_dtgen(d, config, jobs=1, poll=True, poll_interval=0.0, should_stop=should_stop)
+        assert 'GREEN' in header.read_text()
+
+def test_polling_spec_watcher() -> None:
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        spec = d / 'lib/person/include/person/color.enum.toml'
+        new_spec = d / 'lib/person/include/person/shade.enum.toml'
+
+        watcher = PollingSpecWatcher(d, config, interval=0.0)
+        assert watcher.poll() == set()
+
+        spec.write_text(spec.read_text() + '\n')
+        new_spec.write_text(spec.read_text())
+        assert watcher.poll() == {spec, new_spec}
+
+        new_spec.unlink()
+        assert watcher.poll() == {new_spec}
+
+def test_inotify_spec_watcher() -> None:
+    with project_instance('dtgen') as d:
+        config = get_config(d)
+        spec = d / 'lib/person/include/person/color.enum.toml'
+        new_spec = d / 'lib/person/include/person/shades/shade.enum.toml'
+
+        watcher = InotifySpecWatcher(d, config)
+        try:
+            assert watcher.wait(timeout=0.0) == set()
+
+            spec.write_text(spec.read_text() + '\n')
+            (spec.parent / 'unrelated.txt').write_text('')
+            assert watcher.wait(timeout=1.0) == {spec}
+
+            new_spec.parent.mkdir()
+            new_spec.write_text(spec.read_text())
+            assert new_spec in watcher.wait(timeout=1.0)
+
+            new_spec.write_text(spec.read_text() + '\n')
+            assert watcher.wait(timeout=1.0) == {new_spec}
+        finally:
+            watcher.close()
+
+def test_is_dtgen_watch_running() -> None:
+    with project_instance('dtgen') as d:
+        assert not is_dtgen_watch_running(d)
+        with hold_dtgen_watch_lock(d):
+            assert is_dtgen_watch_running(d)
+        assert not is_dtgen_watch_running(d)
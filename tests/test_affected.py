@@ -0,0 +1,127 @@
+import proj.affected as affected
+from proj.affected import (
+    get_affected_targets,
+    get_dependent_targets,
+    load_compile_commands_targets,
+)
+import proj.cmake as cmake
+from proj.cmake import (
+    get_target_dependency_graph,
+    parse_graphviz_dependencies,
+)
+from proj.config_file import (
+    get_config,
+)
+from .project_utils import (
+    project_instance,
+)
+from pathlib import Path
+from typing import (
+    Dict,
+    FrozenSet,
+    List,
+)
+import json
+import tempfile
+import pytest
+
+CMAKE_GRAPHVIZ = '''digraph "test-project-1" {
+node [
+  fontsize = "12"
+];
+    "node0" [ label = "bin1", shape = egg ];
+    "node1" [ label = "lib1", shape = doubleoctagon ];
+    "node2" [ label = "lib2", shape = doubleoctagon ];
+    "node2" -> "node1" [ style = dotted ] // lib2 -> lib1
+    "node3" [ label = "lib1-tests", shape = egg ];
+    "node3" -> "node1" [ style = dotted ] // lib1-tests -> lib1
+    "node4" [ label = "lib2-tests", shape = egg ];
+    "node4" -> "node2" [ style = dotted ] // lib2-tests -> lib2
+}
+'''
+
+def test_parse_graphviz_dependencies() -> None:
+    assert parse_graphviz_dependencies(CMAKE_GRAPHVIZ) == {
+        'bin1': frozenset(),
+        'lib1': frozenset(),
+        'lib2': frozenset({'lib1'}),
+        'lib1-tests': frozenset({'lib1'}),
+        'lib2-tests': frozenset({'lib2'}),
+    }
+
+def test_get_dependent_targets() -> None:
+    graph = parse_graphviz_dependencies(CMAKE_GRAPHVIZ)
+
+    assert get_dependent_targets(graph, ['lib1']) == frozenset({'lib1', 'lib2', 'lib1-tests', 'lib2-tests'})
+    assert get_dependent_targets(graph, ['lib2']) == frozenset({'lib2', 'lib2-tests'})
+    assert get_dependent_targets(graph, []) == frozenset()
+
+def test_target_dependency_graph_is_cached(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: List[Path] = []
+
+    def fake_run_cmake_graphviz(build_dir: Path) -> str:
+        calls.append(build_dir)
+        (build_dir / 'CMakeCache.txt').write_text(f'reconfigured {len(calls)} times\n')
+        return CMAKE_GRAPHVIZ
+
+    monkeypatch.setattr(cmake, '_run_cmake_graphviz', fake_run_cmake_graphviz)
+
+    with tempfile.TemporaryDirectory() as d:
+        build_dir = Path(d)
+        (build_dir / 'CMakeCache.txt').write_text('configured\n')
+
+        assert get_target_dependency_graph(build_dir) == parse_graphviz_dependencies(CMAKE_GRAPHVIZ)
+        assert get_target_dependency_graph(build_dir) == parse_graphviz_dependencies(CMAKE_GRAPHVIZ)
+        assert len(calls) == 1
+
+        (build_dir / 'CMakeCache.txt').write_text('configured again\n')
+        get_target_dependency_graph(build_dir)
+        assert len(calls) == 2
+
+def test_load_compile_commands_targets() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        build_dir = Path(d) / 'build/normal'
+        compile_commands = Path(d) / 'compile_commands.json'
+        with compile_commands.open('w') as f:
+            json.dump([
+                {
+                    'directory': str(build_dir / 'lib/lib1'),
+                    'command': 'c++ -Iinclude -o CMakeFiles/lib1.dir/src/lib1/lib1.cc.o -c ../../../../lib/lib1/src/lib1/lib1.cc',
+                    'file': '../../../../lib/lib1/src/lib1/lib1.cc',
+                },
+                {
+                    'directory': str(build_dir / 'lib/lib1/test'),
+                    'arguments': ['c++', '-o', 'CMakeFiles/lib1-tests.dir/src/lib1/lib1.cc.o', '-c', str(Path(d) / 'lib/lib1/test/src/lib1/lib1.cc')],
+                    'file': str(Path(d) / 'lib/lib1/test/src/lib1/lib1.cc'),
+                },
+            ], f)
+
+        assert load_compile_commands_targets(compile_commands) == {
+            (Path(d) / 'lib/lib1/src/lib1/lib1.cc').resolve(): frozenset({'lib1'}),
+            (Path(d) / 'lib/lib1/test/src/lib1/lib1.cc').resolve(): frozenset({'lib1-tests'}),
+        }
+
+def test_get_affected_targets_uses_tested_build_dir(monkeypatch: pytest.MonkeyPatch) -> None:
+    with project_instance('simple') as d:
+        config = get_config(d)
+        build_dir = config.coverage_build_dir
+        changed = d / 'tools/bin1.cc'
+
+        def fake_get_target_dependency_graph(build_dir: Path) -> Dict[str, FrozenSet[str]]:
+            return parse_graphviz_dependencies(CMAKE_GRAPHVIZ)
+
+        monkeypatch.setattr(affected, 'get_changed_files', lambda root, since: frozenset({changed}))
+        monkeypatch.setattr(affected, 'get_target_dependency_graph', fake_get_target_dependency_graph)
+
+        build_dir.mkdir(parents=True)
+        with (build_dir / 'compile_commands.json').open('w') as f:
+            json.dump([
+                {
+                    'directory': str(build_dir / 'tools'),
+                    'arguments': ['c++', '-o', 'CMakeFiles/bin1.dir/bin1.cc.o', '-c', str(changed)],
+                    'file': str(changed),
+                },
+            ], f)
+
+        assert get_affected_targets(config, build_dir, 'HEAD') == frozenset({'bin1'})
+        assert get_affected_targets(config, config.debug_build_dir, 'HEAD') == frozenset()
@@ -0,0 +1,93 @@
+from proj.benchmarks import (
+    BenchmarkResult,
+    IndividualBenchmark,
+)
+from proj.benchmark_history import (
+    compare_benchmarks,
+    get_machine_key,
+    load_benchmarks_for_commit,
+    open_benchmark_history,
+    permutation_test_p_value,
+    record_benchmark_result,
+)
+from .test_benchmarks import COMPILER_BENCHMARK_JSON
+from pathlib import Path
+from typing import (
+    Sequence,
+)
+import dataclasses
+import json
+import tempfile
+
+def make_samples(name: str, times: Sequence[float], time_unit: str = 'ns') -> Sequence[IndividualBenchmark]:
+    return [
+        IndividualBenchmark(
+            name=name,
+            real_time=t,
+            cpu_time=t,
+            iterations=1000,
+            time_unit=time_unit,
+            rest={'run_type': 'iteration'},
+        )
+        for t in times
+    ]
+
+def test_benchmark_history_round_trip() -> None:
+    result = BenchmarkResult.from_json(json.loads(COMPILER_BENCHMARK_JSON))
+    machine = get_machine_key(result.context)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = Path(d) / 'history.sqlite'
+        with open_benchmark_history(path) as conn:
+            record_benchmark_result(conn, result, git_commit='abc', dirty=False)
+            record_benchmark_result(conn, result, git_commit='def', dirty=True)
+
+        with open_benchmark_history(path) as conn:
+            assert load_benchmarks_for_commit(conn, 'abc', machine) == list(result.benchmarks)
+            assert load_benchmarks_for_commit(conn, 'def', machine) == []
+            assert load_benchmarks_for_commit(conn, 'abc', 'other-machine') == []
+
+def test_machine_key_depends_on_host() -> None:
+    result = BenchmarkResult.from_json(json.loads(COMPILER_BENCHMARK_JSON))
+    other_host = dataclasses.replace(
+        result.context,
+        rest={**result.context.rest, 'host_name': 'other-host'},
+    )
+    assert get_machine_key(result.context) != get_machine_key(other_host)
+
+def test_permutation_test_p_value() -> None:
+    assert permutation_test_p_value([1.0], [2.0], alpha=0.05) is None
+
+    p_slower = permutation_test_p_value([10.0, 11.0, 10.5, 10.2], [20.0, 21.0, 20.5, 20.2], alpha=0.05)
+    assert p_slower is not None
+    assert p_slower < 0.05
+
+    p_faster = permutation_test_p_value([20.0, 21.0, 20.5, 20.2], [10.0, 11.0, 10.5, 10.2], alpha=0.05)
+    assert p_faster is not None
+    assert p_faster > 0.05
+
+def test_compare_benchmarks_flags_significant_regressions() -> None:
+    baseline = [
+        *make_samples('fast', [10.0, 11.0, 10.5, 10.2]),
+        *make_samples('noisy', [10.0, 30.0, 10.0, 30.0]),
+        *make_samples('unit', [1.0, 1.1, 1.05, 1.02], time_unit='us'),
+    ]
+    current = [
+        *make_samples('fast', [20.0, 21.0, 20.5, 20.2]),
+        *make_samples('noisy', [30.0, 10.0, 30.0, 12.0]),
+        *make_samples('unit', [1000.0, 1100.0, 1050.0, 1020.0], time_unit='ns'),
+        *make_samples('new', [1.0]),
+    ]
+
+    comparisons = {c.name: c for c in compare_benchmarks(baseline, current, alpha=0.05)}
+    assert set(comparisons.keys()) == {'fast', 'noisy', 'unit'}
+    assert comparisons['fast'].is_regression(threshold=0.05, alpha=0.05)
+    assert not comparisons['noisy'].is_regression(threshold=0.05, alpha=0.05)
+    assert not comparisons['unit'].is_regression(threshold=0.05, alpha=0.05)
+    assert abs(comparisons['unit'].change) < 1e-9
+
+def test_single_samples_are_inconclusive() -> None:
+    comparisons = compare_benchmarks(make_samples('a', [10.0]), make_samples('a', [20.0]), alpha=0.05)
+    assert [c.p_value for c in comparisons] == [None]
+    assert not comparisons[0].is_regression(threshold=0.05, alpha=0.05)
+    assert comparisons[0].is_inconclusive(threshold=0.05)
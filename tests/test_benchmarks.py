@@ -2,8 +2,23 @@ from proj.benchmarks import (
     render_table,
     BenchmarkResult,
     pretty_print_benchmark,
+    parse_cpu_list,
+    split_cores,
+    record_cpu_affinity,
+    merge_benchmark_results,
+    CPU_AFFINITY_KEY,
+    IndividualBenchmark,
+    BenchmarkStatistics,
+    summarize_benchmarks,
+    BenchmarkOutputParser,
 )
+from proj.json import Json
+from typing import (
+    List,
+)
+import dataclasses
 import json
+import math
 import io
 
 COMPILER_BENCHMARK_JSON = '''{
@@ -180,3 +195,142 @@ def test_pretty_print_benchmark() -> None:
     )
 
     assert result == correct
+
+def test_parse_cpu_list() -> None:
+    assert parse_cpu_list('2-5,8,10-11\n') == frozenset({2, 3, 4, 5, 8, 10, 11})
+    assert parse_cpu_list('\n') == frozenset()
+
+def test_split_cores() -> None:
+    assert split_cores([0, 1, 2, 3, 4], 2) == ((0, 1), (2, 3))
+    assert split_cores([0, 1, 2], 1) == ((0,), (1,), (2,))
+    assert split_cores([0], 2) == ()
+
+def test_merge_benchmark_results_keeps_cpu_affinity() -> None:
+    result = BenchmarkResult.from_json(json.loads(COMPILER_BENCHMARK_JSON))
+    first, second = result.benchmarks[:2]
+    # cases of the same binary run separately on different cores
+    a = record_cpu_affinity(dataclasses.replace(result, benchmarks=(first,)), [0, 1])
+    b = record_cpu_affinity(dataclasses.replace(result, benchmarks=(second,)), [2, 3])
+
+    merged = merge_benchmark_results([a, b])
+    assert merged.context.rest[CPU_AFFINITY_KEY] == {
+        first.run_name: [0, 1],
+        second.run_name: [2, 3],
+    }
+
+def make_repetition(name: str, real_time: float, index: int, repetitions: int) -> Json:
+    return {
+        'name': name,
+        'run_name': name,
+        'run_type': 'iteration',
+        'repetitions': repetitions,
+        'repetition_index': index,
+        'iterations': 10,
+        'real_time': real_time,
+        'cpu_time': real_time,
+        'time_unit': 'ns',
+    }
+
+def make_aggregate(name: str, aggregate_name: str, real_time: float, repetitions: int) -> Json:
+    return {
+        'name': f'{name}_{aggregate_name}',
+        'run_name': name,
+        'run_type': 'aggregate',
+        'repetitions': repetitions,
+        'aggregate_name': aggregate_name,
+        'iterations': repetitions,
+        'real_time': real_time,
+        'cpu_time': real_time,
+        'time_unit': 'ns',
+    }
+
+def test_summarize_benchmarks_from_repetitions() -> None:
+    benchmarks = [
+        IndividualBenchmark.from_json(j)
+        for j in [
+            make_repetition('a', 10.0, 0, 3),
+            make_repetition('a', 12.0, 1, 3),
+            make_repetition('a', 14.0, 2, 3),
+            make_aggregate('a', 'mean', 12.0, 3),
+            make_aggregate('a', 'median', 12.0, 3),
+            make_aggregate('a', 'stddev', 2.0, 3),
+        ]
+    ]
+
+    (summary,) = summarize_benchmarks(benchmarks)
+    assert summary.name == 'a'
+    assert summary.repetitions == 3
+    assert summary.mean == 12.0
+    assert summary.median == 12.0
+    assert summary.stddev == 2.0
+
+    ci = summary.confidence_interval
+    assert ci is not None
+    half_width = 4.303 * 2.0 / math.sqrt(3)
+    assert abs(ci[0] - (12.0 - half_width)) < 1e-9
+    assert abs(ci[1] - (12.0 + half_width)) < 1e-9
+    assert summary.is_precise(0.5)
+    assert not summary.is_precise(0.1)
+
+def test_summarize_benchmarks_from_aggregates_only() -> None:
+    benchmarks = [
+        IndividualBenchmark.from_json(j)
+        for j in [
+            make_aggregate('b', 'mean', 20.0, 5),
+            make_aggregate('b', 'median', 19.0, 5),
+            make_aggregate('b', 'stddev', 1.0, 5),
+            make_aggregate('b', 'cv', 0.05, 5),
+        ]
+    ]
+
+    assert summarize_benchmarks(benchmarks) == [
+        BenchmarkStatistics(
+            name='b',
+            time_unit='ns',
+            repetitions=5,
+            mean=20.0,
+            median=19.0,
+            stddev=1.0,
+        ),
+    ]
+
+def test_summarize_benchmarks_single_run_has_no_ci() -> None:
+    benchmarks = BenchmarkResult.from_json(json.loads(COMPILER_BENCHMARK_JSON)).benchmarks
+    summary = summarize_benchmarks(benchmarks)
+    assert len(summary) == len(benchmarks)
+    assert all(s.repetitions == 1 for s in summary)
+    assert all(s.confidence_interval is None for s in summary)
+
+def test_benchmark_output_parser_streams_benchmarks() -> None:
+    correct = BenchmarkResult.from_json(json.loads(COMPILER_BENCHMARK_JSON))
+
+    for chunk_size in [1, 7, 64, len(COMPILER_BENCHMARK_JSON)]:
+        seen: List[str] = []
+        parser = BenchmarkOutputParser(lambda b: seen.append(b.name))
+        for i in range(0, len(COMPILER_BENCHMARK_JSON), chunk_size):
+            parser.feed(COMPILER_BENCHMARK_JSON[i : i + chunk_size])
+        result = parser.finish()
+
+        assert result == correct
+        assert seen == [b.name for b in correct.benchmarks]
+
+def test_benchmark_output_parser_does_not_depend_on_layout() -> None:
+    correct = BenchmarkResult.from_json(json.loads(COMPILER_BENCHMARK_JSON))
+
+    for layout in [{'separators': (',', ':')}, {'indent': 1}, {'indent': '\t'}]:
+        output = json.dumps(json.loads(COMPILER_BENCHMARK_JSON), **layout) # type: ignore[arg-type]
+        for chunk_size in [1, 13, len(output)]:
+            seen: List[str] = []
+            parser = BenchmarkOutputParser(lambda b: seen.append(b.name))
+            for i in range(0, len(output), chunk_size):
+                parser.feed(output[i : i + chunk_size])
+            assert parser.finish() == correct
+            assert seen == [b.name for b in correct.benchmarks]
+
+def test_benchmark_output_parser_reports_benchmarks_before_finish() -> None:
+    seen: List[str] = []
+    parser = BenchmarkOutputParser(lambda b: seen.append(b.name))
+
+    (before_second, _) = COMPILER_BENCHMARK_JSON.split('    {\n      "name": "benchmark_get_computation_graph_series_parallel_decomposition/transformer"')
+    parser.feed(before_second)
+    assert seen == ['benchmark_get_computation_graph_series_parallel_decomposition/split_test']
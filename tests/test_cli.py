@@ -1,5 +1,77 @@
-from proj.__main__ import make_parser
+from proj.__main__ import (
+    main,
+    make_parser,
+)
+from proj.config_file import get_path_info
+from .project_utils import project_instance
+from pathlib import Path
+from typing import (
+    List,
+)
+import io
+import json
+import os
+import proj
+import subprocess
+import sys
+import time
+import pytest
+
+def run_proj(args: List[str], cwd: Path) -> subprocess.CompletedProcess[str]:
+    env = {**os.environ, 'PYTHONPATH': str(Path(proj.__file__).parent.parent)}
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, text=True, check=True)
 
 def test_cli() -> None:
     p = make_parser()
     p.print_help()
+
+def test_root_does_not_import_subsystems() -> None:
+    with project_instance('simple') as d:
+        result = run_proj(['-c', (
+            'import sys\n'
+            'from proj.__main__ import main\n'
+            'main(["root"])\n'
+            'print(" ".join(sorted(sys.modules)))\n'
+        )], cwd=d)
+        root, modules = result.stdout.splitlines()
+        assert Path(root) == d.resolve()
+        for module in ['proj.dtgen', 'proj.build', 'proj.testing', 'proj.benchmarks', 'asyncio', 'multiprocessing']:
+            assert module not in modules.split()
+
+def test_query_path_batch(monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]) -> None:
+    with project_instance('dtgen') as d:
+        monkeypatch.chdir(d)
+        files = ['lib/person/include/person/color.dtg.hh', 'lib/person/src/person/color.dtg.cc']
+        monkeypatch.setattr('sys.stdin', io.StringIO('\n'.join(files) + '\n'))
+
+        assert main(['query-path', '--batch']) == 0
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(l) for l in lines] == [get_path_info(Path(f)).json() for f in files]
+
+        (d / 'files.txt').write_text('\n'.join([files[0], 'README.md', 'lib/person/CMakeLists.txt', files[1]]))
+        assert main(['query-path', '--batch', 'files.txt']) == 1
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[1:3] == ['null', 'null']
+        assert json.loads(lines[3]) == get_path_info(Path(files[1])).json()
+
+# `proj root` is run by editor integrations on every save, so the time it adds
+# on top of starting python and importing proj is bounded. the budget is
+# generous, as it is only meant to catch large regressions (e.g. eagerly
+# importing every subcommand), not machine-to-machine noise
+ROOT_STARTUP_OVERHEAD_BUDGET_SECONDS = 0.5
+
+def best_run_time(args: List[str], cwd: Path, repeats: int = 5) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run_proj(args, cwd=cwd)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+@pytest.mark.slow
+def test_root_startup_latency() -> None:
+    with project_instance('simple') as d:
+        baseline = best_run_time(['-c', 'import proj'], cwd=d)
+        # the same entrypoint that bin/proj and the installed script use
+        root = best_run_time(['-m', 'proj.client', 'root'], cwd=d)
+        assert root - baseline < ROOT_STARTUP_OVERHEAD_BUDGET_SECONDS
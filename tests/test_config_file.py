@@ -1,8 +1,17 @@
 import pytest
+import proj.config_file as config_file
 from proj.config_file import (
+    get_config_snapshot_path,
+    load_config,
     load_parsed_config,
+    get_path_info,
+    get_path_infos,
     ConfigKey,
     ProjectConfig,
+    ProjectContext,
+)
+from .project_utils import (
+    project_instance,
 )
 from typing import (
     Dict,
@@ -28,6 +37,7 @@ def get_example_config() -> Dict[str, Any]:
         ConfigKey.FIX_COMPILE_COMMANDS: False,
         ConfigKey.TEST_HEADER_PATH: '/example/test/header/path.h',
         ConfigKey.CUDA_LAUNCH_CMD: ['a', 'b'],
+        ConfigKey.DTGEN_BUILTIN_LAYOUT: True,
     }
 
 CONFIG_ROOT = Path('/config/root')
@@ -48,6 +58,7 @@ LOADED_CONFIG = ProjectConfig(
     _fix_compile_commands=False,
     _test_header_path=Path('/example/test/header/path.h'),
     _cuda_launch_cmd=('a', 'b'),
+    _dtgen_builtin_layout=True,
 )
 
 def test_load_parsed_config_loads_complete_value() -> None:
@@ -90,3 +101,74 @@ def test_load_parsed_config_fails_to_load_when_missing_required_field() -> None:
             config_root=CONFIG_ROOT,
             raw=raw,
         )
+
+def test_project_context_parses_config_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    with project_instance('dtgen') as d:
+        files = [
+            d / 'lib/person/include/person/color.dtg.hh',
+            d / 'lib/person/src/person/color.dtg.cc',
+            d / 'lib/person/include/person/person.dtg.hh',
+        ]
+        uncached = [get_path_info(f) for f in files]
+
+        loaded = []
+        load_config = config_file.load_config
+        def counting_load_config(d: Path) -> ProjectConfig:
+            loaded.append(d)
+            return load_config(d)
+        monkeypatch.setattr(config_file, 'load_config', counting_load_config)
+
+        ctx = ProjectContext()
+        assert [get_path_info(f, ctx) for f in files] == uncached
+        assert loaded == [d.resolve()]
+
+def test_get_path_infos() -> None:
+    with project_instance('dtgen') as d:
+        files = [
+            d / 'lib/person/include/person/color.dtg.hh',
+            d / 'README.md',
+            d / 'lib/person/src/person/color.dtg.cc',
+        ]
+        assert list(get_path_infos(files)) == [get_path_info(files[0]), None, get_path_info(files[2])]
+
+def test_get_path_info_rejects_paths_outside_sublibs() -> None:
+    # raised explicitly rather than through asserts, which python -O removes
+    with project_instance('dtgen') as d:
+        for p in [d / 'README.md', d / 'lib/person/CMakeLists.txt']:
+            with pytest.raises(ValueError):
+                get_path_info(p)
+
+def test_config_snapshot_is_reused_until_config_changes(monkeypatch: pytest.MonkeyPatch) -> None:
+    with project_instance('dtgen') as d:
+        assert load_config(d).project_name == 'person'
+        # nothing is written before the project has a build directory
+        assert not get_config_snapshot_path(d).exists()
+
+        (d / 'build').mkdir()
+        expected = load_config(d)
+        assert get_config_snapshot_path(d).exists()
+
+        parsed = []
+        def counting_load_parsed_config(config_root: Path, raw: object) -> ProjectConfig:
+            parsed.append(config_root)
+            return load_parsed_config(config_root, raw)
+        monkeypatch.setattr(config_file, 'load_parsed_config', counting_load_parsed_config)
+
+        loaded = load_config(d)
+        assert loaded == expected
+        assert loaded.all_build_targets == expected.all_build_targets
+        assert parsed == []
+
+        config_path = d / '.proj.toml'
+        config_path.write_text(config_path.read_text().replace('project_name = "person"', 'project_name = "people"'))
+        assert load_config(d).project_name == 'people'
+        assert parsed == [d.resolve()]
+
+        get_config_snapshot_path(d).write_bytes(b'garbage')
+        assert load_config(d).project_name == 'people'
+
+def test_derived_targets_are_computed_once() -> None:
+    config = dataclasses.replace(LOADED_CONFIG)
+    assert config.lib_targets is config.lib_targets
+    assert config.configured_names is config.configured_names
+    assert config.all_build_targets is config.all_build_targets
@@ -0,0 +1,28 @@
+from proj.format import (
+    chunk_files,
+)
+from os import PathLike
+from pathlib import Path
+from typing import (
+    List,
+)
+
+def test_chunk_files_respects_max_command_length() -> None:
+    files: List[PathLike[str]] = [Path(f'file{i:02}.cc') for i in range(10)]
+    command = ['ff-clang-format', '-i']
+
+    # each file name costs 9 bytes + null + pointer = 18, the command 35
+    chunks = chunk_files(command, files, max_command_length=35 + 3 * 18)
+    assert chunks == [files[0:3], files[3:6], files[6:9], files[9:10]]
+
+def test_chunk_files_splits_for_parallelism() -> None:
+    files: List[PathLike[str]] = [Path(f'file{i:02}.cc') for i in range(10)]
+
+    chunks = chunk_files(['ff-clang-format'], files, max_command_length=1 << 20, num_chunks=3)
+    assert chunks == [files[0:4], files[4:8], files[8:10]]
+
+    assert chunk_files(['ff-clang-format'], files, max_command_length=1 << 20) == [files]
+
+def test_chunk_files_always_makes_progress() -> None:
+    files: List[PathLike[str]] = [Path('a_very_long_file_name.cc')]
+    assert chunk_files(['ff-clang-format'], files, max_command_length=1) == [files]
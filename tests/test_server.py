@@ -0,0 +1,93 @@
+from .project_utils import project_instance
+from proj.client import (
+    get_server_socket_path,
+    is_server_running,
+    query_server,
+    try_main_using_server,
+)
+from proj.config_file import (
+    dump_config,
+    get_config,
+    get_path_info,
+)
+from proj.server import (
+    ProjectServer,
+    make_project_server,
+)
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Iterator,
+)
+import json
+import socket
+import threading
+import pytest
+
+@contextmanager
+def running_server(d: Path) -> Iterator[ProjectServer]:
+    with make_project_server(get_config(d)) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            yield server
+        finally:
+            server.shutdown()
+            thread.join()
+
+def test_query_server(monkeypatch: pytest.MonkeyPatch) -> None:
+    with project_instance('dtgen') as d:
+        monkeypatch.chdir(d)
+        header = d / 'lib/person/include/person/color.dtg.hh'
+
+        assert query_server('root', str(d)) is None
+
+        with running_server(d):
+            assert is_server_running(str(d))
+            assert query_server('root', str(d / 'lib')) == str(d)
+            assert query_server('config', str(d)) == dump_config(get_config(d))
+            assert query_server('query-path', 'lib/person/include/person/color.dtg.hh') == get_path_info(header).json()
+
+            # errors are left to the caller to report
+            assert query_server('query-path', str(d / 'README.md')) is None
+            assert query_server('unknown', str(d)) is None
+
+        assert not is_server_running(str(d))
+        assert not Path(get_server_socket_path(str(d))).exists()
+
+def test_server_reloads_changed_config() -> None:
+    with project_instance('dtgen') as d:
+        with running_server(d):
+            config_path = d / '.proj.toml'
+            config_path.write_text(config_path.read_text().replace('project_name = "person"', 'project_name = "people"'))
+
+            result = query_server('config', str(d))
+            assert isinstance(result, dict)
+            assert result['namespace_name'] == 'people'
+
+def test_server_answers_several_requests_per_connection() -> None:
+    with project_instance('dtgen') as d:
+        with running_server(d):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(get_server_socket_path(str(d)))
+                f = s.makefile('rwb')
+                f.write(b'{"command": "root", "path": "' + str(d).encode() + b'"}\n')
+                f.write(b'not json\n')
+                f.flush()
+                assert json.loads(f.readline()) == {'result': str(d)}
+                assert 'error' in json.loads(f.readline())
+
+def test_try_main_using_server(monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]) -> None:
+    with project_instance('dtgen') as d:
+        monkeypatch.chdir(d)
+        assert not try_main_using_server(['root'])
+
+        with running_server(d):
+            assert try_main_using_server(['root'])
+            assert capsys.readouterr().out == f'{d}\n'
+
+            assert try_main_using_server(['config'])
+            assert json.loads(capsys.readouterr().out) == dump_config(get_config(d))
+
+            assert not try_main_using_server(['root', '-v'])
+            assert not try_main_using_server(['build'])
@@ -2,8 +2,27 @@ from proj.subprocess_trace import (
     tee_output_bytes, 
     tee_output_str,
     CalledProcessError,
+    hook_stdout,
+    run_async,
+    check_call_async,
+    check_output_async,
+    hook_stdout_async,
+    ProcessLimiter,
+    PIPE,
+    check_call,
+    check_output,
+    start_tracing,
+    stop_tracing,
+    write_chrome_trace,
 )
+from pathlib import Path
+from typing import (
+    List,
+)
+import asyncio
 import io
+import json
+import tempfile
 
 def test_tee_output_to_stdout() -> None:
     stdout = io.StringIO()
@@ -88,3 +107,141 @@ def test_tee_output_real_stderr_stdout_command_fails_text_mode() -> None:
         stderr_val = e.stderr
         assert stdout_val == 'okay world\n'
         assert stderr_val == 'error world\n'
+
+def test_tee_output_does_not_stall_on_full_pipes() -> None:
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    # write more than a pipe buffer to stderr before writing anything to stdout
+    script = 'head -c 1000000 /dev/zero | tr "\\0" e 1>&2 && head -c 1000000 /dev/zero | tr "\\0" o'
+    (stdout_val, stderr_val) = tee_output_bytes(script, stdout=stdout, stderr=stderr, shell=True)
+
+    assert stdout_val == b'o' * 1000000
+    assert stderr_val == b'e' * 1000000
+    assert stdout.getvalue() == stdout_val
+    assert stderr.getvalue() == stderr_val
+
+def test_hook_stdout_calls_hook_per_line() -> None:
+    lines: List[str] = []
+    output = hook_stdout('printf "a\\nbb\\nccc"', stdout_hook=lines.append, shell=True)
+
+    assert lines == ['a\n', 'bb\n', 'ccc']
+    assert output == 'a\nbb\nccc'
+
+def test_hook_stdout_without_capture() -> None:
+    lines: List[str] = []
+    output = hook_stdout(['echo', 'hello'], stdout_hook=lines.append, capture_output=False)
+
+    assert lines == ['hello\n']
+    assert output == ''
+
+def test_hook_stdout_command_fails() -> None:
+    try:
+        hook_stdout('echo hello && false', stdout_hook=lambda _: None, shell=True)
+        assert False
+    except CalledProcessError as e:
+        assert e.returncode == 1
+
+def test_check_output_async() -> None:
+    assert asyncio.run(check_output_async(['echo', 'hello'], text=True)) == 'hello\n'
+    assert asyncio.run(check_output_async('echo hello', shell=True)) == b'hello\n'
+
+def test_check_output_async_command_fails() -> None:
+    try:
+        asyncio.run(check_output_async(['false']))
+        assert False
+    except CalledProcessError as e:
+        assert e.returncode == 1
+
+def test_run_async_captures_both_pipes() -> None:
+    result = asyncio.run(run_async(
+        'echo "error world" 1>&2 && echo "okay world"',
+        stdout=PIPE,
+        stderr=PIPE,
+        text=True,
+        shell=True,
+    ))
+    assert result.returncode == 0
+    assert result.stdout == 'okay world\n'
+    assert result.stderr == 'error world\n'
+
+def test_hook_stdout_async_calls_hook_per_line() -> None:
+    lines: List[str] = []
+    output = asyncio.run(hook_stdout_async('printf "a\\nbb\\nccc"', stdout_hook=lines.append, shell=True))
+
+    assert lines == ['a\n', 'bb\n', 'ccc']
+    assert output == 'a\nbb\nccc'
+
+def test_process_limiter_bounds_concurrency() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        log = Path(d) / 'log'
+        limiter = ProcessLimiter(2)
+
+        async def run_all() -> None:
+            await asyncio.gather(*[
+                check_call_async(
+                    f'echo start >> {log} && sleep 0.1 && echo end >> {log}',
+                    shell=True,
+                    limiter=limiter,
+                )
+                for _ in range(4)
+            ])
+
+        asyncio.run(run_all())
+
+        running = 0
+        max_running = 0
+        for line in log.read_text().splitlines():
+            running += 1 if line == 'start' else -1
+            max_running = max(max_running, running)
+        assert max_running == 2
+
+def test_tracing_records_process_spans() -> None:
+    start_tracing()
+    try:
+        check_call(['true'])
+        assert check_output(['echo', 'hello'], text=True) == 'hello\n'
+        try:
+            check_call(['sh', '-c', 'exit 3'])
+            assert False
+        except CalledProcessError as e:
+            assert e.returncode == 3
+        asyncio.run(check_call_async(['true']))
+    finally:
+        spans = stop_tracing()
+
+    assert [(s.command, s.returncode) for s in spans] == [
+        ('true', 0),
+        ('echo hello', 0),
+        ("sh -c 'exit 3'", 3),
+        ('true', 0),
+    ]
+    for span in spans[:3]:
+        assert span.wall_time >= 0
+        assert span.user_cpu is not None
+        assert span.sys_cpu is not None
+        assert span.max_rss_kb is not None and span.max_rss_kb > 0
+    assert spans[3].max_rss_kb is None
+
+def test_tracing_is_off_by_default() -> None:
+    check_call(['true'])
+    assert stop_tracing() == []
+
+def test_write_chrome_trace() -> None:
+    start_tracing()
+    try:
+        check_call(['true'], cwd='/')
+    finally:
+        spans = stop_tracing()
+
+    with tempfile.TemporaryDirectory() as d:
+        path = Path(d) / 'trace.json'
+        write_chrome_trace(spans, path)
+        trace = json.loads(path.read_text())
+
+    (event,) = trace['traceEvents']
+    assert event['name'] == 'true'
+    assert event['ph'] == 'X'
+    assert event['tid'] == spans[0].pid
+    assert event['dur'] >= 0
+    assert event['args']['cwd'] == '/'
+    assert event['args']['returncode'] == 0
@@ -0,0 +1,67 @@
+import proj.test_listing as test_listing
+from proj.test_listing import (
+    list_test_cases_in_binary,
+    parse_doctest_xml_listing,
+)
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    Tuple,
+)
+import os
+import tempfile
+import pytest
+
+DOCTEST_XML_LISTING = b'''<?xml version="1.0" encoding="UTF-8"?>
+<doctest binary="lib/lib1/test/lib1-tests">
+  <Options order_by="file" rand_seed="0" first="0" last="4294967295" abort_after="0" subcase_filter_levels="2147483647" case_sensitive="false" no_throw="false" no_skip="false"/>
+  <TestCase name="call_lib1" testsuite="cpu-lib1-tests" filename="lib1.cc" line="5" skipped="false"/>
+  <TestCase name="other_lib1" testsuite="cpu-lib1-tests" filename="lib1.cc" line="9" skipped="false"/>
+  <TestCase name="gpu_lib1" testsuite="cuda-lib1-tests" filename="lib1.cc" line="13" skipped="false"/>
+  <OverallResultsTestCases unskipped="3"/>
+</doctest>
+'''
+
+def test_parse_doctest_xml_listing() -> None:
+    assert parse_doctest_xml_listing(DOCTEST_XML_LISTING) == {
+        'cpu-lib1-tests': ('call_lib1', 'other_lib1'),
+        'cuda-lib1-tests': ('gpu_lib1',),
+    }
+
+def test_parse_doctest_xml_listing_without_suite() -> None:
+    xml = DOCTEST_XML_LISTING.replace(b'<OverallResultsTestCases', b'<TestCase name="x"/>\n  <OverallResultsTestCases')
+    assert parse_doctest_xml_listing(xml) == {
+        'cpu-lib1-tests': ('call_lib1', 'other_lib1'),
+        'cuda-lib1-tests': ('gpu_lib1',),
+        '': ('x',),
+    }
+
+def test_list_test_cases_in_binary_is_cached(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: List[Path] = []
+
+    def fake_run_list_test_cases(executable: Path, build_dir: Path) -> Dict[str, Tuple[str, ...]]:
+        calls.append(executable)
+        return parse_doctest_xml_listing(DOCTEST_XML_LISTING)
+
+    monkeypatch.setattr(test_listing, '_run_list_test_cases', fake_run_list_test_cases)
+
+    with tempfile.TemporaryDirectory() as d:
+        build_dir = Path(d)
+        executable = Path('lib/lib1/test/lib1-tests')
+        (build_dir / executable).parent.mkdir(parents=True)
+        (build_dir / executable).write_bytes(b'v1')
+
+        first = list_test_cases_in_binary(executable, build_dir)
+        second = list_test_cases_in_binary(executable, build_dir)
+        assert first == second
+        assert len(calls) == 1
+
+        (build_dir / executable).write_bytes(b'v2, but longer')
+        list_test_cases_in_binary(executable, build_dir)
+        assert len(calls) == 2
+
+        stat = (build_dir / executable).stat()
+        os.utime(build_dir / executable, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        list_test_cases_in_binary(executable, build_dir)
+        assert len(calls) == 3
@@ -0,0 +1,58 @@
+from proj.test_result_cache import (
+    parse_ldd_output,
+    load_test_result_cache,
+    lookup_cached_passes,
+    update_test_result_cache,
+    CachedTestCaseResult,
+)
+from proj.targets import (
+    LibTarget,
+)
+from pathlib import Path
+import tempfile
+
+LDD_OUTPUT = '''	linux-vdso.so.1 (0x00007ffd0a9f2000)
+	liblib2.so => /proj/build/normal/lib/lib2/liblib2.so (0x00007f0f4c000000)
+	liblib1.so => /proj/build/normal/lib/lib1/liblib1.so (0x00007f0f4bc00000)
+	libstdc++.so.6 => /usr/lib/libstdc++.so.6 (0x00007f0f4b800000)
+	libmissing.so => not found
+	/lib64/ld-linux-x86-64.so.2 (0x00007f0f4c3a4000)
+'''
+
+def test_parse_ldd_output() -> None:
+    assert parse_ldd_output(LDD_OUTPUT) == (
+        Path('/proj/build/normal/lib/lib2/liblib2.so'),
+        Path('/proj/build/normal/lib/lib1/liblib1.so'),
+        Path('/usr/lib/libstdc++.so.6'),
+    )
+
+def test_test_result_cache_only_replays_passes_with_same_hash() -> None:
+    suite = LibTarget('lib1').cpu_test_target
+    a = suite.get_test_case('a')
+    b = suite.get_test_case('b')
+    c = suite.get_test_case('c')
+
+    with tempfile.TemporaryDirectory() as d:
+        build_dir = Path(d)
+
+        update_test_result_cache(
+            build_dir,
+            binary_hashes={a: 'h1', b: 'h1', c: 'h1'},
+            results={a: (True, 1.0), b: (False, 2.0), c: (True, 3.0)},
+        )
+        cache = load_test_result_cache(build_dir)
+
+        assert lookup_cached_passes(cache, {a: 'h1', b: 'h1', c: 'h2'}) == {
+            a: CachedTestCaseResult(binary_hash='h1', duration=1.0),
+        }
+
+        update_test_result_cache(
+            build_dir,
+            binary_hashes={a: 'h1'},
+            results={a: (False, 1.0)},
+        )
+        cache = load_test_result_cache(build_dir)
+
+        assert lookup_cached_passes(cache, {a: 'h1', b: 'h1', c: 'h1'}) == {
+            c: CachedTestCaseResult(binary_hash='h1', duration=3.0),
+        }
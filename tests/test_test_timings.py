@@ -0,0 +1,56 @@
+from proj.test_timings import (
+    get_test_timing_key,
+    load_test_timings,
+    update_test_timings,
+    schedule_longest_first,
+    shard_test_cases,
+)
+from proj.targets import (
+    LibTarget,
+)
+from pathlib import Path
+import tempfile
+
+SUITE = LibTarget('lib1').cpu_test_target
+
+def test_update_and_load_test_timings() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        build_dir = Path(d)
+        assert load_test_timings(build_dir) == {}
+
+        update_test_timings(build_dir, [(SUITE.get_test_case('a'), 1.5)])
+        update_test_timings(build_dir, [(SUITE.get_test_case('b'), 0.5)])
+
+        assert load_test_timings(build_dir) == {
+            get_test_timing_key(SUITE.get_test_case('a')): 1.5,
+            get_test_timing_key(SUITE.get_test_case('b')): 0.5,
+        }
+
+def test_schedule_longest_first() -> None:
+    a = SUITE.get_test_case('a')
+    b = SUITE.get_test_case('b')
+    c = SUITE.get_test_case('c')
+    unknown = SUITE.get_test_case('unknown')
+
+    timings = {
+        get_test_timing_key(a): 1.0,
+        get_test_timing_key(b): 3.0,
+        get_test_timing_key(c): 2.0,
+    }
+
+    assert schedule_longest_first([a, b, unknown, c], timings) == (unknown, b, c, a)
+
+def test_shard_test_cases() -> None:
+    cases = [SUITE.get_test_case(str(i)) for i in range(5)]
+    timings = {
+        get_test_timing_key(cases[0]): 4.0,
+        get_test_timing_key(cases[1]): 3.0,
+        get_test_timing_key(cases[2]): 2.0,
+        get_test_timing_key(cases[3]): 2.0,
+        get_test_timing_key(cases[4]): 1.0,
+    }
+
+    shards = shard_test_cases(cases, timings, 2)
+
+    assert sorted(sum(shards, tuple())) == sorted(cases)
+    assert [sum(timings[get_test_timing_key(t)] for t in shard) for shard in shards] == [6.0, 6.0]
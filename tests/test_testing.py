@@ -0,0 +1,141 @@
+import proj.testing as testing
+from proj.testing import (
+    run_test_cases,
+)
+from proj.targets import (
+    CudaRunTarget,
+    LibTarget,
+    CpuTestCaseTarget,
+    CudaTestCaseTarget,
+)
+from pathlib import Path
+from typing import (
+    Any,
+    List,
+    Union,
+)
+import threading
+import time
+import pytest
+
+def test_run_test_cases_preserves_order(monkeypatch: pytest.MonkeyPatch) -> None:
+    test_cases = [
+        LibTarget('lib1').cpu_test_target.get_test_case(f'case{i}')
+        for i in range(8)
+    ]
+
+    def fake_run_test_case(test_case: CpuTestCaseTarget, **kwargs: Any) -> testing.TestCaseResult:
+        idx = int(test_case.test_case_name[len('case'):])
+        time.sleep(0.01 * (8 - idx))
+        return testing.TestCaseResult(
+            did_pass=(idx % 2 == 0),
+            stderr=b'',
+            stdout=test_case.test_case_name.encode(),
+            duration=0.0,
+        )
+
+    monkeypatch.setattr(testing, 'run_test_case', fake_run_test_case)
+
+    completed: List[Union[CpuTestCaseTarget, CudaTestCaseTarget]] = []
+    results = run_test_cases(
+        config=None, # type: ignore
+        test_cases=test_cases,
+        build_dir=Path('/build'),
+        jobs=8,
+        cuda_jobs=1,
+        on_complete=completed.append,
+    )
+
+    assert [r.stdout for r in results] == [t.test_case_name.encode() for t in test_cases]
+    assert [r.did_pass for r in results] == [i % 2 == 0 for i in range(8)]
+    assert set(completed) == set(test_cases)
+
+def test_run_test_cases_limits_cuda_concurrency(monkeypatch: pytest.MonkeyPatch) -> None:
+    test_cases = [
+        LibTarget('lib1').cuda_test_target.get_test_case(f'case{i}')
+        for i in range(4)
+    ]
+
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def fake_run_test_case(test_case: CudaTestCaseTarget, **kwargs: Any) -> testing.TestCaseResult:
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+        return testing.TestCaseResult(did_pass=True, stderr=b'', stdout=b'', duration=0.0)
+
+    monkeypatch.setattr(testing, 'run_test_case', fake_run_test_case)
+
+    run_test_cases(
+        config=None, # type: ignore
+        test_cases=test_cases,
+        build_dir=Path('/build'),
+        jobs=4,
+        cuda_jobs=1,
+        on_complete=lambda _: None,
+    )
+
+    assert max_running == 1
+
+DOCTEST_XML_REPORT = b'''<?xml version="1.0" encoding="UTF-8"?>
+<doctest binary="./lib1-tests">
+  <Options order_by="file" rand_seed="0" first="0" last="4294967295" abort_after="0" subcase_filter_levels="2147483647" case_sensitive="true" no_throw="false" no_skip="false"/>
+  <TestSuite name="cpu-lib1-tests">
+    <TestCase name="passes" filename="lib1.cc" line="5">
+      <OverallResultsAsserts successes="1" failures="0" test_case_success="true" duration="0.25"/>
+    </TestCase>
+    <TestCase name="fails, with comma" filename="lib1.cc" line="9">
+      <Expression success="false" type="CHECK" filename="lib1.cc" line="10">
+        <Original>
+          x == 1
+        </Original>
+      </Expression>
+      <OverallResultsAsserts successes="0" failures="1" test_case_success="false" duration="0.5"/>
+    </TestCase>
+    <TestCase name="crashes" filename="lib1.cc" line="13">
+'''
+
+def test_parse_doctest_xml_report_truncated() -> None:
+    reports = testing.parse_doctest_xml_report(DOCTEST_XML_REPORT, 'cpu-lib1-tests')
+
+    assert reports == {
+        'passes': testing.DoctestCaseReport(did_pass=True, duration=0.25),
+        'fails, with comma': testing.DoctestCaseReport(did_pass=False, duration=0.5),
+    }
+
+def test_parse_doctest_xml_report_ignores_other_suites() -> None:
+    assert testing.parse_doctest_xml_report(DOCTEST_XML_REPORT, 'cuda-lib1-tests') == {}
+
+def test_make_test_case_batches() -> None:
+    cpu = LibTarget('lib1').cpu_test_target
+    cuda = LibTarget('lib1').cuda_test_target
+
+    test_cases: List[Union[CpuTestCaseTarget, CudaTestCaseTarget]] = [
+        cpu.get_test_case('a'),
+        cuda.get_test_case('b'),
+        cpu.get_test_case('c*'),
+        cpu.get_test_case('d'),
+        cpu.get_test_case('e'),
+        cuda.get_test_case('f'),
+    ]
+
+    assert testing.make_test_case_batches(test_cases, 2) == (
+        (cpu.get_test_case('a'), cpu.get_test_case('d')),
+        (cuda.get_test_case('b'), cuda.get_test_case('f')),
+        (cpu.get_test_case('c*'),),
+        (cpu.get_test_case('e'),),
+    )
+
+def test_test_case_batch_run_target_is_scoped_to_suite() -> None:
+    suite = LibTarget('lib1').cuda_test_target
+    run_target = testing.get_test_case_batch_run_target([suite.get_test_case('a'), suite.get_test_case('b, c')])
+
+    assert isinstance(run_target, CudaRunTarget)
+    assert run_target.executable_path == suite.run_target.executable_path
+    assert run_target.args == ('--test-suite=cuda-lib1-tests', '--test-case=a,b\\, c')